@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark for the per test latency of PyGrade.run_test_cases().
+
+   Compares the old poll/sleep wait (timeout/4 sleep quantization), the
+   event driven wait on a new interpreter per test and the fork server.
+
+   Usage: bench/bench_exec_wait.py [ -n <tests> -t <timeout> ]
+"""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import sys
+import os
+
+# helper imports
+import argparse
+import logging
+import shutil
+import subprocess
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from gradepython import PyGrade, PYTHON_EXEC
+from gradeworker import worker_script
+
+
+USER_PROG = '''"""
+Benchmark submission.
+"""
+
+
+def add(num1, num2):
+    """
+    Add two numbers.
+    """
+    return num1 + num2
+'''
+
+SPEC_HEAD = '''codespec:
+  filesizelimit: 1
+  language: 'python'
+  function: 'add'
+  argcount: 2
+  argnames:
+    - num1
+    - num2
+  argtypes:
+    - integer
+    - integer
+  returntype:
+    - integer
+evalspec:
+  grademax: 100
+  testcases:
+    maxhit: 100
+    count: %d
+    timeout: %s
+    input:
+'''
+
+
+class LegacyPyGrade(PyGrade):
+    """PyGrade with the poll/sleep wait we used to have, for reference."""
+
+    def run_exec_test(self, program):
+        p = subprocess.Popen([PYTHON_EXEC, worker_script(), 'exec'],
+                             stdin=subprocess.PIPE, stderr=subprocess.PIPE,
+                             stdout=subprocess.PIPE, close_fds=True)
+        self.send_program(p, program)
+        max_retry = 4
+        sleep_interval = float(self.timeout_interval) / max_retry
+        count = 0
+        while count < max_retry:
+            p.poll()
+            if p.returncode is not None:
+                break
+            time.sleep(sleep_interval)
+            count = count+1
+        if count == max_retry:
+            p.kill()
+            p.wait()
+            return 0, ['fail', 'timeout']
+        result = p.stdout.read()
+        stdoutdata = p.stderr.read()
+        return self.check_exec_result(p.returncode, result, stdoutdata)
+
+
+def write_inputs(workdir, count, timeout):
+    """Write the submission and a spec with 'count' tests."""
+    user_prog = os.path.join(workdir, 'bench.py')
+    with open(user_prog, 'w') as fd:
+        fd.write(USER_PROG)
+
+    config_spec = os.path.join(workdir, 'code_spec.yaml')
+    with open(config_spec, 'w') as fd:
+        fd.write(SPEC_HEAD % (count, timeout))
+        for i in range(count):
+            fd.write('      - [ %d, %d ]\n' % (i, i))
+        fd.write('    output:\n')
+        for i in range(count):
+            fd.write('      - %d\n' % (i + i))
+    return config_spec, user_prog
+
+
+def bench(name, grader):
+    """Time run_test_cases() for the given grader."""
+    if grader.load() < 0:
+        return None
+    start = time.time()
+    retval, testrun = grader.run_test_cases()
+    elapsed = time.time() - start
+    grader.cleanup()
+    passed = len([t for t in testrun if t[0] == 'pass'])
+    print ('%-12s tests %4d  passed %4d  total %8.3fs  per test %8.2fms' %
+           (name, len(testrun), passed, elapsed,
+            1000.0 * elapsed / max(len(testrun), 1)))
+    return elapsed
+
+
+def main(argv):
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description='Per test latency.')
+    parser.add_argument('-n', '--tests', type=int, default=20,
+                        help='Number of test cases')
+    parser.add_argument('-t', '--timeout', type=float, default=2,
+                        help='Test timeout in seconds')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='pygrade_bench_')
+    try:
+        config_spec, user_prog = write_inputs(workdir, args.tests,
+                                              args.timeout)
+        bench('poll/sleep', LegacyPyGrade(config_spec, user_prog,
+                                          logging.ERROR,
+                                          use_forkserver=False))
+        bench('popen', PyGrade(config_spec, user_prog, logging.ERROR,
+                               use_forkserver=False))
+        bench('forkserver', PyGrade(config_spec, user_prog, logging.ERROR))
+    finally:
+        shutil.rmtree(workdir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
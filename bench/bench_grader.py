@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark for the grader end to end, on synthetic specs and
+   submissions.
+
+   Each scenario is a spec with a number of test cases, a list argument
+   of a given size and a timeout. It is graded with gradebatch against
+   submissions that pass, fail, crash on some test cases, hang on some
+   and pass with a lot of pylint messages. The result is JSON, with
+   submissions/sec, the per test overhead and latency percentiles of
+   each grading stage (see Grade.enable_timings()), so two commits can
+   be compared with --compare.
+
+   Usage: bench/bench_grader.py [ -c <submissions per kind>
+                                  -s <name:tests:size:timeout> ...
+                                  -o <result file> --compare <file> ]
+"""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import sys
+import os
+
+# helper imports
+import argparse
+import cStringIO
+import json
+import logging
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import gradebatch
+
+
+# Bump when the result layout changes.
+RESULT_FORMAT = 1
+
+# name, test cases, list size, timeout
+SCENARIOS = ['small:5:10:1',
+             'many:50:10:0.25',
+             'large:10:20000:2']
+
+SUBMISSION_HEAD = '''"""
+Benchmark submission.
+"""
+
+'''
+
+# Submission kinds, the first item of the argument is the test index.
+SUBMISSIONS = {
+    'pass': '''
+def total(items):
+    """
+    Sum of the items.
+    """
+    return sum(items)
+''',
+    'fail': '''
+def total(items):
+    """
+    Sum of the items, off by one.
+    """
+    return sum(items) + 1
+''',
+    'crash': '''import os
+
+
+def total(items):
+    """
+    Sum of the items, the process dies on every other test.
+    """
+    if items[0] % 2:
+        os._exit(1)
+    return sum(items)
+''',
+    'hang': '''
+def total(items):
+    """
+    Sum of the items, never returns on every tenth test.
+    """
+    while items[0] % 10 == 0:
+        pass
+    return sum(items)
+''',
+    'lint': '''import os, sys
+def total(items):
+    a=1;b=2
+    X = 0
+    for I in range(len(items)):
+        X+=items[I]
+    unused=os;unused2=sys
+    if a == 1: return X
+    else: return X
+''',
+}
+
+SPEC = '''codespec:
+  filesizelimit: 1
+  language: 'python'
+  function: 'total'
+  argcount: 1
+  argnames:
+    - items
+  argtypes:
+    - list[integer]
+  returntype:
+    - integer
+evalspec:
+  grademax: 100
+  wellness:
+    convention:
+      maxhit: 10
+      error: 1
+    refactor:
+      maxhit: 20
+      error: 2
+    warning:
+      maxhit: 100
+      error: 10
+    error:
+      maxhit: 100
+      error: 20
+  testcases:
+    maxhit: 100
+    timeout: %s
+    datafile: 'tests.jsonl'
+'''
+
+
+def parse_scenario(text):
+    """'name:tests:size:timeout' as a map."""
+    name, tests, size, timeout = text.split(':')
+    return {'name': name, 'tests': int(tests), 'size': int(size),
+            'timeout': float(timeout)}
+
+
+def write_scenario(workdir, scenario, count):
+    """Write the spec, its test data and 'count' submissions of each kind
+       for the scenario.
+
+    Return values:
+    pair -- spec path, list of (kind, submission path)
+    """
+    path = os.path.join(workdir, scenario['name'])
+    os.makedirs(path)
+    rng = random.Random(scenario['tests'] * 1000003 + scenario['size'])
+    with open(os.path.join(path, 'tests.jsonl'), 'w') as fd:
+        for index in range(scenario['tests']):
+            items = [index] + [rng.randint(-1000, 1000)
+                               for _ in range(scenario['size'] - 1)]
+            fd.write(json.dumps({'input': [items], 'output': sum(items)}) +
+                     '\n')
+    config_spec = os.path.join(path, 'code_spec.yaml')
+    with open(config_spec, 'w') as fd:
+        fd.write(SPEC % scenario['timeout'])
+
+    submissions = []
+    for kind in sorted(SUBMISSIONS):
+        for index in range(count):
+            user_prog = os.path.join(path, '%s_%d.py' % (kind, index))
+            with open(user_prog, 'w') as fd:
+                fd.write(SUBMISSION_HEAD + SUBMISSIONS[kind])
+            submissions.append((kind, user_prog))
+    return config_spec, submissions
+
+
+def percentiles(values):
+    """p50, p90, p99 and max of values, nearest rank."""
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda p: values[min(len(values) - 1,
+                                int(p / 100.0 * len(values)))]
+    return {'p50': pick(50), 'p90': pick(90), 'p99': pick(99),
+            'max': values[-1], 'count': len(values)}
+
+
+def test_overhead(report):
+    """Seconds the test cases of a report took besides the user function,
+       and how many test cases ran.
+    """
+    testrun = report.get('testrun') or []
+    ran = [t for t in testrun if t[0] != 'skip']
+    spent = report['timings'].get('run_test_cases', {}).get('seconds', 0.0)
+    called = sum([t[2].get('time') or 0.0 for t in ran
+                  if len(t) > 2 and t[2]])
+    return spent - called, len(ran)
+
+
+def grade_scenario(scenario, count, workdir, options):
+    """Grade all the submissions of a scenario in one gradebatch run."""
+    config_spec, submissions = write_scenario(workdir, scenario, count)
+    kinds = dict((user_prog, kind) for kind, user_prog in submissions)
+
+    outfile = cStringIO.StringIO()
+    start = time.time()
+    retval, graded = gradebatch.grade_batch(
+        config_spec, [user_prog for _, user_prog in submissions], outfile,
+        options['workers'], options)
+    elapsed = time.time() - start
+    if retval < 0:
+        return None
+
+    results = [json.loads(line) for line in
+               outfile.getvalue().splitlines()]
+    stages = {}
+    by_kind = {}
+    for result in results:
+        kind = by_kind.setdefault(kinds[result['filename']],
+                                  {'grades': [], 'totals': [],
+                                   'overhead': 0.0, 'tests': 0,
+                                   'errors': 0})
+        if result['status'] != 'done':
+            kind['errors'] = kind['errors'] + 1
+            continue
+        report = result['report']
+        for stage, timing in report['timings'].iteritems():
+            stages.setdefault(stage, []).append(timing['seconds'])
+        kind['totals'].append(report['timings']['total']['seconds'])
+        grade = report.get('grade', 'None').split('/')[0]
+        if grade != 'None':
+            kind['grades'].append(float(grade))
+        overhead, tests = test_overhead(report)
+        kind['overhead'] = kind['overhead'] + overhead
+        kind['tests'] = kind['tests'] + tests
+
+    kinds_out = {}
+    for name, kind in by_kind.iteritems():
+        kinds_out[name] = {
+            'count': len(kind['totals']),
+            'errors': kind['errors'],
+            'mean_grade': (sum(kind['grades']) / len(kind['grades'])
+                           if kind['grades'] else None),
+            'per_test_overhead_ms': (1000.0 * kind['overhead'] /
+                                     kind['tests'] if kind['tests']
+                                     else None),
+            'total': percentiles(kind['totals'])}
+
+    result = dict(scenario)
+    result.update({'submissions': graded,
+                   'elapsed': elapsed,
+                   'submissions_per_sec': graded / elapsed,
+                   'kinds': kinds_out,
+                   'stages': dict((stage, percentiles(values))
+                                  for stage, values in stages.iteritems())})
+    return result
+
+
+def git_commit():
+    """Commit of the grader we benchmark, None outside of git."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline, outfile):
+    """Write how result does against baseline, a result of an earlier
+       run, scenario by scenario.
+    """
+    earlier = dict((s['name'], s) for s in baseline.get('scenarios', []))
+    outfile.write('%-10s %14s %14s %8s\n' % ('scenario', 'baseline sub/s',
+                                             'sub/s', 'change'))
+    for scenario in result['scenarios']:
+        base = earlier.get(scenario['name'])
+        if base is None:
+            continue
+        change = scenario['submissions_per_sec'] / \
+            base['submissions_per_sec'] - 1.0
+        outfile.write('%-10s %14.2f %14.2f %+7.1f%%\n' %
+                      (scenario['name'], base['submissions_per_sec'],
+                       scenario['submissions_per_sec'], 100.0 * change))
+
+
+def main(argv):
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description='Grader throughput.')
+    parser.add_argument('-c', '--count', type=int, default=4,
+                        help='Submissions of each kind per scenario')
+    parser.add_argument('-s', '--scenario', action='append',
+                        help='name:tests:size:timeout, default %s' %
+                             ' '.join(SCENARIOS))
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='User programs to grade at a time')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Test cases to run at a time')
+    parser.add_argument('--test-mode', dest='testMode',
+                        choices=['process', 'batched'],
+                        help='Test mode, default that of the spec')
+    parser.add_argument('--no-forkserver', action='store_false',
+                        dest='useForkServer', default=True,
+                        help='Start a new interpreter for every test case')
+    parser.add_argument('-o', '--output', help='Write the JSON result here')
+    parser.add_argument('--compare', help='Earlier JSON result to compare ' +
+                                          'with')
+    args = parser.parse_args(argv)
+
+    testcase_overrides = {}
+    if args.testMode is not None:
+        testcase_overrides['mode'] = args.testMode
+    if args.jobs is not None:
+        testcase_overrides['parallelism'] = args.jobs
+    options = {'log_level': logging.CRITICAL,
+               'use_forkserver': args.useForkServer,
+               'jobs': args.jobs,
+               'testcase_overrides': testcase_overrides,
+               'cache_dir': None,
+               'cache_size': 0,
+               'inprocess_lint': True,
+               'batch_lint': True,
+               'lint_jobs': 1,
+               'overlap_stages': True,
+               'timings': True,
+               'workers': args.workers}
+
+    result = {'format': RESULT_FORMAT,
+              'commit': git_commit(),
+              'python': platform.python_version(),
+              'started': time.time(),
+              'options': {'count': args.count,
+                          'workers': args.workers,
+                          'jobs': args.jobs,
+                          'test_mode': args.testMode,
+                          'forkserver': args.useForkServer},
+              'scenarios': []}
+
+    workdir = tempfile.mkdtemp(prefix='pygrade_bench_')
+    try:
+        for text in args.scenario or SCENARIOS:
+            scenario = grade_scenario(parse_scenario(text), args.count,
+                                      workdir, options)
+            if scenario is None:
+                sys.stderr.write('Scenario %s failed\n' % text)
+                return -1
+            sys.stderr.write('%-10s %4d submissions %8.2fs %8.2f sub/s\n' %
+                             (scenario['name'], scenario['submissions'],
+                              scenario['elapsed'],
+                              scenario['submissions_per_sec']))
+            result['scenarios'].append(scenario)
+    finally:
+        shutil.rmtree(workdir)
+
+    data = json.dumps(result, indent=2, sort_keys=True)
+    if args.output is not None:
+        with open(args.output, 'w') as fd:
+            fd.write(data + '\n')
+    else:
+        print (data)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as fd:
+            # stderr, as the progress lines, stdout may be the result.
+            compare(result, json.load(fd), sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
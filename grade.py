@@ -9,8 +9,15 @@ __version__ = '0.1.1'
 import os
 
 # helper library imports
+import itertools
+import threading
 import yaml
 
+import gradeperf
+import gradespec
+import gradetimings
+from gradecache import ResultCache
+
 
 class Grade:
     """Base implementation for grading code.
@@ -19,7 +26,8 @@ class Grade:
     test code input:
     1. Expects only single function for evaluation
     2. Return value is the only way to get results.
-    3. Function arguments are of primitive types.
+    3. Function arguments are of primitive types, lists, tuples, dicts
+       (nested too) or numpy arrays.
 
     Design:
       Use a yaml file as input that proves spec for evaluating code.
@@ -72,6 +80,25 @@ class Grade:
      maxhit: 100              # Max deduction possible.
      count: 3                 # maxhit/count is each test weight.
      timeout: 0.5             # Max alloted exec time for each test.
+     mode: 'process'          # 'process', a process per test (default)
+                              # 'batched', one process for all tests.
+     parallelism: 1           # Test cases to run at a time.
+     outputlimit: 65536       # Bytes of user output kept per test, the
+                              # first and last half, 0 keeps it all.
+     failfast: false          # Stop running tests once the grade is 0,
+     maxfailures: 0           # or once this many failed (0, no limit).
+                              # The tests not run count as failed.
+     memlimit: 0              # Address space per test process in MB,
+                              # interpreter included (0, no limit).
+     cpulimit: 0              # Cpu seconds per test (0, no limit).
+     compare:                 # How results are compared, optional.
+      abstol: 0.0             # Numbers may differ by abstol + reltol *
+      reltol: 1e-09           # |expected|.
+      unordered: false        # Lists in any order.
+      strict: true            # Returned type has to be the expected type.
+   # datafile: 'tests.jsonl'  # Instead of input/output, read the test
+                              # cases from a data file as the tests run,
+                              # .jsonl, .csv, .npy or .npz.
      input:                   # Test case input, each line is one test run
       - [ 'John Smith', 1 ]
       - [ 'Anna Maria Simpson ', 2]
@@ -80,29 +107,46 @@ class Grade:
       - 1
       - 2
       - 5
+    performance:              # How run time grows with the input size,
+     reference: 'linear'      # optional, see gradeperf.
+     maxhit: 20               # Max deduction possible.
+     error: 10                # Deduction per 'threshold' the growth
+     threshold: 0.5           # exponent is above that of the reference.
+     sizes: [1000, 2000, 4000, 8000]
 
     Following is how we grade the code:
     1. Complile to ensure it works. Scripts that cannot
        compiled will skip this implementation.
     2. Rate code by syntax, lack of comments etc.
     3. Run configured tests and rate based on results.
+    4. Time the function on inputs of increasing size and rate how its
+       run time grows.
 
     """
 
     def __str__(self):
         return "grade"
 
-    def __init__(self, config_spec, user_prog):
+    def __init__(self, config_spec, user_prog, testcase_overrides=None,
+                 compiled_spec=None):
         """Initialize class members.
 
         Parameters:
           config_spec - Yaml spec for how to parse, grade.
           user_prog   - Given user code, has to be a single file.
+          testcase_overrides - map of 'testcases' spec items to use
+                               instead of what the spec has, i.e
+                               command line options.
+          compiled_spec - Already compiled config_spec, saves us loading
+                          the same spec again when grading many programs.
           log_level   - default of DEBUG.
 
         """
         self.config_spec = config_spec
         self.user_prog = user_prog
+        self.compiled_spec = compiled_spec
+        self.spec_cache = None          # ResultCache for compiled specs
+        self.print_report = True        # Print report on console
         self.max_file_size = 10         # 10MB
         self.code_spec = None           # yaml load time
         self.eval_spec = None           # yaml load time
@@ -112,7 +156,7 @@ class Grade:
         self.arg_count = 0
         self.arg_list = []
         self.arg_type_list = []
-        self.return_type = 'bool'
+        self.return_type = ['bool']
         self.wellness_map = {}
         self.wellness_check_list = []
         self.timeout_interval = 1       # in Seconds max run time per test
@@ -120,125 +164,72 @@ class Grade:
         self.test_count = 0             # Default is no tests
         self.testcase_input = {}
         self.testcase_output = {}
+        self.test_source = None         # gradespec.TestVectors
+        self.testcase_overrides = testcase_overrides or {}
+        self.test_mode = 'process'      # one process per test case
+        self.test_jobs = 1              # test cases run at a time
+        self.output_limit = None        # bytes of user output kept
+        self.compare_options = None     # exact comparison
+        self.fail_fast = False          # stop once the grade is decided
+        self.max_failures = 0           # failures that decide, 0 none
+        self.mem_limit = None           # bytes of address space per test
+        self.cpu_limit = None           # cpu seconds per test
+        self.performance = None         # 'performance' map, see gradeperf
+        self.testrun_budget = None      # grade left for the test cases
         self.eval_result = 'none'
         self.grade_report = {}
         self.grade_yaml = {}
+        self.result_cache = None        # ResultCache, if we should use one
+        self.overlap_stages = True      # wellness check runs with tests
+        self.timings = None             # StageTimings, see enable_timings()
         self.logger = None
 
-    def __load_config_spec(self, config_stream):
-        """Loads the available yaml stream and populates
-           the right data-structs
-
-           TODO: This needs more spec checks? i.e reject a spec
-           if something is missing.
+    def apply_spec(self, spec):
+        """Populate our data-structs from the compiled spec.
 
-           We do assume defaults for some items when not given.
+        Keyword arguments:
+        spec -- gradespec.CompiledSpec
         """
-        data_map = None
-        try:
-            data_map = yaml.safe_load(config_stream)
-        except Exception, e:
-            self.logger.error("Loading yaml config_spec [%s]: %s" %
-                              (self.config_spec, str(e)))
-            return -1
-
-        data_dump = yaml.dump(data_map)
-
-        # populate our member variables
-        for k, v in data_map.iteritems():
-            if k == 'codespec':
-                self.code_spec = v
-                continue
-            if k == 'evalspec':
-                self.eval_spec = v
-                continue
-
-        if self.code_spec is None:
-            self.logger.error("conf_spec[%s] does not contain 'codespec'" %
-                              self.config_spec)
-            return -1
-
-        if self.eval_spec is None:
-            self.logger.error("conf_spec[%s] does not contain 'evalspec'" %
-                              self.config_spec)
-            return -1
-
-        if 'language' in self.code_spec.keys():
-            self.language = self.code_spec['language']
-        else:
-            self.logger.error("conf_spec[%s] does not contain 'language'" %
-                              self.config_spec)
-            return -1
-
-        if 'function' in self.code_spec.keys():
-            self.function_name = self.code_spec['function']
-        else:
-            self.logger.error("conf_spec[%s] does not contain 'function'" %
-                              self.config_spec)
-            return -1
-
-        if 'argcount' in self.code_spec.keys():
-            self.arg_count = int(self.code_spec['argcount'])
-
-        if self.arg_count > 0:
-            # Parse only when arg_count > 0
-            if 'argnames' in self.code_spec.keys():
-                self.arg_list = self.code_spec['argnames']
-
-                if 'argtypes' in self.code_spec.keys():
-                    self.arg_type_list = self.code_spec['argtypes']
-
-        if len(self.arg_list) != self.arg_count or \
-           len(self.arg_list) != len(self.arg_type_list):
-            self.logger.error('conf_spec[%s] parse error, arg count mismatch' %
-                              (self.config_spec))
-            return -1
-
-        if 'returntype' in self.code_spec.keys():
-            self.return_type = self.code_spec['returntype']
-
-        if 'filesizelimit' in self.code_spec.keys():
-            self.max_file_size = int(self.code_spec['filesizelimit'])
-
-        if 'grademax' in self.eval_spec.keys():
-            self.max_grade = int(self.eval_spec['grademax'])
-        else:
-            self.max_grade = 100
-
-        if 'wellness' in self.eval_spec.keys():
-            self.wellness_map = self.eval_spec['wellness']
-            for k, v in self.wellness_map.iteritems():
-                self.wellness_check_list.append(k)
-
-        if 'testcases' in self.eval_spec.keys():
-            self.testcase_map = self.eval_spec['testcases']
-            if 'count' in self.testcase_map.keys():
-                self.test_count = int(self.testcase_map['count'])
-
-            if 'timeout' in self.testcase_map.keys():
-                # time allotted per test run in seconds.
-                self.timeout_interval = float(self.testcase_map['timeout'])
-
-            for k, v in self.testcase_map.iteritems():
-                if k == 'input':
-                    self.testcase_input = v
-                    continue
-                if k == 'output':
-                    self.testcase_output = v
-                    continue
-
-            if len(self.testcase_input) != self.test_count or \
-               len(self.testcase_input) != len(self.testcase_output):
-                errStr = 'conf_spec [%s] parse error, i/o mismatch' \
-                         % (self.config_spec)
-                self.logger.error(errStr)
-                return -1
+        self.compiled_spec = spec
+        self.code_spec = spec.code_spec
+        self.language = spec.language
+        self.function_name = spec.function_name
+        self.arg_count = spec.arg_count
+        self.arg_list = spec.arg_list
+        self.arg_type_list = spec.arg_type_list
+        self.return_type = spec.return_type
+        self.max_file_size = spec.max_file_size
+        self.max_grade = spec.max_grade
+        self.wellness_map = spec.wellness_map
+        self.wellness_check_list = list(spec.wellness_check_list)
+        self.testcase_map = spec.testcase_map
+        self.test_count = spec.test_count
+        self.timeout_interval = spec.timeout_interval
+        self.test_mode = spec.test_mode
+        self.test_jobs = spec.test_jobs
+        self.output_limit = spec.output_limit
+        self.compare_options = spec.compare_options
+        self.fail_fast = spec.fail_fast
+        self.max_failures = spec.max_failures
+        self.mem_limit = spec.mem_limit
+        self.cpu_limit = spec.cpu_limit
+        self.performance = spec.performance
+        self.testcase_input = spec.testcase_input
+        self.testcase_output = spec.testcase_output
+        self.test_source = spec.test_source
 
         self.logger.debug("max file size : %s MB" % self.max_file_size)
-        self.logger.debug("yaml input: %s" % data_dump)
-
         return 0
 
+    def test_vectors(self):
+        """Iterate over the test cases, (input, expected output) pairs
+           of the spec types. Test cases of a data file are read as we
+           go.
+        """
+        if self.test_source is not None:
+            return iter(self.test_source)
+        return itertools.izip(self.testcase_input, self.testcase_output)
+
     def __check_user_prog(self):
         """Check the size of user prog, it should not
            exceed the limit in config_spe
@@ -256,6 +247,22 @@ class Grade:
 
         return 0
 
+    def load_spec(self):
+        """Loads the config_spec, unless we were given the compiled spec,
+           and populates the data-structs that specify how to evalulate
+           the code.
+        """
+        spec = self.compiled_spec
+        if spec is None:
+            retval, spec = gradespec.load_spec(self.config_spec,
+                                               self.testcase_overrides,
+                                               self.spec_cache)
+            if retval < 0:
+                self.logger.error(spec)
+                return -1
+
+        return self.apply_spec(spec)
+
     def load(self):
         """Loads both the config_spec and checks for a valid
            user_prog.
@@ -263,22 +270,11 @@ class Grade:
            Populates various members for later.
         """
 
-        # First open the yaml spec.
-        fd = None
-        try:
-            fd = open(self.config_spec, 'r')
-        except Exception, e:
-            self.logger.error("Reading config_spec[%s]: %s" %
-                              (self.config_spec, str(e)))
-            return -1
-
         # Load all the data-structs that specify how to
         # evalulate the code.
-        if self.__load_config_spec(fd) < 0:
-            fd.close()
+        if self.load_spec() < 0:
             return -1
 
-        fd.close()
         fd = None
         # Try opening the user program.
         try:
@@ -319,6 +315,17 @@ class Grade:
              considered as an issue. So deduct the grade accordingly.
         """
 
+        for grade_adj in self.wellness_hits(wellness_data):
+            if self.eval_result > grade_adj:
+                self.eval_result = self.eval_result - grade_adj
+            else:
+                self.eval_result = 0      # 0%!!!!
+
+        return 0
+
+    def wellness_hits(self, wellness_data):
+        """Grade each wellness category takes off, see grade_wellness()."""
+        hits = []
         for k, v in self.wellness_map.iteritems():
             if k in wellness_data.keys():
                 items = wellness_data[k]
@@ -326,13 +333,44 @@ class Grade:
                 errcut = int(v['error'])
 
                 total_errhit = errcut * len(items)
-                grade_adj = min(maxhit, total_errhit)
+                hits.append(min(maxhit, total_errhit))
+        return hits
 
-                if self.eval_result > grade_adj:
-                    self.eval_result = self.eval_result - grade_adj
-                else:
-                    self.eval_result = 0      # 0%!!!!
+    def test_weight(self):
+        """Grade a failed test case takes off, maxhit/count."""
+        maxhit = 100  # Default, Typically test cases failures can
+                      # get you 0%
+        # grab from spec if available.
+        if 'maxhit' in self.testcase_map.keys():
+            maxhit = int(self.testcase_map['maxhit'])
+        return float(maxhit)/self.test_count
 
+    def testrun_decided(self, failed):
+        """With fail_fast, True once the test cases still to run cannot
+           change the grade: the failed ones take it to 0, or there are
+           max_failures of them. Until the wellness check is done we
+           take the grade left to be max_grade, so we never stop too
+           early.
+
+           Parameters:
+           failed - number of test cases that failed so far.
+        """
+        if not self.fail_fast or self.test_count == 0:
+            return False
+        if self.max_failures and failed >= self.max_failures:
+            return True
+        grade = self.testrun_budget
+        if grade is None:
+            grade = self.max_grade
+        return failed * self.test_weight() >= grade
+
+    def skip_test_cases(self, testrun_data):
+        """Mark the test cases that were not run once the grade was
+           decided, see testrun_decided(), as skipped.
+        """
+        while len(testrun_data) < self.test_count:
+            testrun_data.append(['skip', 'SKIPPED - Grade decided by ' +
+                                 'the tests before it \n'])
         return 0
 
     def grade_testrun(self, testrun_data):
@@ -344,19 +382,17 @@ class Grade:
            Example of testrun_data:
              [ 'fail' , 'FAILED - Expected : 1 - Received : 'Tony' ]
              [ 'pass', 'PASSED - Expected : 'Tony - Received 'Tony' ]
+           A derived class may add more items after these two, i.e
+           details on the test run.
 
-           We have three category of test result:
+           We have four category of test result:
            1. 'pass' - Test case passed so do not decrement grade.
            2. 'fail' - Test case failed so decrement grade.
            3. 'none' - Operation issue do not decrement grade.
+           4. 'skip' - Not run since the grade was decided (fail_fast),
+                       decrement grade as for 'fail'.
         """
 
-        maxhit = 100  # Default, Typically test cases failures can
-                      # get you 0%
-        # grab from spec if available.
-        if 'maxhit' in self.testcase_map.keys():
-            maxhit = int(self.testcase_map['maxhit'])
-
         # make sure we got the count right
         if self.test_count == 0:
             self.logger.info('No test cases to evalulate bail!')
@@ -368,10 +404,10 @@ class Grade:
                               (len(testrun_data), self.test_count))
             return -1
 
-        errhit = float(maxhit)/self.test_count
+        errhit = self.test_weight()
 
         for items in testrun_data:
-            if 'fail' == items[0]:
+            if items[0] in ('fail', 'skip'):
                 if self.eval_result > errhit:
                     self.eval_result = self.eval_result - errhit
                 else:
@@ -380,6 +416,30 @@ class Grade:
 
         return 0
 
+    def grade_performance(self, performance_data):
+        """Get the user program performance data and input from config
+           spec. With both the info adjust the grade and return.
+
+           Parameters:
+           performance_data - map with the growth 'exponent' fitted to
+             the run times, see gradeperf, or an 'error' if the function
+             could not be timed at every size, i.e it timed out or
+             raised. That takes off 'maxhit'. The grade taken off is
+             added as 'deduction'.
+        """
+        if performance_data.get('error') is not None:
+            grade_adj = self.performance['maxhit']
+        else:
+            grade_adj = gradeperf.growth_hit(self.performance,
+                                             performance_data['exponent'])
+        performance_data['deduction'] = grade_adj
+
+        if self.eval_result > grade_adj:
+            self.eval_result = self.eval_result - grade_adj
+        else:
+            self.eval_result = 0
+        return 0
+
     def check_function_def(self):
         """Has to be implemented in derived class!!!"""
 
@@ -405,6 +465,18 @@ class Grade:
         self.logger.info("run_test_cases: Not implemented in base class!")
         return -1
 
+    def run_performance_check(self):
+        """Has to be implemented in derived class!!!"""
+
+        self.logger.info("run_performance_check: Not implemented in " +
+                         "base class!")
+        return -1, {}
+
+    def cleanup(self):
+        """Release resources held by the derived class, if any."""
+
+        return 0
+
     def eval_user_prog(self):
         """Implemented here, defines basic structure on how to evaluate
            the code. Free to override in derived class, but if this works
@@ -415,6 +487,12 @@ class Grade:
            2. Run compile check, if fails return and set eval_result to 0
            3. Run code health/wellness check, fails only for operational error
            4. Run test cases, fails only for operation error.
+           5. Run the performance check if the spec has one and there is
+              any grade left, fails only for operation error.
+
+           Steps 3 and 4 do not depend on each other, with overlap_stages
+           the wellness check runs in a thread while the test cases run.
+           The grade is the same either way.
         """
 
         self.eval_result = self.max_grade
@@ -443,7 +521,28 @@ class Grade:
 
         # Check for how well the code is written now that it
         # compiled ok!
-        retval, retdata = self.run_wellness_check()
+        # Once we have the wellness check, the test cases know how much
+        # grade is left for them, see testrun_decided().
+        wellness = []
+
+        def wellness_check():
+            retval, retdata = self.run_wellness_check()
+            if retval == 0:
+                self.testrun_budget = max(
+                    0, self.max_grade - sum(self.wellness_hits(retdata)))
+            wellness.append((retval, retdata))
+
+        self.testrun_budget = None
+        wellness_thread = None
+        if self.overlap_stages:
+            wellness_thread = threading.Thread(target=wellness_check)
+            wellness_thread.start()
+            testrun = self.run_test_cases()
+            wellness_thread.join()
+        else:
+            wellness_check()
+
+        retval, retdata = wellness[0] if wellness else (-1, {})
         self.grade_report['wellness'] = retdata
         if retval < 0:
             # something went wrong
@@ -455,7 +554,9 @@ class Grade:
         # accordingly.
         self.grade_wellness(retdata)
 
-        retval, retdata = self.run_test_cases()
+        if wellness_thread is None:
+            testrun = self.run_test_cases()
+        retval, retdata = testrun
         self.grade_report['testrun'] = retdata
         if retval < 0:
             # something went wrong
@@ -464,6 +565,17 @@ class Grade:
         # Now grade the test run
         self.grade_testrun(retdata)
 
+        if self.performance is None or self.eval_result <= 0:
+            return 0
+
+        retval, retdata = self.run_performance_check()
+        self.grade_report['performance'] = retdata
+        if retval < 0:
+            # something went wrong
+            return -1
+
+        self.grade_performance(retdata)
+
         return 0
 
     def print_line(self, size=50):
@@ -475,7 +587,7 @@ class Grade:
     def compile_grade_report(self):
         """Now that we have details publish them.
            Generate and save the yaml file in test program directory.
-           Print a nice report to console.
+           Print a nice report to console, unless print_report is off.
         """
 
         # Store the grade result in 10/100, 65.7/200 etc
@@ -503,6 +615,9 @@ class Grade:
         with open(fgrade_report, 'w') as outfile:
             outfile.write(yaml.dump(self.grade_yaml, default_flow_style=True))
 
+        if not self.print_report:
+            return 0
+
         self.print_line()
         print ('Report')
         self.print_line()
@@ -544,17 +659,144 @@ class Grade:
                 i = item[1]
                 print("\t%s" % ('-'*42))
                 print("\tTest [%d], %s" % (count, i))
+                if len(item) > 2 and item[2].get('wall') is not None:
+                    usage = item[2]
+                    print("\tUsage : wall %.3fs, cpu %.3fs, peak rss %d KB" %
+                          (usage['wall'], usage['utime'] + usage['stime'],
+                           usage['maxrss']))
                 count = count + 1
             self.print_line()
+        if 'performance' in self.grade_report.keys():
+            status = self.grade_report['performance']
+            print ("Performance")
+            for size, elapsed in zip(status.get('sizes', []),
+                                     status.get('times', [])):
+                print ("\tSize %-10d : %.6fs" % (size, elapsed))
+            if status.get('error') is not None:
+                print ("\tError : %s" % status['error'])
+            else:
+                print ("\tGrowth : n^%.2f (%s), expected n^%.2f (%s)" %
+                       (status['exponent'], status['growth'],
+                        status['expected'], status['reference']))
+            print ("\tDeduction : %s" % status.get('deduction'))
+            self.print_line()
+        if 'timings' in self.grade_report.keys():
+            status = self.grade_report['timings']
+            print ("Timings")
+            for stage in sorted(status):
+                print ("\t%-24s : %9.4fs  %d" % (stage,
+                                                  status[stage]['seconds'],
+                                                  status[stage]['count']))
+            self.print_line()
 
         return 0
 
+    def timed_stages(self):
+        """Methods timed by enable_timings(), derived class should add
+           its own stages.
+        """
+        return ['load', 'load_spec', 'result_cache_key',
+                'load_cached_result', 'check_function_def', 'run_compile_test',
+                'run_wellness_check', 'run_test_cases',
+                'run_performance_check', 'save_cached_result', 'cleanup']
+
+    def enable_timings(self):
+        """Time each grading stage from now on, the durations and
+           counts go in the grade report under 'timings', along with the
+           'total' of run(). Without this nothing is timed at all.
+        """
+        if self.timings is None:
+            self.timings = gradetimings.StageTimings()
+            self.timings.instrument(self, self.timed_stages())
+        return 0
+
+    def cache_key_items(self):
+        """Everything besides the user program and the spec that decides
+           the grade, derived class should add its tool versions.
+        """
+        return ['grade', __version__]
+
+    def result_cache_key(self):
+        """Cache key for the current user program, spec and grader. The
+           user program path is part of it since the report refers to it.
+        """
+        try:
+            with open(self.user_prog, 'rb') as fd:
+                user_data = fd.read()
+        except Exception, e:
+            self.logger.error("Reading user_prog[%s]: %s" %
+                              (self.user_prog, str(e)))
+            return None
+
+        return ResultCache.make_key([os.path.abspath(self.user_prog),
+                                     user_data,
+                                     self.compiled_spec.digest] +
+                                    self.cache_key_items())
+
+    def load_cached_result(self, key):
+        """Look up the grade of this very user program.
+
+        Return values:
+        int -- 0 on a cache hit, -1 otherwise.
+        """
+        if key is None:
+            return -1
+
+        entry = self.result_cache.get(key)
+        if entry is None:
+            return -1
+
+        self.logger.info("Using cached grade for user_prog[%s]" %
+                         self.user_prog)
+        self.eval_result = entry['eval_result']
+        self.grade_report = entry['grade_report']
+        return 0
+
+    def operational_error(self):
+        """True if an operational error, not the user program, had a say
+           in the grade, e.g a test case that could not be run. Such a
+           grade is worth another try.
+        """
+        if type(self.eval_result) is str:
+            return True
+
+        if 'testrun' in self.grade_report.keys():
+            testrun = self.grade_report['testrun']
+            if len(testrun) < self.test_count or \
+               'none' in [items[0] for items in testrun]:
+                return True
+
+        return False
+
+    def save_cached_result(self, key):
+        """Cache the grade, unless an operational error was involved
+           since that is worth another try.
+        """
+        if key is None or self.operational_error():
+            return -1
+
+        return self.result_cache.put(key, {'eval_result': self.eval_result,
+                                           'grade_report': self.grade_report})
+
     def run(self):
         """Main run method needs to be called to load, eval and report."""
 
+        if self.timings is not None:
+            start = gradetimings.monotonic()
         if self.load() == 0:
-            # Run evalution only if we could load properly.
-            self.eval_user_prog()
+            # Run evalution only if we could load properly, and have not
+            # graded the very same thing before.
+            key = None
+            if self.result_cache is not None:
+                key = self.result_cache_key()
+            if key is None or self.load_cached_result(key) < 0:
+                self.eval_user_prog()
+                if key is not None:
+                    self.save_cached_result(key)
+        self.cleanup()
+        if self.timings is not None:
+            self.timings.add('total', gradetimings.monotonic() - start)
+            self.grade_report['timings'] = self.timings.report()
         self.compile_grade_report()
 
         return 0
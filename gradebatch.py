@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Module for grading a batch of python programs against one spec."""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import sys
+import os
+
+# helper imports
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import threading
+import time
+import Queue
+
+import gradelint
+import gradespec
+from gradepython import PyGrade, PYTHON_EXEC
+from gradeworker import ForkServerPool
+from gradecache import ResultCache, CACHE_DIR, CACHE_MAX_BYTES, \
+    result_cache_dir, spec_cache_dir
+
+
+# Per worker process state, set up once by init_worker().
+WORKER = {}
+
+# User programs linted in one pylint run, see lint_tasks().
+LINT_CHUNK = 16
+
+
+def find_submissions(directory=None, pattern=None, manifest=None):
+    """Collect the user programs to grade.
+
+    Keyword arguments:
+    directory -- grade every '*.py' in this directory.
+    pattern -- grade every file matching this glob.
+    manifest -- file with one user program path per line, relative
+                paths are relative to the manifest.
+
+    Return values:
+    list -- user program paths, in a stable order.
+    """
+    found = []
+    if directory is not None:
+        found.extend(sorted(glob.glob(os.path.join(directory, '*.py'))))
+    if pattern is not None:
+        found.extend(sorted(glob.glob(pattern)))
+    if manifest is not None:
+        mpath = os.path.dirname(manifest)
+        with open(manifest, 'r') as fd:
+            for line in fd:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                found.append(os.path.join(mpath, line))
+
+    # Skip what we generate next to the user programs.
+    submissions = []
+    for user_prog in found:
+        if os.path.basename(user_prog).startswith('exec_'):
+            continue
+        if user_prog not in submissions:
+            submissions.append(user_prog)
+    return submissions
+
+
+def needs_grading(user_prog, compiled_spec, result_cache):
+    """True unless the result cache already has the grade of user_prog."""
+    if result_cache is None:
+        return True
+    py_grade = PyGrade(None, user_prog, logging.WARN,
+                       compiled_spec=compiled_spec)
+    py_grade.load_spec()
+    key = py_grade.result_cache_key()
+    return key is None or result_cache.get(key) is None
+
+
+def lint_tasks(submissions, compiled_spec, options):
+    """Grading tasks, (user program, its pylint output), for all the
+       submissions. The programs are linted LINT_CHUNK at a time, each
+       chunk in one pylint run, in a thread that lints the next chunk
+       while the programs of the previous ones are being graded.
+       Programs already in the result cache are not linted.
+    """
+    result_cache = None
+    if options['cache_dir'] is not None:
+        result_cache = ResultCache(result_cache_dir(options['cache_dir']),
+                                   options['cache_size'])
+    chunks = Queue.Queue(2)
+
+    def linter():
+        try:
+            for start in range(0, len(submissions), LINT_CHUNK):
+                chunk = submissions[start:start + LINT_CHUNK]
+                try:
+                    paths = [user_prog for user_prog in chunk
+                             if needs_grading(user_prog, compiled_spec,
+                                              result_cache)]
+                    outputs = gradelint.lint_files(paths,
+                                                   options['lint_jobs'],
+                                                   options['inprocess_lint'])
+                except Exception:
+                    # The graders lint these on their own then.
+                    outputs = {}
+                chunks.put((chunk, outputs))
+        finally:
+            chunks.put(None)
+
+    thread = threading.Thread(target=linter)
+    thread.daemon = True
+    thread.start()
+    for chunk, outputs in iter(chunks.get, None):
+        for user_prog in chunk:
+            yield user_prog, outputs.get(user_prog)
+
+
+def init_worker(config_spec, compiled_spec, options):
+    """Worker process initializer, keeps the compiled spec and a warm
+       fork server pool around for all the programs this worker grades.
+    """
+    WORKER['config_spec'] = config_spec
+    WORKER['compiled_spec'] = compiled_spec
+    WORKER['options'] = options
+    WORKER['exec_pool'] = None
+    WORKER['result_cache'] = None
+    if options['cache_dir'] is not None:
+        WORKER['result_cache'] = ResultCache(
+            result_cache_dir(options['cache_dir']), options['cache_size'])
+    if options['use_forkserver']:
+        try:
+            WORKER['exec_pool'] = ForkServerPool(
+                PYTHON_EXEC, max(options['jobs'] or 1,
+                                 compiled_spec.test_jobs))
+        except Exception:
+            WORKER['exec_pool'] = None
+
+
+def grade_one(task):
+    """Grade a single user program in this worker.
+
+    Keyword arguments:
+    task -- pair, user program and its pylint output or None.
+
+    Return values:
+    map -- result record for the aggregated result stream.
+    """
+    user_prog, lint_output = task
+    options = WORKER['options']
+    result = {'filename': user_prog}
+    try:
+        py_grade = PyGrade(WORKER['config_spec'], user_prog,
+                           options['log_level'],
+                           use_forkserver=options['use_forkserver'],
+                           exec_pool=WORKER['exec_pool'],
+                           testcase_overrides=options['testcase_overrides'],
+                           compiled_spec=WORKER['compiled_spec'],
+                           result_cache=WORKER['result_cache'],
+                           use_inprocess_lint=options['inprocess_lint'],
+                           lint_output=lint_output)
+        py_grade.print_report = False
+        py_grade.overlap_stages = options['overlap_stages']
+        if options['timings']:
+            py_grade.enable_timings()
+        py_grade.run()
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+        return result
+
+    result['status'] = 'done'
+    result['grade'] = py_grade.grade_report.get('grade')
+    result['result'] = py_grade.eval_result
+    result['report'] = py_grade.grade_report
+    return result
+
+
+def dump_result(result):
+    """Serialize a result record as a single JSON line, user output may
+       not be valid utf-8.
+    """
+    try:
+        return json.dumps(result, sort_keys=True)
+    except UnicodeDecodeError:
+        return json.dumps(result, sort_keys=True, encoding='latin-1')
+
+
+def grade_batch(config_spec, submissions, outfile, workers, options):
+    """Grade all the submissions, results are written to outfile as they
+       complete, one JSON line per user program. The grade_report_*.yaml
+       of each user program is written as usual.
+
+    Keyword arguments:
+    config_spec -- yaml spec, loaded once for the whole batch.
+    submissions -- user programs to grade.
+    outfile -- file object for the aggregated result stream.
+    workers -- number of programs to grade at a time.
+    options -- grader options, see main().
+
+    Return values:
+    pair -- -1/0, number of programs graded
+    """
+    spec_cache = None
+    if options['cache_dir'] is not None:
+        spec_cache = ResultCache(spec_cache_dir(options['cache_dir']),
+                                 CACHE_MAX_BYTES)
+    retval, spec = gradespec.load_spec(config_spec,
+                                       options['testcase_overrides'],
+                                       spec_cache)
+    if retval < 0:
+        sys.stderr.write(spec + '\n')
+        return -1, 0
+
+    if options['batch_lint']:
+        tasks = lint_tasks(submissions, spec, options)
+    else:
+        tasks = ((user_prog, None) for user_prog in submissions)
+
+    initargs = (config_spec, spec, options)
+    count = 0
+    if workers <= 1:
+        init_worker(*initargs)
+        results = (grade_one(task) for task in tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers, init_worker, initargs)
+        results = pool.imap_unordered(grade_one, tasks)
+
+    try:
+        for result in results:
+            outfile.write(dump_result(result) + '\n')
+            outfile.flush()
+            count = count + 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        elif WORKER.get('exec_pool') is not None:
+            WORKER['exec_pool'].close()
+
+    return 0, count
+
+
+def main(argv):
+    """Parse the args and grade the whole batch.
+
+    Keyword arguments:
+    argv - user args.
+    """
+    usage = '%(prog)s -s <yaml spec> ' + \
+            '( -d <dir> | -g <glob> | -m <manifest> ) ' + \
+            '[ -w <workers> -o <results file> ]'
+    description = 'Python function grader tool, batch mode.'
+    parser = argparse.ArgumentParser(usage=usage, description=description)
+
+    parser.add_argument('-s', '--spec', action='store',
+                        dest='configSpecFileName',
+                        help='Input spec for valuating user programs',
+                        metavar="configSpecFileName", required=True)
+
+    parser.add_argument('-d', '--dir', action='store', dest='directory',
+                        help='Grade every .py file in this directory')
+
+    parser.add_argument('-g', '--glob', action='store', dest='pattern',
+                        help='Grade every file matching this pattern')
+
+    parser.add_argument('-m', '--manifest', action='store', dest='manifest',
+                        help='File listing the user programs, one per line')
+
+    parser.add_argument('-w', '--workers', action='store', type=int,
+                        dest='workers', default=multiprocessing.cpu_count(),
+                        help='User programs to grade at a time')
+
+    parser.add_argument('-o', '--output', action='store', dest='output',
+                        help='Write the result stream here, default stdout')
+
+    parser.add_argument('-j', '--jobs', action='store', type=int,
+                        dest='jobs',
+                        help='Number of test cases to run at a time')
+
+    parser.add_argument('--test-mode', action='store',
+                        dest='testMode', choices=['process', 'batched'],
+                        help='Run each test case in its own process ' +
+                             '(default) or all of them in one process')
+
+    parser.add_argument('--fail-fast', action='store_true',
+                        dest='failFast', default=False,
+                        help='Stop running test cases once the grade is ' +
+                             'decided, the rest count as failed')
+
+    parser.add_argument('--max-failures', action='store', type=int,
+                        dest='maxFailures',
+                        help='Stop running test cases after this many ' +
+                             'failed, the rest count as failed')
+
+    parser.add_argument('--output-limit', action='store', type=int,
+                        dest='outputLimit',
+                        help='Bytes of user output to keep per test case, ' +
+                             '0 keeps it all')
+
+    parser.add_argument('--no-forkserver', action='store_false',
+                        dest='useForkServer', default=True,
+                        help='Start a new interpreter for every test case')
+
+    parser.add_argument('--no-cache', action='store_false',
+                        dest='useCache', default=True,
+                        help='Always grade, do not use the result cache')
+
+    parser.add_argument('--cache-dir', action='store', dest='cacheDir',
+                        default=CACHE_DIR,
+                        help='Cache directory, default %(default)s')
+
+    parser.add_argument('--cache-size', action='store', type=int,
+                        dest='cacheSize', default=256,
+                        help='Result cache size limit in MB')
+
+    parser.add_argument('--lint-subprocess', action='store_false',
+                        dest='inprocessLint', default=True,
+                        help='Run pylint in a new process, not in-process')
+
+    parser.add_argument('--lint-jobs', action='store', type=int,
+                        dest='lintJobs', default=1,
+                        help='Number of pylint processes to lint with')
+
+    parser.add_argument('--lint-each', action='store_false',
+                        dest='batchLint', default=True,
+                        help='Lint each user program on its own instead ' +
+                             'of many of them in one pylint run')
+
+    parser.add_argument('--no-overlap', action='store_false',
+                        dest='overlapStages', default=True,
+                        help='Run the wellness check and then the test ' +
+                             'cases instead of both at once')
+
+    parser.add_argument('--timings', action='store_true',
+                        dest='timings', default=False,
+                        help='Time each grading stage, reported under ' +
+                             "'timings' in the grade report")
+
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit:
+        return -1
+
+    submissions = find_submissions(args.directory, args.pattern,
+                                   args.manifest)
+    if not submissions:
+        sys.stderr.write('No user programs to grade\n')
+        return -1
+
+    testcase_overrides = {}
+    if args.testMode is not None:
+        testcase_overrides['mode'] = args.testMode
+    if args.jobs is not None:
+        testcase_overrides['parallelism'] = args.jobs
+    if args.outputLimit is not None:
+        testcase_overrides['outputlimit'] = args.outputLimit
+    if args.failFast:
+        testcase_overrides['failfast'] = True
+    if args.maxFailures is not None:
+        testcase_overrides['maxfailures'] = args.maxFailures
+
+    options = {'log_level': logging.WARN,
+               'use_forkserver': args.useForkServer,
+               'jobs': args.jobs,
+               'testcase_overrides': testcase_overrides,
+               'cache_dir': args.cacheDir if args.useCache else None,
+               'cache_size': args.cacheSize * 1024 * 1024,
+               'inprocess_lint': args.inprocessLint,
+               'batch_lint': args.batchLint,
+               'lint_jobs': args.lintJobs,
+               'overlap_stages': args.overlapStages,
+               'timings': args.timings}
+
+    outfile = sys.stdout
+    if args.output is not None:
+        outfile = open(args.output, 'w')
+
+    start = time.time()
+    try:
+        retval, count = grade_batch(args.configSpecFileName, submissions,
+                                    outfile, args.workers, options)
+    finally:
+        if outfile is not sys.stdout:
+            outfile.close()
+
+    sys.stderr.write('Graded %d of %d user programs in %.2f seconds\n' %
+                     (count, len(submissions), time.time() - start))
+    return retval
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""Module for the on-disk cache of grade results."""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import os
+
+# helper imports
+import cPickle
+import errno
+import hashlib
+import tempfile
+
+
+# Default cache location and size, grade results and compiled specs
+# live in their own sub directory.
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pygrade')
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def result_cache_dir(cache_dir):
+    """Directory for the grade results under cache_dir."""
+    return os.path.join(cache_dir, 'results')
+
+
+def spec_cache_dir(cache_dir):
+    """Directory for the compiled specs under cache_dir."""
+    return os.path.join(cache_dir, 'specs')
+
+
+class ResultCache(object):
+    """Content addressed cache of grade results.
+
+       Each entry is a file named by the hash of everything that decides
+       the grade, so an entry never needs to be invalidated, it simply
+       stops being looked up. Entries are touched on every hit and the
+       least recently used ones are evicted once the cache grows past
+       its size limit.
+    """
+
+    def __str__(self):
+        return "ResultCache"
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        """Init method.
+
+        Keyword arguments:
+        cache_dir -- directory holding the entries, created on demand.
+        max_bytes -- evict entries once the cache is bigger than this.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.known_bytes = None         # cache size as of our last scan
+
+    @staticmethod
+    def make_key(items):
+        """Hash the given list of strings into a cache key."""
+        h = hashlib.sha256()
+        for item in items:
+            h.update('%d:' % len(item))
+            h.update(item)
+        return h.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """Returns the cached entry or None on a miss."""
+        path = self.__path(key)
+        try:
+            with open(path, 'rb') as fd:
+                entry = cPickle.load(fd)
+        except (IOError, OSError):
+            return None
+        except Exception:
+            # Corrupt entry, it will be replaced on the next put().
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        """Store the entry, written to a temporary file first so readers
+           never see a partial entry.
+
+        Return values:
+        int -- -1/0
+        """
+        path = self.__path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                return -1
+
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                            prefix='.tmp')
+            with os.fdopen(fd, 'wb') as outfile:
+                cPickle.dump(entry, outfile, cPickle.HIGHEST_PROTOCOL)
+            size = os.stat(tmp_path).st_size
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            return -1
+
+        # Only scan the cache when we may have gone past the limit.
+        if self.known_bytes is None or \
+           self.known_bytes + size > self.max_bytes:
+            self.evict()
+        else:
+            self.known_bytes = self.known_bytes + size
+        return 0
+
+    def evict(self):
+        """Remove the least recently used entries until we are under
+           max_bytes.
+        """
+        entries = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for fname in filenames:
+                path = os.path.join(dirpath, fname)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total = total + st.st_size
+
+        self.known_bytes = total
+        if total <= self.max_bytes:
+            return 0
+
+        entries.sort()
+        for mtime, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total = total - size
+            if total <= self.max_bytes:
+                break
+        self.known_bytes = total
+        return 0
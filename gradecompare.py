@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+"""Module for comparing the value a user function returned with the
+   expected one, runs inside the test process.
+
+   How values are compared is set by the 'compare' map of 'testcases':
+     abstol    -- absolute tolerance for numbers, default 0.
+     reltol    -- relative tolerance for numbers, default 0. A number
+                  matches if |received - expected| <= abstol + reltol *
+                  |expected|, the same as numpy.allclose().
+     unordered -- lists, tuples and arrays match in any order, default
+                  false.
+     strict    -- the returned type has to be the expected type, default
+                  true.
+   Without it values have to be equal. numpy arrays, and long lists of
+   numbers when there is a tolerance, are compared by numpy in one go.
+"""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import sys
+
+
+# 'compare' options and their defaults, exact comparison.
+COMPARE_DEFAULTS = {'abstol': 0.0,
+                    'reltol': 0.0,
+                    'unordered': False,
+                    'strict': True}
+
+# Lists of numbers at least this long are compared by numpy.
+VECTOR_MIN_ITEMS = 64
+
+
+def is_ndarray(value):
+    """True for a numpy array, without importing numpy."""
+    return type(value).__module__ == 'numpy' and \
+        type(value).__name__ in ('ndarray', 'memmap')
+
+
+def is_number(value):
+    """True for a number a tolerance applies to."""
+    return isinstance(value, (int, long, float, complex)) and \
+        not isinstance(value, bool)
+
+
+def numeric_array(value):
+    """value as a numpy array of numbers, None if it is not one or we do
+       not have numpy.
+    """
+    if is_ndarray(value):
+        return value if value.dtype.kind in 'biufc' else None
+    try:
+        import numpy
+        array = numpy.asarray(value)
+    except Exception:
+        return None
+    if array.dtype.kind not in 'biufc':
+        return None
+    return array
+
+
+def tolerant(options):
+    """True if options allow numbers to differ."""
+    return bool(options['abstol'] or options['reltol'])
+
+
+def arrays_match(received, expected, options):
+    """values_match() for two numpy arrays."""
+    import numpy
+
+    if received.shape != expected.shape:
+        return False
+    if options['unordered']:
+        received = numpy.sort(received, axis=None)
+        expected = numpy.sort(expected, axis=None)
+    if tolerant(options) and received.dtype.kind in 'biufc' and \
+       expected.dtype.kind in 'biufc':
+        return bool(numpy.allclose(received, expected,
+                                   rtol=options['reltol'],
+                                   atol=options['abstol']))
+    return bool(numpy.array_equal(received, expected))
+
+
+def values_match(received, expected, options=None):
+    """True if received matches expected, see the module docstring for
+       the options. options None compares exactly, also numpy arrays on
+       their own or in lists, tuples and dicts, where == does not give a
+       truth value.
+    """
+    options = options or COMPARE_DEFAULTS
+
+    if is_ndarray(expected):
+        if not is_ndarray(received):
+            if options['strict']:
+                return False
+            import numpy
+            received = numpy.asarray(received)
+        return arrays_match(received, expected, options)
+
+    if isinstance(expected, (list, tuple)):
+        sequence = type(expected) if options['strict'] else (list, tuple)
+        if not isinstance(received, sequence) or \
+           len(received) != len(expected):
+            return False
+        if options['unordered']:
+            received = sorted(received)
+            expected = sorted(expected)
+        if tolerant(options):
+            if len(expected) >= VECTOR_MIN_ITEMS:
+                r_array = numeric_array(received)
+                e_array = numeric_array(expected)
+                if r_array is not None and e_array is not None:
+                    return arrays_match(r_array, e_array, options)
+        else:
+            # Plain == first, it is much faster on big lists.
+            try:
+                if received == expected:
+                    return True
+            except ValueError:
+                pass
+            # Decided unless a numpy array or, not strict, a tuple for a
+            # list (at any depth) made == False.
+            if options['strict'] and 'numpy' not in sys.modules:
+                return False
+        return all(values_match(r, e, options)
+                   for r, e in zip(received, expected))
+
+    if isinstance(expected, dict):
+        if not isinstance(received, dict) or set(received) != set(expected):
+            return False
+        return all(values_match(received[k], expected[k], options)
+                   for k in expected)
+
+    if tolerant(options) and is_number(expected) and is_number(received):
+        return abs(received - expected) <= \
+            options['abstol'] + options['reltol'] * abs(expected)
+
+    try:
+        return bool(received == expected)
+    except ValueError:
+        return False
+
+
+def format_index(index):
+    """'[1]', '[1, 2]' or "['key']" for the report."""
+    return '[%s]' % ', '.join([repr(i) for i in index])
+
+
+def find_mismatch(received, expected, options=None):
+    """Where received does not match expected, for the report.
+
+    Return values:
+    map -- mismatch   -- first index that differs, e.g '[3]', None if
+                         the lengths or shapes differ.
+           mismatches -- how many items differ.
+           maxerror   -- largest difference of the numbers.
+           Empty if neither is a list, tuple, dict or array.
+    """
+    options = options or COMPARE_DEFAULTS
+
+    if is_number(expected) and is_number(received):
+        return {'maxerror': float(abs(received - expected))}
+
+    if is_ndarray(expected) or (isinstance(expected, (list, tuple)) and
+                                len(expected) >= VECTOR_MIN_ITEMS):
+        r_array = numeric_array(received)
+        e_array = numeric_array(expected)
+        if r_array is not None and e_array is not None:
+            return find_array_mismatch(r_array, e_array, options)
+
+    if isinstance(expected, (list, tuple)) and \
+       isinstance(received, (list, tuple)):
+        if options['unordered']:
+            received = sorted(received)
+            expected = sorted(expected)
+        size = min(len(received), len(expected))
+        bad = [i for i in xrange(size)
+               if not values_match(received[i], expected[i], options)]
+        info = {'mismatches': len(bad) + abs(len(received) - len(expected))}
+        if bad:
+            info['mismatch'] = format_index([bad[0]])
+        elif len(received) != len(expected):
+            info['mismatch'] = format_index([size])
+        return info
+
+    if isinstance(expected, dict) and isinstance(received, dict):
+        bad = [k for k in sorted(set(received) | set(expected))
+               if k not in received or k not in expected or
+               not values_match(received[k], expected[k], options)]
+        info = {'mismatches': len(bad)}
+        if bad:
+            info['mismatch'] = format_index([bad[0]])
+        return info
+
+    return {}
+
+
+def find_array_mismatch(received, expected, options):
+    """find_mismatch() for two numpy arrays, in one go."""
+    import numpy
+
+    if received.shape != expected.shape:
+        return {'mismatch': None,
+                'mismatches': abs(received.size - expected.size)}
+    if options['unordered']:
+        received = numpy.sort(received, axis=None)
+        expected = numpy.sort(expected, axis=None)
+    if tolerant(options):
+        bad = ~numpy.isclose(received, expected, rtol=options['reltol'],
+                             atol=options['abstol'])
+    else:
+        bad = received != expected
+    bad = numpy.asarray(bad)
+
+    info = {'mismatches': int(bad.sum())}
+    if info['mismatches']:
+        index = numpy.unravel_index(int(numpy.argmax(bad)), bad.shape)
+        info['mismatch'] = format_index([int(i) for i in index])
+    if received.size and 'b' not in (received.dtype.kind,
+                                     expected.dtype.kind):
+        info['maxerror'] = float(numpy.abs(received - expected).max())
+    return info
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""Module for the test harness that runs inside the test process.
+
+   A test case is plain data, (user module, function name, arguments,
+   expected value), the harness calls the user function with it and
+   reports the result as a record (a map) through the given callable,
+   apart from anything the user code prints:
+     status    -- 'pass' or 'fail'
+     message   -- 'PASSED - Expected : <expected> - Received : <received>'
+                  or the matching 'FAILED - ...' text.
+     expected  -- repr of the expected value.
+     received  -- repr of the returned value, None if nothing returned.
+     exception -- type name of the exception raised, or None.
+     time      -- wall clock seconds the call took.
+     cpu       -- cpu seconds the call took.
+     mismatch, mismatches, maxerror -- where a wrong value differs, see
+                  gradecompare.find_mismatch().
+   The exit status is 0 when the test passed.
+"""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import sys
+import os
+
+# helper imports
+import time
+import traceback
+
+import gradecompare
+
+
+# Longest repr we report of a value.
+REPR_LIMIT = 1024
+
+
+def short_repr(value):
+    """repr() of value, cut at REPR_LIMIT."""
+    text = repr(value)
+    if len(text) > REPR_LIMIT:
+        text = text[:REPR_LIMIT] + '...'
+    return text
+
+
+def short_str(value):
+    """str() of value (unicode stays unicode), cut at REPR_LIMIT."""
+    text = value if isinstance(value, unicode) else str(value)
+    if len(text) > REPR_LIMIT:
+        text = text[:REPR_LIMIT] + '...'
+    return text
+
+
+def cpu_time():
+    """User plus system cpu seconds of this process."""
+    times = os.times()
+    return times[0] + times[1]
+
+
+def run_test(import_name, function_name, args, expected, compare, report):
+    """Run one test case, always ends with sys.exit().
+
+    Keyword arguments:
+    import_name -- user module name.
+    function_name -- user function to call.
+    args -- tuple of arguments, already of the spec types (lists, dicts,
+            numpy arrays ...), or None when the function takes none.
+    expected -- expected return value, of the spec return type.
+    compare -- 'compare' options, see gradecompare, None to compare
+               exactly.
+    report -- callable, called with the result record.
+    """
+    # importing user code
+    module = __import__(import_name)
+
+    record = {'status': 'fail',
+              'expected': short_repr(expected),
+              'received': None,
+              'exception': None}
+    start = time.time()
+    start_cpu = cpu_time()
+    try:
+        return_val = getattr(module, function_name)(*(args or ()))
+    except Exception:
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        record['time'] = time.time() - start
+        record['cpu'] = cpu_time() - start_cpu
+        record['exception'] = exc_type.__name__
+        record['message'] = "FAILED - STACKTRACE: \n" + \
+            ''.join(traceback.format_exception(exc_type, exc_value,
+                                               exc_traceback, limit=2))
+        report(record)
+        sys.exit(1)
+    record['time'] = time.time() - start
+    record['cpu'] = cpu_time() - start_cpu
+    record['received'] = short_repr(return_val)
+
+    return_data = expected
+    options = compare or gradecompare.COMPARE_DEFAULTS
+    if options['strict'] and type(return_val) is not type(return_data):
+        record['message'] = "FAILED - Expected Return Type: %s" \
+            " - Received Return Type : %s \n" % \
+            (type(return_data), type(return_val))
+        report(record)
+        sys.exit(1)
+    if not gradecompare.values_match(return_val, return_data, options):
+        record.update(gradecompare.find_mismatch(return_val, return_data,
+                                                 options))
+        where = ''
+        if record.get('mismatch') is not None:
+            where = '- First mismatch at %s, %d differ ' % \
+                (record['mismatch'], record['mismatches'])
+        record['message'] = "FAILED - Expected : %s - Received : %s %s\n" % \
+            (short_str(return_data), short_str(return_val), where)
+        report(record)
+        sys.exit(1)
+
+    record['status'] = 'pass'
+    record['message'] = "PASSED - Expected : %s - Received : %s \n" % \
+        (short_str(return_data), short_str(return_val))
+    report(record)
+    sys.exit(0)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""Module for running pylint in-process with a long-lived linter."""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import os
+
+# helper imports
+import subprocess
+import threading
+import StringIO
+
+
+# Messages that need more than one module to fire. They are turned off so
+# that a program linted along with others in one run gets the very same
+# messages as when it is linted alone.
+CROSS_MODULE_MESSAGES = ('duplicate-code', 'cyclic-import')
+
+# Per process linter, see get_linter().
+LINTER = []
+LINTER_LOCK = threading.Lock()
+
+
+class PylintLinter(object):
+    """Keeps one pylint linter around and lints files through the pylint
+       API, so we pay for importing pylint/astroid and setting up the
+       checkers only once per process.
+
+       The linter is set up the way 'pylint -f parseable -r n' sets it up
+       (same rc file lookup and defaults), and its output is the same
+       parseable text.
+    """
+
+    def __str__(self):
+        return "PylintLinter"
+
+    def __init__(self):
+        """Set up the linter, raises ImportError if pylint is missing."""
+        from pylint import lint
+        from pylint.reporters.text import ParseableTextReporter
+
+        self.lint = lint
+        self.lock = threading.Lock()
+        self.linter = lint.PyLinter()
+        self.linter.load_default_plugins()
+        self.linter.disable('I')
+        try:
+            self.linter.enable('c-extension-no-member')
+        except Exception:
+            pass
+        self.linter.read_config_file()
+        self.linter.load_config_file()
+        self.linter.load_command_line_configuration(['-r', 'n'])
+        for msgid in CROSS_MODULE_MESSAGES:
+            self.linter.disable(msgid)
+        self.reporter = ParseableTextReporter()
+        self.linter.set_reporter(self.reporter)
+
+    def forget(self, paths):
+        """Drop what astroid has cached about the given files, a file may
+           have changed since we last saw it.
+        """
+        from astroid import MANAGER
+
+        abspaths = set([os.path.abspath(p) for p in paths])
+        for modname, module in MANAGER.astroid_cache.items():
+            mfile = getattr(module, 'file', None)
+            if mfile is not None and os.path.abspath(mfile) in abspaths:
+                del MANAGER.astroid_cache[modname]
+
+    def run(self, paths):
+        """Lint the given files.
+
+        Keyword arguments:
+        paths -- files to lint.
+
+        Return values:
+        pair -- parseable pylint output, pylint exit status
+        """
+        with self.lock:
+            self.forget(paths)
+            output = StringIO.StringIO()
+            self.reporter.set_output(output)
+            self.linter.msg_status = 0
+            try:
+                with self.lint.fix_import_path(paths):
+                    self.linter.check(paths)
+            finally:
+                self.reporter.set_output(None)
+            return output.getvalue(), self.linter.msg_status
+
+
+def get_linter():
+    """Returns this process' PylintLinter, set up on first use. Returns
+       None if pylint cannot be used in-process.
+    """
+    with LINTER_LOCK:
+        if not LINTER:
+            try:
+                LINTER.append(PylintLinter())
+            except Exception:
+                LINTER.append(None)
+        return LINTER[0]
+
+
+def split_output(output, paths):
+    """Split parseable pylint output of many files into the output of
+       each file, each line starts with the path of its file.
+
+    Return values:
+    map -- path to its pylint output
+    """
+    outputs = dict((path, []) for path in paths)
+    for line in output.split('\n'):
+        path = line.split(':', 1)[0]
+        if path in outputs:
+            outputs[path].append(line)
+    return dict((path, '\n'.join(lines))
+                for path, lines in outputs.iteritems())
+
+
+def lint_files(paths, jobs=1, inprocess=True):
+    """Lint all the given files in one pylint run.
+
+    Keyword arguments:
+    paths -- files to lint.
+    jobs -- number of pylint processes to lint with, as 'pylint -j'.
+    inprocess -- use this process' linter if we can, else the pylint
+                 command. With jobs > 1 we always use the command, each
+                 of its processes sets up a linter of its own anyway.
+
+    Return values:
+    map -- path to its pylint output, as if pylint ran on it alone.
+           Empty if we could not run pylint.
+    """
+    if not paths:
+        return {}
+
+    linter = None
+    if inprocess and jobs == 1:
+        linter = get_linter()
+    if linter is not None:
+        try:
+            output = linter.run(paths)[0]
+            return split_output(output, paths)
+        except Exception:
+            pass
+
+    args = ['pylint', '-f', 'parseable', '-r', 'n', '-j', str(jobs),
+            '--disable=' + ','.join(CROSS_MODULE_MESSAGES)] + list(paths)
+    try:
+        output = subprocess.check_output(args, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        output = str(e.output)
+    except OSError:
+        # No pylint, every program gets linted on its own then.
+        return {}
+    return split_output(output, paths)
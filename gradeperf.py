@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""Module for grading how the run time of the user function grows with
+   the size of its input, so a quadratic solution that passes the test
+   cases does not get the grade of a linear one.
+
+   Set by the 'performance' map of 'evalspec':
+     reference -- expected growth, 'constant', 'logarithmic', 'linear',
+                  'linearithmic', 'quadratic', 'cubic' or k for n^k.
+     maxhit    -- max deduction, default 20.
+     error     -- deduction for every 'threshold' the growth exponent
+                  is above that of the reference, rounded, default
+                  maxhit.
+     threshold -- see error, less than that above is no deduction,
+                  default 0.5.
+     sizes     -- input sizes, default [1000, 2000, 4000, 8000].
+     repeat    -- runs per size, the fastest one counts, default 3.
+     timeout   -- max run time of each run in seconds, default 10.
+     seed      -- seed of the generated inputs, default 0.
+
+   The inputs are generated from the argument types: a number argument
+   is the size itself, a string, list, tuple, dict or array has 'size'
+   random items.
+
+   The growth is the exponent k of the power law t = c * n^k that best
+   fits the run times, a least squares fit of log t to log n. The same
+   fit of the reference curve over the same sizes gives the exponent
+   expected, e.g a little over 1 for 'linearithmic'.
+"""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import math
+import random
+import string
+
+
+# 'performance' options and their defaults, 'error' defaults to maxhit.
+PERFORMANCE_DEFAULTS = {'reference': 'linear',
+                        'maxhit': 20,
+                        'error': None,
+                        'threshold': 0.5,
+                        'sizes': [1000, 2000, 4000, 8000],
+                        'repeat': 3,
+                        'timeout': 10.0,
+                        'seed': 0}
+
+# Reference growth curves, by name.
+GROWTH = {'constant': lambda n: 1.0,
+          'logarithmic': lambda n: math.log(n + 1),
+          'linear': lambda n: float(n),
+          'linearithmic': lambda n: n * math.log(n + 1),
+          'quadratic': lambda n: float(n) ** 2,
+          'cubic': lambda n: float(n) ** 3}
+
+# Shortest run time we fit, below that we only see the timer.
+MIN_TIME = 1e-6
+
+# Length of a string that is an item of a container.
+ITEM_STRING_SIZE = 8
+
+# Integers in a container are up to this, few of them are equal.
+ITEM_INT_MAX = 2 ** 31 - 1
+
+
+def growth_curve(reference):
+    """Reference curve, by name or exponent."""
+    if reference in GROWTH:
+        return GROWTH[reference]
+    exponent = float(reference)
+    return lambda n: float(n) ** exponent
+
+
+def fit_exponent(sizes, times):
+    """Exponent k of t = c * n^k that fits the (size, time) pairs best,
+       a least squares fit of log t to log n.
+    """
+    xs = [math.log(n) for n in sizes]
+    ys = [math.log(max(t, MIN_TIME)) for t in times]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(ys) / len(ys)
+    sxx = sum((x - x_mean) ** 2 for x in xs)
+    sxy = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys))
+    return sxy / sxx
+
+
+def closest_growth(sizes, exponent):
+    """Name of the reference curve whose fit over sizes is the closest to
+       exponent, for the report.
+    """
+    fits = [(abs(fit_exponent(sizes, [curve(n) for n in sizes]) - exponent),
+             name) for name, curve in GROWTH.iteritems()]
+    return min(fits)[1]
+
+
+def growth_hit(performance, exponent):
+    """Grade a growth exponent takes off, see the module docstring."""
+    excess = exponent - performance['exponent']
+    if excess < performance['threshold']:
+        return 0
+    hits = int(round(excess / performance['threshold']))
+    return min(performance['maxhit'], hits * performance['error'])
+
+
+def generate_item(parsed, size, rng):
+    """Random value of the parse_type() type, an item of a container."""
+    name, params = parsed
+    if name == 'integer':
+        return rng.randint(0, ITEM_INT_MAX)
+    if name in ('float', 'double'):
+        return rng.random() * size
+    if name == 'complex':
+        return complex(rng.random(), rng.random())
+    if name == 'bool':
+        return rng.random() < 0.5
+    if name == 'none':
+        return None
+    if name == 'string':
+        return ''.join(rng.choice(string.ascii_lowercase)
+                       for _ in xrange(ITEM_STRING_SIZE))
+    return generate_value(parsed, ITEM_STRING_SIZE, rng)
+
+
+def generate_value(parsed, size, rng):
+    """Value of the parse_type() type for an input of the given size,
+       see the module docstring.
+    """
+    name, params = parsed
+    if name == 'integer':
+        return size
+    if name in ('float', 'double'):
+        return float(size)
+    if name == 'string':
+        return ''.join(rng.choice(string.ascii_lowercase)
+                       for _ in xrange(size))
+    if name not in ('list', 'tuple', 'dict', 'ndarray'):
+        return generate_item(parsed, size, rng)
+
+    if name == 'ndarray':
+        import numpy
+        state = numpy.random.RandomState(rng.randint(0, 2 ** 31 - 1))
+        kind = params[0][0] if params else 'float'
+        if kind == 'integer':
+            return state.randint(0, size + 1, size=size).astype('int64')
+        if kind == 'bool':
+            return state.random_sample(size) < 0.5
+        return state.random_sample(size) * size
+
+    if name == 'dict':
+        key, value = params or (('integer', ()), ('integer', ()))
+        keys = set()
+        for _ in xrange(size * 4):
+            if len(keys) >= size:
+                break
+            keys.add(generate_item(key, size * 4, rng))
+        return dict((k, generate_item(value, size, rng)) for k in keys)
+
+    if name == 'tuple' and len(params) > 1:
+        return tuple([generate_item(param, size, rng) for param in params])
+    item = params[0] if params else ('integer', ())
+    values = [generate_item(item, size, rng) for _ in xrange(size)]
+    if name == 'tuple':
+        return tuple(values)
+    return values
+
+
+def generate_args(parsed_types, size, seed=0):
+    """Arguments of the user function for an input of the given size.
+
+    Keyword arguments:
+    parsed_types -- parse_type() of each argument type.
+    size -- input size.
+    seed -- random seed, the same seed and size give the same input.
+
+    Return values:
+    tuple -- the arguments.
+    """
+    rng = random.Random(seed * 1000003 + size)
+    return tuple([generate_value(parsed, size, rng)
+                  for parsed in parsed_types])
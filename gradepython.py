@@ -12,15 +12,70 @@ import os
 
 # helper imports
 import argparse
+import ast
+import collections
 import logging
 import re
 import itertools
 import py_compile
+import select
+import signal
 import subprocess
+import threading
 import time
 
 # Base class import
 from grade import Grade
+import gradelint
+import gradeperf
+import gradespec
+import gradeworker
+from gradeworker import ForkServerPool
+from gradecache import ResultCache, CACHE_DIR, CACHE_MAX_BYTES, \
+    result_cache_dir, spec_cache_dir
+
+
+# Interpreter used to run the test cases.
+PYTHON_EXEC = '/usr/bin/python'
+
+# Result record items kept in the test report, see gradeharness, along
+# with what the test process used, see gradeworker.usage_record().
+TEST_DETAILS = ('expected', 'received', 'exception', 'time', 'cpu',
+                'mismatch', 'mismatches', 'maxerror')
+
+# Memo of the pylint version, see pylint_version().
+PYLINT_VERSION = []
+
+# Most tests a batch child is handed ahead of the one it runs, the big
+# arrays of the tests in flight are held in shared memory.
+BATCH_AHEAD = 16
+
+
+def pylint_version():
+    """Version of the pylint we grade with, part of the result cache key
+       since it decides the wellness report.
+    """
+    if PYLINT_VERSION:
+        return PYLINT_VERSION[0]
+
+    version = None
+    try:
+        from pylint import __pkginfo__
+        version = getattr(__pkginfo__, 'version', None) or \
+            getattr(__pkginfo__, '__version__', None)
+    except Exception:
+        pass
+
+    if version is None:
+        try:
+            version = subprocess.check_output('pylint --version',
+                                              stderr=subprocess.STDOUT,
+                                              shell=True)
+        except Exception:
+            version = 'unknown'
+
+    PYLINT_VERSION.append(str(version))
+    return PYLINT_VERSION[0]
 
 
 class PyGrade(Grade):
@@ -29,11 +84,12 @@ class PyGrade(Grade):
 
        Feature highlight:
        1. Function parser.
-           We use regex to find the given function in user submitted code.
-           We then check if the args are specified according to given spec.
+           We parse the user submitted code into an ast and find the given
+           function in it. We then check if the args are specified
+           according to given spec.
        2. Compile test.
-           We use py_compile module to compile given user code. This could
-           be done via seperate process.
+           We compile the same ast in memory, nothing is written next to
+           the user code. This could be done via seperate process.
        3. Code quality check.
            Here we use 'pylint', with default configuration for now.
            'pylint' runs using given user code and we parse the output.
@@ -46,11 +102,16 @@ class PyGrade(Grade):
              * (F) fatal, if an error occurred which prevented pylint from
                    doing further processing.
        4. Test case check.
-           We take user program and generate new code with '__main__'
-           method run desired test.
+           We run each test with a fixed harness (gradeharness) that is
+           given the function name, typed args and expected value as
+           data, along with the compiled user code, over a pipe. No code
+           is generated and no file is written for it.
            This way we run the user program in a seperate process hence
            giving us ability monitor it, and also helps us make sure running
            user program does not impact our execution.
+           By default the test process is forked from a pre-warmed fork
+           server (see gradeworker), this saves us the interpreter startup
+           for every test case while still giving each test a fresh process.
 
            TODO:  potentialy run it in a seperate sandbox/env, with
                   restricted privilidges.
@@ -59,7 +120,11 @@ class PyGrade(Grade):
     def __str__(self):
         return "PyGrade"
 
-    def __init__(self, config_spec, user_prog, log_level=logging.DEBUG):
+    def __init__(self, config_spec, user_prog, log_level=logging.DEBUG,
+                 use_forkserver=True, exec_pool=None,
+                 testcase_overrides=None, compiled_spec=None,
+                 result_cache=None, spec_cache=None,
+                 use_inprocess_lint=True, lint_output=None):
         """Init method, initialize the super class and then set the
            logger
 
@@ -67,106 +132,163 @@ class PyGrade(Grade):
         config_spec -- Config yaml file.
         user_prog -- Give user code
         log_level -- Logger logging level, defaults to DEBUG
+        use_forkserver -- Run tests in children forked from a warm
+                          fork server instead of a new interpreter.
+        exec_pool -- Shared ForkServerPool, caller owns it.
+        testcase_overrides -- 'testcases' spec items to override.
+        compiled_spec -- Already compiled config spec.
+        result_cache -- ResultCache to reuse grades of unchanged programs.
+        spec_cache -- ResultCache to reuse compiled specs.
+        use_inprocess_lint -- Run pylint through its API with a linter
+                              kept for the whole process.
+        lint_output -- pylint output for user_prog from an earlier run
+                       over many programs, see gradelint.lint_files().
         """
-        Grade.__init__(self, config_spec, user_prog)
-
-        # Initialze logger
+        Grade.__init__(self, config_spec, user_prog, testcase_overrides,
+                       compiled_spec)
+        self.result_cache = result_cache
+        self.spec_cache = spec_cache
+        self.use_forkserver = use_forkserver
+        self.exec_pool = exec_pool
+        self.own_exec_pool = False
+        self.shared_arrays = gradeworker.SharedArrays()
+        self.use_inprocess_lint = use_inprocess_lint
+        self.lint_output = lint_output
+        self.user_source = None         # user program, as read
+        self.user_ast = None            # its ast, see parse_user_prog()
+        self.parse_error = None
+        self.user_code = None           # its code object, once compiled
+        self.parsed_params = []
+
+        # Initialze logger, only once per process since the logger is
+        # shared by all graders.
         self.logger = logging.getLogger(str(self))
         self.logger.setLevel(log_level)
-        ch = logging.StreamHandler()
-        ch.setLevel(log_level)
-        formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
-        ch.setFormatter(formatter)
-        self.logger.addHandler(ch)
+        if not self.logger.handlers:
+            ch = logging.StreamHandler()
+            formatter = logging.Formatter('%(name)s - %(levelname)s - ' +
+                                          '%(message)s')
+            ch.setFormatter(formatter)
+            self.logger.addHandler(ch)
+        for ch in self.logger.handlers:
+            ch.setLevel(log_level)
+
+    def timed_stages(self):
+        """Our own stages are timed too, see Grade.enable_timings()."""
+        return Grade.timed_stages(self) + \
+            ['parse_user_prog', 'run_pylint', 'make_exec_program',
+             'run_exec_test', 'run_batched_test_cases']
+
+    def cache_key_items(self):
+        """The grade also depends on us and the pylint we use."""
+        return Grade.cache_key_items(self) + \
+            ['gradepython', __version__, PYTHON_EXEC, pylint_version()]
+
+    def parse_user_prog(self):
+        """Parse the user program into an ast, once. The signature check
+           and the compile check both work off this parse.
 
-    def check_function_def(self):
-        """Here we use good old regex, this is safe since we
-           have determined that file size will not be infinite!
-
-        TODO:
-        1. Support for 'arg=10' etc is lacking.
-        2. Support for *args, **keywords etc is lacking
+        Return values:
+        pair -- -1/0, error string
         """
+        if self.user_ast is not None:
+            return 0, ""
+        if self.parse_error is not None:
+            return -1, self.parse_error
 
-        # XXX: Copied the code from http://stackoverflow.com/\
-        # questions/10158403/python-regex-for-python-function-signatures
-        # TODO: will not work if any arg has the following 'a=10'
-        # or *args etc.
+        try:
+            with open(self.user_prog, 'rb') as fd:
+                self.user_source = fd.read()
+        except Exception, e:
+            self.logger.error("Should not happen, Reading user_prog[%s]: %s" %
+                              (self.user_prog, str(e)))
+            self.parse_error = str(e)
+            return -1, self.parse_error
 
-        # Python identifiers start with a letter or _,
-        # and continue with these or digits.
-        FUNC_NAME = self.function_name
-        IDENT = '[A-Za-z_][A-Za-z_0-9]*'
+        try:
+            self.user_ast = ast.parse(self.user_source, self.user_prog)
+        except (SyntaxError, TypeError) as e:
+            # Same message py_compile gives for it.
+            self.parse_error = str(py_compile.PyCompileError(
+                e.__class__, e, self.user_prog))
+            self.logger.info("Failed to parse - %s - Error : %s" %
+                             (self.user_prog, self.parse_error))
+            return -1, self.parse_error
 
-        # Commas between identifiers can have any amout of space on
-        # either side.
-        COMMA = '\s*,\s*'
+        return 0, ""
 
-        # Parameter list can contain some positional parameters.
-        # For simplicity we ignore now named parameters, *args, and **kwargs.
-        # We catch the entire list.
-        PARAM_LIST = '\((' + IDENT + '?' + '(?:' + COMMA+IDENT + ')*' + ')?\)'
+    def find_function_def(self):
+        """Returns the module level 'def' of our function, the last one
+           if there are many since that is the one we call, or None.
+        """
+        found = None
+        for node in self.user_ast.body:
+            if isinstance(node, ast.FunctionDef) and \
+               node.name == self.function_name:
+                found = node
+        return found
 
-        # Definition starts with 'def', then identifier, some space,
-        # and param list.
-        DEF = 'def\s+(' + FUNC_NAME + ')\s*' + PARAM_LIST
+    def check_function_def(self):
+        """Check the signature of the user function against the spec, off
+           the ast of the user program.
 
-        ident_rx = re.compile(IDENT)
-        def_rx = re.compile(DEF)
+           The spec args have to be the leading positional parameters, in
+           order, the ones past the positional parameters can be taken by
+           *args. Any other parameter needs a default value since we call
+           the function with the spec args only. **kwargs and decorators
+           are fine.
 
-        fd = None
-        # Try opening the user program.
-        try:
-            fd = open(self.user_prog, 'r')
-        except Exception, e:
-            self.logger.error("Should not happen, Reading user_prog[%s]: %s" %
-                              (self.user_prog, str(e)))
-            return -1, str(e)
-
-        # Try to find lines that match the function name,
-        found = False
-        for line in fd:
-            match = def_rx.match(line)
-            if match:
-                name, paramlist = match.groups()
-                # extract individual params
-                params = [x.group()
-                          for x in ident_rx.finditer(paramlist or '')]
-                self.logger.info("Function found : %s %s" % (name, params))
-                self.parsed_params = params
-                found = True
-                break
+        Return values:
+        pair -- -1/0, error string
+        """
+        retval, errStr = self.parse_user_prog()
+        if retval < 0:
+            return -1, errStr
 
-        if found is False:
+        FUNC_NAME = self.function_name
+        func = self.find_function_def()
+        if func is None:
             errStr = "Function not found : %s " % FUNC_NAME
             self.logger.info(errStr)
             return -1, errStr
 
+        args = func.args
+        params = []
+        for arg in args.args:
+            if isinstance(arg, ast.Name):
+                params.append(arg.id)
+            elif hasattr(arg, 'arg'):
+                params.append(arg.arg)
+            else:
+                # Tuple parameter, i.e def f((a, b)).
+                params.append(None)
+        self.parsed_params = params
+        self.logger.info("Function found : %s %s" % (FUNC_NAME, params))
+
         # We have the parameters in a list from parsing above, compare
         # that with what the config spec has.
         # TODO: May be we relax the strict order check?
-
-        # Parameters typically wont be a large dataset unless this
-        # is an attack.
-        count = 0
         for x, y in itertools.izip(self.parsed_params, self.arg_list):
             if x != y:
                 errStr = "Function arg mismatch for " + \
                          "parsed data: %s, spec data: %s" % (x, y)
                 self.logger.info(errStr)
                 return -1, errStr
-            count = count+1
 
-        if count != self.arg_count:
+        if len(self.parsed_params) < self.arg_count and args.vararg is None:
             errStr = "Function arg mismatch for " + \
                      "parsed data: %s, spec data: %s" % \
                      (self.parsed_params, self.arg_list)
             self.logger.info(errStr)
             return -1, errStr
 
-        # The user function has more args than what we expected.
-        # We cannot handle it for now.
-        if len(self.parsed_params) > len(self.arg_list):
+        # The user function has more args than what we give it, fine as
+        # long as they have defaults, keyword-only ones too.
+        required = len(self.parsed_params) - len(args.defaults)
+        kw_required = [kw_default for kw_default
+                       in getattr(args, 'kw_defaults', [])
+                       if kw_default is None]
+        if required > self.arg_count or kw_required:
             errStr = "User code has more args than required " + \
                      "parsed data: %s, spec data: %s" % \
                      (self.parsed_params, self.arg_list)
@@ -178,26 +300,69 @@ class PyGrade(Grade):
         return 0, ""
 
     def run_compile_test(self):
-        """We do an inline compile, we could fork a process for this. It is
-           highly unlikely we will encounter strings that can cause us to
-           crash due to using python compile api(py_compile).
+        """Compile the ast we parsed, inline. It is highly unlikely we will
+           encounter code that can cause us to crash due to using the
+           python compile api. The code object is kept in user_code.
 
         Return values:
         pair -- -1/0, error string
         """
+        retval, errStr = self.parse_user_prog()
+        if retval < 0:
+            return -1, errStr
 
         try:
-            py_compile.compile(self.user_prog, doraise=True)
+            self.user_code = compile(self.user_ast, self.user_prog, 'exec')
         except Exception as e:
+            errStr = str(py_compile.PyCompileError(e.__class__, e,
+                                                   self.user_prog))
             self.logger.error("Failed to compile - %s - Error : %s" %
-                              (self.user_prog, str(e)))
-            return -1, str(e)
+                              (self.user_prog, errStr))
+            return -1, errStr
 
         self.logger.info("Compilation succeeded for  %s" % self.user_prog)
         return 0, ""
 
+    def run_pylint(self):
+        """Run pylint on the user program, with the in-process linter when
+           we can and else via subprocess.
+
+        Return values:
+        pair -- parseable pylint output, error or None
+        """
+        if self.lint_output is not None:
+            return self.lint_output, None
+
+        PYLINT_ARGS = "pylint -f parseable -r n " + self.user_prog
+        linter = None
+        if self.use_inprocess_lint:
+            linter = gradelint.get_linter()
+        if linter is not None:
+            try:
+                pylint_output, status = linter.run([self.user_prog])
+            except Exception as e:
+                self.logger.info("pylint in-process error [%s] : %s" %
+                                 (self.user_prog, str(e)))
+            else:
+                e = None
+                if status != 0:
+                    e = subprocess.CalledProcessError(status, PYLINT_ARGS,
+                                                      pylint_output)
+                return pylint_output, e
+
+        e = None
+        try:
+            pylint_output = subprocess.check_output(PYLINT_ARGS,
+                                                    stderr=subprocess.STDOUT,
+                                                    shell=True)
+        except subprocess.CalledProcessError as e:
+            self.logger.info("pylint error [%s] : %s" %
+                             (PYLINT_ARGS, str(e)))
+            pylint_output = str(e.output)
+        return pylint_output, e
+
     def run_wellness_check(self):
-        """We use pylint via subprocess and parse its output.
+        """We use pylint, see run_pylint(), and parse its output.
            We then return a nice of number of errors for each
            wellness type!
 
@@ -211,17 +376,7 @@ class PyGrade(Grade):
         Return values
         pair -- -1,0, list
         """
-        PYLINT_ARGS = "pylint -f parseable -r n " + self.user_prog
-        pylint_output = None
-        e = None
-        try:
-            pylint_output = subprocess.check_output(PYLINT_ARGS,
-                                                    stderr=subprocess.STDOUT,
-                                                    shell=True)
-        except subprocess.CalledProcessError as e:
-            self.logger.info("pylint error [%s] : %s" %
-                             (PYLINT_ARGS, str(e)))
-            pylint_output = str(e.output)
+        pylint_output, e = self.run_pylint()
 
         self.logger.info("pylint output [%s] : %s" %
                          (self.user_prog, pylint_output))
@@ -259,35 +414,46 @@ class PyGrade(Grade):
 
         return 0, well_report
 
-    def run_exec_test(self, exec_fname):
-        """This function executes the python wrapper code which includes the
+    def run_exec_test(self, program, timeout=None):
+        """This function executes the test harness which imports the
            user code. This code is run in a seperate process using
            subprocess.popen(). This helps us montior the process. We will
            kill the process if it exceeds its time limit for executing and
-           mark the test as failed.
+           mark the test as failed. We wait on the process output rather
+           than polling, so the test costs only as long as it runs.
 
-           TODO: Run the generated code in a seperate sandbox with
+           TODO: Run the test process in a seperate sandbox with
                  given priviledge restriction.
 
         Following are the features:
         1. Sends in the args with right type, position and data.
         2. Ensures return data type mathes with spec and what prog returned
         3. Catch crash and fails the test case.
-        4. We compile our generated code first to make sure there is no
-           operational error.
+
+        The program, i.e the test data and the compiled user code, goes to
+        the child over a pipe, nothing is written to disk.
 
         Keyword arguments:
-        exec_fname - filename of the executable.
+        program - marshalled program, see gradeworker.make_program().
+        timeout - max run time in seconds, default the test timeout.
 
         Return values:
         pair - -1/0, [ 'pass'/'fail'/'none', 'error_string' ]
         """
+        if timeout is None:
+            timeout = self.timeout_interval
+
+        if self.get_exec_pool() is not None:
+            return self.run_pooled_exec_test(program, timeout)
 
         p = None
-        fname = ["/usr/bin/python", exec_fname]
+        fname = [PYTHON_EXEC, gradeworker.worker_script(), 'exec',
+                 str(self.mem_limit or 0), str(self.cpu_limit or 0)]
+        start = time.time()
         try:
-            p = subprocess.Popen(fname, stderr=subprocess.STDOUT,
+            p = subprocess.Popen(fname, stderr=subprocess.PIPE,
                                  stdout=subprocess.PIPE,
+                                 stdin=subprocess.PIPE,
                                  close_fds=True)
         except Exception as e:
             self.logger.info("Popen error [%s] : %s" %
@@ -295,31 +461,42 @@ class PyGrade(Grade):
 
             return -1, ['none', str(e)]
 
-        # How many times to poll for process status
-        max_retry = 4
-
-        # Get sleep interval in milliseconds.
-        sleep_interval = float(self.timeout_interval) / max_retry
+        self.send_program(p, program)
+
+        # Block on the child's output until it exits or the deadline
+        # passes, no fixed poll interval so a quick test returns as soon
+        # as it is done.
+        # The child writes the test result on stdout and the user output
+        # on stderr. We reap it ourselves to get its resource usage.
+        deadline = start + float(timeout)
+        (result, stdoutdata), reaped, timedout = \
+            gradeworker.drain_until_exit([p.stdout.fileno(),
+                                          p.stderr.fileno()],
+                                         lambda: gradeworker.reap_child(p.pid),
+                                         deadline,
+                                         [gradeworker.RESULT_LIMIT,
+                                          self.output_limit])
+        p.stdout.close()
+        p.stderr.close()
+
+        # If we are here due to deadline exceeded then kill the
+        # process and return error.
+        if timedout:
+            p.kill()
+            reaped = gradeworker.reap_child(p.pid, True)
+        status, rusage = reaped
+        p.returncode = p_returncode = gradeworker.wait_status_code(status)
+        usage = gradeworker.usage_record(time.time() - start, rusage)
 
-        count = 0
-        p_returncode = None
-        while count < max_retry:
-            p.poll()
-            p_returncode = p.returncode
-            if p.returncode is not None:
-                # subprocss has termiated
-                break
-            time.sleep(sleep_interval)
-            count = count+1
+        if timedout:
+            errStr = 'Test run exceeded timeout : %s' % timeout
+            self.logger.error(errStr)
+            return 0, ['fail', errStr, self.test_details({}, usage)]
 
-        # If we are here due to count exceeded then kill the
-        # process and return error.
-        if count == max_retry:
-            errStr = 'Test run exceeded timeout : %s' % self.timeout_interval
+        errStr = self.limit_exceeded(p_returncode, usage)
+        if errStr is not None:
             self.logger.error(errStr)
-            p.kill()
-            p.wait()
-            return 0, ['fail', errStr]
+            return 0, ['fail', errStr, self.test_details({}, usage)]
 
         # Check the return code for < 0 if the process was killed
         # someone else or died due to bad code!
@@ -329,33 +506,438 @@ class PyGrade(Grade):
             # Whose fault is it?
             return -1, ['fail', errStr]
 
-        # Get the program output and check if the test passed/failed
-        stdoutdata, stderrdata = p.communicate()
-        self.logger.info('Test result : \n \t[ %s , %s , returncode %s]' %
-                         (stdoutdata, stderrdata, p_returncode))
-
-        # Parse the stdoutdata so we know if test passed or failed.
-        # Capture the reason.
-        if p_returncode == 0:
-            # Check if we have the 'PASSED - Expected :' value
-            passstr = '^PASSED -'
-            pass_rx = re.compile(passstr)
-            match = pass_rx.match(stdoutdata)
-            if match is None:
-                return 0, ['fail', stdoutdata]
+        # Check if the test passed/failed
+        self.logger.info('Test result : \n \t[ %s , returncode %s]' %
+                         (stdoutdata, p_returncode))
+
+        return self.check_exec_result(p_returncode, result, stdoutdata,
+                                      usage)
+
+    def run_pooled_exec_test(self, program, timeout):
+        """Same as run_exec_test() but the test process is forked from
+           one of the warm fork servers instead of starting a new
+           interpreter.
+
+        Keyword arguments:
+        program - marshalled program, see gradeworker.make_program().
+        timeout - max run time in seconds.
+
+        Return values:
+        pair - -1/0, [ 'pass'/'fail'/'none', 'error_string' ]
+        """
+        try:
+            p_returncode, result, stdoutdata, timedout, usage = \
+                self.exec_pool.run(program, timeout,
+                                   self.output_limit, self.mem_limit,
+                                   self.cpu_limit)
+        except Exception as e:
+            self.logger.info("Fork server error [%s] : %s" %
+                             (self.user_prog, str(e)))
+            return -1, ['none', str(e)]
+
+        if timedout:
+            errStr = 'Test run exceeded timeout : %s' % timeout
+            self.logger.error(errStr)
+            return 0, ['fail', errStr, self.test_details({}, usage)]
+
+        errStr = self.limit_exceeded(p_returncode, usage)
+        if errStr is not None:
+            self.logger.error(errStr)
+            return 0, ['fail', errStr, self.test_details({}, usage)]
 
-            return 0, ['pass', stdoutdata]
+        if p_returncode < 0:
+            errStr = 'Process died with signal : %s' % abs(p_returncode)
+            self.logger.error(errStr)
+            return -1, ['fail', errStr]
 
-        # p_returncode == 1
-        failstr = '^FAILED -'
-        fail_rx = re.compile(failstr)
-        match = fail_rx.match(stdoutdata)
-        if match:
-            return 0, ['fail', stdoutdata]
+        self.logger.info('Test result : \n \t[ %s , returncode %s]' %
+                         (stdoutdata, p_returncode))
 
-        self.logger.info('Test result is unknown!')
-        # Should we count this towards grading?
-        return 0, ['none', stdoutdata]
+        return self.check_exec_result(p_returncode, result, stdoutdata,
+                                      usage)
+
+    def send_program(self, p, program):
+        """Hand the program to a child we started, on its stdin."""
+        try:
+            p.stdin.write('%d\n' % len(program))
+            p.stdin.write(program)
+            p.stdin.close()
+        except IOError as e:
+            # Child is gone already, we learn why from its output.
+            self.logger.info("Sending program to child : %s" % str(e))
+
+    def send_tests(self, p, program, tests, sent, ahead, stopped):
+        """Hand the program and then its tests, one at a time, to a batch
+           child we started, on its stdin. Meant for a thread of its own,
+           we read the test vectors as the child gets to them.
+
+        Keyword arguments:
+        p - the batch child.
+        program - make_exec_program() program.
+        tests - iterable of make_test() tuples.
+        sent - deque the tests go on as they are sent, the reader takes
+               them off as their results come.
+        ahead - semaphore of BATCH_AHEAD, released per result.
+        stopped - event set once the reader is done.
+        """
+        try:
+            p.stdin.write('%d\n' % len(program))
+            p.stdin.write(program)
+            for test in tests:
+                ahead.acquire()
+                if stopped.is_set():
+                    break
+                sent.append(test)
+                gradeworker.write_test(p.stdin, test, self.shared_arrays)
+        except IOError as e:
+            # Child is gone already, we learn why from its output.
+            self.logger.info("Sending tests to child : %s" % str(e))
+        except Exception as e:
+            self.logger.error("Reading test vectors : %s" % str(e))
+        try:
+            p.stdin.close()
+        except IOError:
+            pass
+
+    def check_exec_result(self, p_returncode, result, stdoutdata,
+                          usage=None):
+        """Decode the result record of a finished test process so we know
+           if the test passed or failed, and capture the reason. The
+           record comes on its own channel, so whatever the user code
+           printed does not get in the way, it is added after the reason.
+
+        Keyword arguments:
+        p_returncode - exit status of the test process.
+        result - result record data, see gradeworker.write_result().
+        stdoutdata - combined stdout/stderr of the user code.
+        usage - what the test process used, see
+                gradeworker.usage_record().
+
+        Return values:
+        pair - 0, [ 'pass'/'fail'/'none', 'error_string', details ]
+               details has the expected and received repr, exception
+               type, the time the call took and where a wrong value
+               differs, if the harness got that far, and the usage.
+        """
+        record = gradeworker.read_result(result)
+        if record is None:
+            # The harness did not get to report, i.e the user code exited
+            # or could not be imported.
+            if p_returncode == 0:
+                return 0, ['fail', stdoutdata, self.test_details({}, usage)]
+            self.logger.info('Test result is unknown!')
+            # Should we count this towards grading?
+            return 0, ['none', stdoutdata, self.test_details({}, usage)]
+
+        message = record.get('message', '')
+        if isinstance(message, unicode):
+            message = message.encode('utf-8', 'replace')
+        status = 'pass' if record.get('status') == 'pass' else 'fail'
+        return 0, [status, message + stdoutdata,
+                   self.test_details(record, usage)]
+
+    def test_details(self, record, usage=None):
+        """Details of a test result, the TEST_DETAILS of its result
+           record and what the test process used.
+        """
+        details = dict((k, record.get(k)) for k in TEST_DETAILS)
+        details.update(usage or {})
+        return details
+
+    def limit_exceeded(self, p_returncode, usage):
+        """Error string if the test process was killed for going over
+           its cpu limit, None otherwise. Going over the memory limit
+           fails the test with a MemoryError, no need to check for it.
+        """
+        if not self.cpu_limit:
+            return None
+        # SIGXCPU comes at the limit, SIGKILL a second later.
+        if p_returncode != -signal.SIGXCPU and \
+           (p_returncode != -signal.SIGKILL or
+                usage['utime'] + usage['stime'] < self.cpu_limit):
+            return None
+        return 'Test run exceeded cpu limit : %s' % self.cpu_limit
+
+    def get_exec_pool(self):
+        """Returns the fork server pool to run tests with, the pool is
+           started on first use. Returns None if we should (or have to)
+           fall back to starting a new interpreter per test.
+        """
+        if self.exec_pool is not None or not self.use_forkserver:
+            return self.exec_pool
+
+        try:
+            self.exec_pool = ForkServerPool(PYTHON_EXEC, self.test_jobs)
+        except Exception as e:
+            self.logger.info("Fork server unavailable, using Popen : %s" %
+                             str(e))
+            self.use_forkserver = False
+            return None
+
+        self.own_exec_pool = True
+        return self.exec_pool
+
+    def cleanup(self):
+        """Stop the fork servers we started and drop the arrays we
+           shared with the test processes.
+        """
+        if self.own_exec_pool:
+            self.exec_pool.close()
+            self.exec_pool = None
+            self.own_exec_pool = False
+        self.shared_arrays.close()
+        return 0
+
+    def make_test(self, tinput, toutput):
+        """The data gradeharness.run_test() needs for one test case, the
+           test vectors are already of the spec types.
+
+        Keyword arguments:
+        tinput - test case input.
+        toutput - test case expected output.
+        """
+        import_name = os.path.basename(self.user_prog).split('.')[0]
+        return (import_name, self.function_name, tinput, toutput,
+                self.compare_options)
+
+    def user_modules(self):
+        """The user code as a module our test programs can import, the
+           code object from the compile check so a child neither reads
+           nor compiles the user program again.
+
+        Return values:
+        list -- [ (module name, file name, code object) ]
+        """
+        if self.user_code is None and self.run_compile_test()[0] < 0:
+            return []
+        fonly = os.path.basename(self.user_prog)
+        return [(fonly.split('.')[0], self.user_prog, self.user_code)]
+
+    def make_exec_program(self, exec_fname, tests):
+        """Package the tests with the compiled user code into a program
+           for the child, nothing is written to disk. exec_fname is only
+           the name it runs as.
+
+        Keyword arguments:
+        exec_fname - name the program runs as.
+        tests - list of make_test() tuples.
+
+        Return values:
+        pair - -1/0, marshalled program, release() the tests once the
+               program ran.
+        """
+        modules = self.user_modules()
+        if not modules:
+            return -1, None
+
+        try:
+            program = gradeworker.make_program(exec_fname, tests, modules,
+                                               self.shared_arrays)
+        except Exception as e:
+            self.logger.error("Failed to package tests - %s - Error : %s" %
+                              (exec_fname, str(e)))
+            return -1, None
+
+        return 0, program
+
+    def run_batched_test_cases(self, test_eval_data):
+        """Run all the test cases in a single child. The child imports the
+           user code once, runs the test functions one after the other
+           with the timeout enforced per test and streams back a record
+           per test, see gradeworker.run_batch().
+
+           If the child crashes or stops responding we kill it and return
+           with what we have, the caller then runs the remaining test
+           cases one process per test.
+
+        Keyword arguments:
+        test_eval_data - list to append the test results to.
+
+        Return values:
+        int - -1 on fatal error, 0 otherwise.
+        """
+        fpath, fonly = os.path.split(self.user_prog)
+        exec_fname = os.path.join(fpath, 'exec_batch_' + fonly)
+        self.logger.info('Using batch exec program : %s' % exec_fname)
+
+        # The tests follow the program one at a time, see send_tests().
+        count = self.test_count
+        retval, program = self.make_exec_program(exec_fname, [])
+        if retval < 0:
+            return -1
+        tests = (self.make_test(tinput, toutput)
+                 for tinput, toutput in self.test_vectors())
+
+        fname = [PYTHON_EXEC, gradeworker.worker_script(),
+                 'batch', repr(self.timeout_interval), '0',
+                 str(self.output_limit or -1), str(self.mem_limit or 0),
+                 str(self.cpu_limit or 0)]
+        try:
+            p = subprocess.Popen(fname, stdout=subprocess.PIPE,
+                                 stdin=subprocess.PIPE,
+                                 close_fds=True)
+        except Exception as e:
+            self.logger.info("Popen error [%s] : %s" % (fname, str(e)))
+            return 0
+
+        sent = collections.deque()
+        ahead = threading.Semaphore(BATCH_AHEAD)
+        stopped = threading.Event()
+        sender = threading.Thread(target=self.send_tests,
+                                  args=(p, program, tests, sent, ahead,
+                                        stopped))
+        sender.daemon = True
+        sender.start()
+
+        # The child enforces the timeout, we only watch for a child that
+        # does not come back. Allow for the import of user code too.
+        grace = self.timeout_interval + 1.0
+        failed = 0
+        while len(test_eval_data) < count and \
+                not self.testrun_decided(failed):
+            ready, _, _ = select.select([p.stdout], [], [], grace)
+            if not ready:
+                self.logger.error('Batch run stopped responding at test %d' %
+                                  len(test_eval_data))
+                break
+            header = p.stdout.readline().split()
+            if len(header) != 9 or int(header[0]) != len(test_eval_data):
+                self.logger.error('Batch run crashed at test %d' %
+                                  len(test_eval_data))
+                break
+            status, p_returncode = header[1], int(header[2])
+            usage = dict(zip(gradeworker.USAGE_FIELDS,
+                             [float(x) for x in header[5:8]] +
+                             [int(header[8])]))
+            result = p.stdout.read(int(header[3]))
+            stdoutdata = p.stdout.read(int(header[4]))
+            # The child is done with this test, see send_tests().
+            if sent:
+                self.shared_arrays.release(sent.popleft())
+            ahead.release()
+            self.logger.info('Test result : \n \t[ %s , returncode %s]' %
+                             (stdoutdata, p_returncode))
+            if status in ('timeout', 'cpulimit'):
+                if status == 'timeout':
+                    errStr = 'Test run exceeded timeout : %s' % \
+                             self.timeout_interval
+                else:
+                    errStr = 'Test run exceeded cpu limit : %s' % \
+                             self.cpu_limit
+                self.logger.error(errStr)
+                test_eval_data.append(['fail', errStr,
+                                       self.test_details({}, usage)])
+                failed = failed + 1
+                continue
+            retval, retargs = self.check_exec_result(p_returncode, result,
+                                                     stdoutdata, usage)
+            test_eval_data.append(retargs)
+            if retargs[0] == 'fail':
+                failed = failed + 1
+
+        if p.poll() is None:
+            p.kill()
+        p.wait()
+        stopped.set()
+        ahead.release()
+        sender.join()
+        p.stdout.close()
+        while sent:
+            self.shared_arrays.release(sent.popleft())
+        return 0
+
+    def next_test_case(self, tests):
+        """Read the next test case, a data file may turn out bad half way.
+
+        Return values:
+        pair - 0, test case or None once there are no more
+               -1, [ 'none', 'error_string' ] if it could not be read
+        """
+        try:
+            return 0, next(tests)
+        except StopIteration:
+            return 0, None
+        except Exception as e:
+            self.logger.error('Reading test data: %s' % str(e))
+            return -1, ['none', 'Reading test data : %s' % str(e)]
+
+    def run_parallel_test_cases(self, tests, test_eval_data):
+        """Run the given test cases on 'test_jobs' threads, each thread
+           hands its test to its own process. Results are added to
+           test_eval_data in spec order.
+
+        Keyword arguments:
+        tests - iterable of (index, input, output) to run, taken as the
+                threads get to them.
+        test_eval_data - list to append the test results to.
+
+        Return values:
+        int - -1 on fatal error, 0 otherwise.
+        """
+        fpath, fonly = os.path.split(self.user_prog)
+        exec_fname = os.path.join(fpath, 'exec_' + fonly)
+
+        todo = iter(tests)
+        todo_lock = threading.Lock()
+        taken = []
+        results = {}
+        read_error = []
+        stop = threading.Event()
+        failed = [len([r for r in test_eval_data if r[0] == 'fail'])]
+
+        def worker():
+            while not stop.is_set():
+                with todo_lock:
+                    retval, test = self.next_test_case(todo)
+                    if retval < 0:
+                        read_error.append(test)
+                        stop.set()
+                    if test is None or retval < 0:
+                        return
+                    index, tinput, toutput = test
+                    taken.append(index)
+                test = [self.make_test(tinput, toutput)]
+                retval, program = self.make_exec_program(exec_fname, test)
+                if retval < 0:
+                    results[index] = (-1, None)
+                    stop.set()
+                    continue
+
+                retval, retargs = self.run_exec_test(program)
+                self.shared_arrays.release(test)
+                self.logger.debug('retval %s , retargs %s' %
+                                  (retval, retargs))
+
+                results[index] = (retval, retargs)
+                # error < 0 means a fatal problem, stop the others.
+                if retval < 0:
+                    stop.set()
+                if retargs[0] == 'fail':
+                    with todo_lock:
+                        failed[0] = failed[0] + 1
+                        if self.testrun_decided(failed[0]):
+                            stop.set()
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(self.test_jobs)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for index in taken:
+            if index not in results:
+                # never ran since we had to stop.
+                return -1
+            retval, retargs = results[index]
+            if retargs is not None:
+                test_eval_data.append(retargs)
+            if retval < 0:
+                return -1
+        if read_error:
+            test_eval_data.append(read_error[0])
+            return -1
+        return 0
 
     def run_test_cases(self):
         """We get all the test suite that needs to be executed. We do this
@@ -364,6 +946,11 @@ class PyGrade(Grade):
            Should only return 'pass', 'none' or 'pass' so super can
            understand if a test case passed or failed.
 
+           In the 'batched' test mode all the test cases are run in a
+           single child, whatever the batch could not finish is run one
+           process per test case. With 'parallelism' > 1 those processes
+           run concurrently.
+
         Return Value:
         pair - -1/0, [ [ 'string1', 'string2' ] ]
 
@@ -372,141 +959,56 @@ class PyGrade(Grade):
              - [ 'none', 'error Popen' ]
              - [ 'pass', 'PASSED - ...' ]
         """
+        test_eval_data = []
+        if self.test_mode == 'batched':
+            if self.run_batched_test_cases(test_eval_data) < 0:
+                return -1, test_eval_data
+
         fpath, fonly = os.path.split(self.user_prog)
-        exec_fname = fpath + '/' + 'exec_' + fonly
-        self.logger.info('Using exec file : %s' % exec_fname)
+        exec_fname = os.path.join(fpath, 'exec_' + fonly)
+        self.logger.info('Using exec program : %s' % exec_fname)
 
-        # we will grab the input code which is right now a function and
-        # output with a main function and a set of args with right types.
-        # We do this for every test run and collect the result and
-        # convert the result to right type as per config_spec
+        # Every test run is the same harness (gradeharness) given the
+        # function name, the args with right types and the expected
+        # value as per config_spec, and we collect the result.
 
         # This result is then used by the base implementation to grade
         # the code.
 
-        # import <userprog without .py>
-        INPUT_IMPORT_NAME = fonly.split('.')[0]
-
-        # Given function name, we know this has been verified already
-        FUNCTION_NAME = self.function_name
-
-        CODE_PREFIX = "#!/usr/bin/env python\n\n" + \
-                      "# import our dependencies only!\n" + \
-                      "import sys\n" + \
-                      "import traceback\n\n" + \
-                      "# importing user code\n" + \
-                      "import " + INPUT_IMPORT_NAME + '\n\n' + \
-                      "if __name__ == \'__main__':\n" + \
-                      "\targs = sys.argv[1:]\n\targs_right = []\n"
-
-        # we need to take the input args and then generate code that will
-        # convert them to right type and ad them to "args_right" list
-        test_eval_data = []
-        arg_cast = {'string': 'str',
-                    'integer': 'int',
-                    'float': 'float',
-                    'bool': 'bool',
-                    'double': 'double',
-                    'complex': 'complex',
-                    'none': 'None'}
-
-        for tinput, toutput in itertools.izip(self.testcase_input,
-                                              self.testcase_output):
-            arg_position = 0
-            ARG_CONVERSION = ""
-            if tinput is None:
-                FUNCTION_ARGS = '()'
-            else:
-                for t in tinput:
-                    # Get the arg type from config_spec which helps
-                    # us with sending right params to the test user
-                    # function.
-                    arg_type = self.arg_type_list[arg_position]
-
-                    ARG_CONV_STR = '\targs_right.append(' + \
-                                   arg_cast[arg_type] + \
-                                   '(\'' + str(t) + '\')' + ')'
-                    ARG_CONVERSION += ARG_CONV_STR + '\n'
-                    arg_position = arg_position + 1
-                FUNCTION_ARGS = '(*args_right)'
-
-            CODE_CALL_FUNC = '\ttry:\n' + \
-                             '\t\treturn_val = ' + INPUT_IMPORT_NAME + '.' + \
-                             FUNCTION_NAME + FUNCTION_ARGS + '\n' + \
-                             '\texcept Exception as e:\n' + \
-                             '\t\texc_type, exc_value, exc_traceback ' + \
-                             '= sys.exc_info()\n' + \
-                             '\t\tprint (\"FAILED - STACKTRACE: \")\n' + \
-                             '\t\ttraceback.print_exception(exc_type, ' + \
-                             'exc_value, exc_traceback, limit=2, ' + \
-                             'file=sys.stdout)\n' + \
-                             '\t\tsys.exit(1)\n'
-
-            # test case output is a single value! is our current
-            # assumption!.
-            if arg_cast[self.return_type[0]] == 'None':
-                ARG_CAST = 'None\n'
-            else:
-                ARG_CAST = arg_cast[self.return_type[0]] + \
-                           '(\'' + str(toutput) + '\')\n'
-
-            RETURN_DATA = '\treturn_data = ' + ARG_CAST
-
-            RETURN_VAL_CHECK = '\tif type(return_val) is not ' + \
-                               'type(return_data):\n' + \
-                               '\t\tprint (\"FAILED - Expected Return ' + \
-                               'Type: %s' + \
-                               ' - Received Return Type : %s \" %\n' + \
-                               '\t\t  (type(return_data), ' + \
-                               'type(return_val)))\n' + \
-                               '\t\tsys.exit(1)\n' + \
-                               '\tif return_val != return_data:\n' + \
-                               '\t\tprint (\"FAILED - Expected : %s' + \
-                               ' - Received : %s \" %\n' + \
-                               '\t\t  (return_data, ' + \
-                               'return_val))\n' + \
-                               '\t\tsys.exit(1)\n'
-
-            CODE_EXIT = '\tprint (\"PASSED - Expected : %s' + \
-                        ' - Received : %s \" %\n' + \
-                        '\t\t(return_data, return_val))\n' + \
-                        '\tsys.exit(0)\n'
-            CODE_GEN = CODE_PREFIX + ARG_CONVERSION + CODE_CALL_FUNC + \
-                RETURN_DATA + RETURN_VAL_CHECK + CODE_EXIT
-
-            # Ok CODE_GEN has the generated code.
-            # Output this to a temporary file and then lets run it
-            # in a seperate process.
-            self.logger.debug('\n%s' % CODE_GEN)
-
-            fd = None
-            try:
-                fd = open(exec_fname, 'w')
-            except Exception, e:
-                self.logger.error("Creating exec file[%s]: %s" %
-                                  (exec_fname, str(e)))
-                # This is a fatal error, should not impact grading?
+        # With fail_fast we stop once the grade is decided, the tests we
+        # did not run are marked skipped.
+        done = len(test_eval_data)
+        failed = len([r for r in test_eval_data if r[0] == 'fail'])
+        if self.testrun_decided(failed):
+            self.skip_test_cases(test_eval_data)
+            return 0, test_eval_data
+
+        if self.test_jobs > 1:
+            tests = ((index, tinput, toutput) for index, (tinput, toutput)
+                     in enumerate(self.test_vectors()) if index >= done)
+            if self.run_parallel_test_cases(tests, test_eval_data) < 0:
                 return -1, test_eval_data
+            self.skip_test_cases(test_eval_data)
+            return 0, test_eval_data
 
-            # Write the generated code.
-            fd.write(CODE_GEN)
-
-            # Close the file
-            fd.close()
+        tests = itertools.islice(self.test_vectors(), done, None)
+        while True:
+            retval, test = self.next_test_case(tests)
+            if retval < 0:
+                test_eval_data.append(test)
+                return -1, test_eval_data
+            if test is None:
+                break
+            tinput, toutput = test
 
-            # Ensure that this code compiles!, we did confirm that
-            # user provided code compiles so our additions should
-            # compile.
-            # TODO: Have to make sure user does not have his own
-            # __main__ ?
-            try:
-                py_compile.compile(exec_fname, doraise=True)
-            except Exception as e:
-                self.logger.error("Failed to compile - %s - Error : %s" %
-                                  (exec_fname, str(e)))
+            # Package the test and then lets run it in a seperate process.
+            test = [self.make_test(tinput, toutput)]
+            retval, program = self.make_exec_program(exec_fname, test)
+            if retval < 0:
                 return -1, test_eval_data
 
-            retval, retargs = self.run_exec_test(exec_fname)
+            retval, retargs = self.run_exec_test(program)
+            self.shared_arrays.release(test)
             self.logger.debug('retval %s , retargs %s' %
                              (retval, retargs))
 
@@ -516,9 +1018,85 @@ class PyGrade(Grade):
             if retval < 0:
                 return -1, test_eval_data
 
+            if retargs[0] == 'fail':
+                failed = failed + 1
+                if self.testrun_decided(failed):
+                    self.skip_test_cases(test_eval_data)
+                    break
+
         # Return the test run evaluation.
         return 0, test_eval_data
 
+    def run_performance_check(self):
+        """Time the user function on inputs of increasing size, see
+           gradeperf. Each run is a test process of its own, as a test
+           case is, and the fastest of 'repeat' runs counts. We stop at
+           the first size the function times out or raises at.
+
+        Return values:
+        pair - -1/0, map with the 'sizes' and 'times' (seconds) we got
+               to, the peak 'maxrss' (KB) per size, the growth
+               'exponent' fitted to the times and the closest 'growth'
+               curve, or an 'error'.
+        """
+        performance = self.performance
+        fpath, fonly = os.path.split(self.user_prog)
+        exec_fname = os.path.join(fpath, 'exec_perf_' + fonly)
+        self.logger.info('Using performance exec program : %s' % exec_fname)
+
+        report = {'reference': performance['reference'],
+                  'expected': performance['exponent'],
+                  'sizes': [],
+                  'times': [],
+                  'maxrss': [],
+                  'error': None}
+        parsed_types = [gradespec.parse_type(type_name)
+                        for type_name in self.arg_type_list]
+        for size in performance['sizes']:
+            try:
+                args = gradeperf.generate_args(parsed_types, size,
+                                               performance['seed'])
+            except ImportError as e:
+                report['error'] = 'ndarray needs numpy : %s' % str(e)
+                return -1, report
+            test = [self.make_test(args, None)]
+            retval, program = self.make_exec_program(exec_fname, test)
+            if retval < 0:
+                return -1, report
+
+            best = None
+            maxrss = 0
+            try:
+                for _ in range(performance['repeat']):
+                    retval, retargs = self.run_exec_test(
+                        program, performance['timeout'])
+                    if retval < 0:
+                        report['error'] = retargs[1]
+                        return -1, report
+                    details = retargs[2] if len(retargs) > 2 else {}
+                    if details.get('exception') is not None:
+                        report['error'] = 'Size %d : raised %s' % \
+                            (size, details['exception'])
+                        return 0, report
+                    if details.get('time') is None:
+                        report['error'] = 'Size %d : %s' % \
+                            (size, retargs[1].strip().split('\n')[0])
+                        return 0, report
+                    if best is None or details['time'] < best:
+                        best = details['time']
+                    maxrss = max(maxrss, details.get('maxrss') or 0)
+            finally:
+                self.shared_arrays.release(test)
+            report['sizes'].append(size)
+            report['times'].append(best)
+            report['maxrss'].append(maxrss)
+
+        report['exponent'] = gradeperf.fit_exponent(report['sizes'],
+                                                    report['times'])
+        report['growth'] = gradeperf.closest_growth(report['sizes'],
+                                                    report['exponent'])
+        return 0, report
+
 
 def main(argv):
     """Parse the args and initialize the grade class.
@@ -546,6 +1124,60 @@ def main(argv):
     parser.add_argument('-x', '--verbose', action='count',
                         help='Logging verbosity')
 
+    parser.add_argument('--test-mode', action='store',
+                        dest='testMode', choices=['process', 'batched'],
+                        help='Run each test case in its own process ' +
+                             '(default) or all of them in one process')
+
+    parser.add_argument('-j', '--jobs', action='store', type=int,
+                        dest='jobs',
+                        help='Number of test cases to run at a time')
+
+    parser.add_argument('--fail-fast', action='store_true',
+                        dest='failFast', default=False,
+                        help='Stop running test cases once the grade is ' +
+                             'decided, the rest count as failed')
+
+    parser.add_argument('--max-failures', action='store', type=int,
+                        dest='maxFailures',
+                        help='Stop running test cases after this many ' +
+                             'failed, the rest count as failed')
+
+    parser.add_argument('--output-limit', action='store', type=int,
+                        dest='outputLimit',
+                        help='Bytes of user output to keep per test case, ' +
+                             '0 keeps it all')
+
+    parser.add_argument('--no-forkserver', action='store_false',
+                        dest='useForkServer', default=True,
+                        help='Start a new interpreter for every test case')
+
+    parser.add_argument('--no-cache', action='store_false',
+                        dest='useCache', default=True,
+                        help='Always grade, do not use the result cache')
+
+    parser.add_argument('--cache-dir', action='store', dest='cacheDir',
+                        default=CACHE_DIR,
+                        help='Cache directory, default %(default)s')
+
+    parser.add_argument('--cache-size', action='store', type=int,
+                        dest='cacheSize', default=256,
+                        help='Result cache size limit in MB')
+
+    parser.add_argument('--lint-subprocess', action='store_false',
+                        dest='inprocessLint', default=True,
+                        help='Run pylint in a new process, not in-process')
+
+    parser.add_argument('--no-overlap', action='store_false',
+                        dest='overlapStages', default=True,
+                        help='Run the wellness check and then the test ' +
+                             'cases instead of both at once')
+
+    parser.add_argument('--timings', action='store_true',
+                        dest='timings', default=False,
+                        help='Time each grading stage, reported under ' +
+                             "'timings' in the grade report")
+
     parser.add_argument('-v', '--version', action='version',
                         help='Show verion', version='1.01')
 
@@ -554,9 +1186,36 @@ def main(argv):
     except SystemExit:
         return -1
 
+    # Command line options win over the spec.
+    testcase_overrides = {}
+    if args.testMode is not None:
+        testcase_overrides['mode'] = args.testMode
+    if args.jobs is not None:
+        testcase_overrides['parallelism'] = args.jobs
+    if args.outputLimit is not None:
+        testcase_overrides['outputlimit'] = args.outputLimit
+    if args.failFast:
+        testcase_overrides['failfast'] = True
+    if args.maxFailures is not None:
+        testcase_overrides['maxfailures'] = args.maxFailures
+
+    result_cache = None
+    spec_cache = None
+    if args.useCache:
+        result_cache = ResultCache(result_cache_dir(args.cacheDir),
+                                   args.cacheSize * 1024 * 1024)
+        spec_cache = ResultCache(spec_cache_dir(args.cacheDir),
+                                 CACHE_MAX_BYTES)
+
     # we have the args.
     py_grade = PyGrade(args.configSpecFileName[0], args.userProgFileName[0],
-                       logging.WARN)
+                       logging.WARN, use_forkserver=args.useForkServer,
+                       testcase_overrides=testcase_overrides,
+                       result_cache=result_cache, spec_cache=spec_cache,
+                       use_inprocess_lint=args.inprocessLint)
+    py_grade.overlap_stages = args.overlapStages
+    if args.timings:
+        py_grade.enable_timings()
     py_grade.run()
 
 
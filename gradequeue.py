@@ -0,0 +1,642 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Module for a durable grading job queue, a SQLite database (in WAL
+   mode) that any number of worker processes on the box pull from. A
+   job is a user program and its spec, it is 'queued', 'running' on a
+   worker, then 'done' or 'failed'.
+
+   A worker leases the job it grades for a while and renews the lease
+   while grading. When a worker or the whole host dies, the lease runs
+   out and another worker grades the job again, so nothing is lost and
+   'work' picks up where it was after a crash.
+
+   A job whose grade was decided by an operational error (a test case
+   that could not be run, a Popen error, see Grade.operational_error())
+   goes back to the queue, up to max_attempts attempts. Results are kept
+   by the result cache key of the grade report (program, spec and grader)
+   and written once, only by the worker holding the job, a worker that
+   lost its lease drops its result.
+
+   Usage:
+     gradequeue.py add [ -q <queue> ] -s <yaml spec>
+                       ( -d <dir> | -g <glob> | -m <manifest> | <program> )
+     gradequeue.py work [ -q <queue> -w <workers> -j <jobs> ]
+     gradequeue.py status [ -q <queue> ]
+     gradequeue.py results [ -q <queue> -o <results file> ]
+"""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import sys
+import os
+
+# helper imports
+import argparse
+import json
+import logging
+import multiprocessing
+import signal
+import socket
+import sqlite3
+import threading
+import time
+
+import gradeserver
+from gradebatch import dump_result, find_submissions
+from gradecache import CACHE_DIR
+
+
+# Default queue database.
+QUEUE_PATH = os.path.join(CACHE_DIR, 'jobs.db')
+
+# Bump when the tables change.
+SCHEMA_VERSION = 1
+
+SCHEMA = ['''CREATE TABLE IF NOT EXISTS jobs (
+               id INTEGER PRIMARY KEY,
+               spec TEXT NOT NULL,
+               user_prog TEXT NOT NULL,
+               overrides TEXT NOT NULL,
+               state TEXT NOT NULL,
+               attempts INTEGER NOT NULL DEFAULT 0,
+               max_attempts INTEGER NOT NULL,
+               not_before REAL NOT NULL DEFAULT 0,
+               worker TEXT,
+               lease_until REAL,
+               result_key TEXT,
+               error TEXT,
+               created REAL NOT NULL,
+               updated REAL NOT NULL)''',
+          '''CREATE INDEX IF NOT EXISTS jobs_state
+               ON jobs (state, not_before)''',
+          '''CREATE TABLE IF NOT EXISTS results (
+               key TEXT PRIMARY KEY,
+               job_id INTEGER NOT NULL,
+               grade TEXT,
+               result TEXT,
+               report TEXT NOT NULL,
+               created REAL NOT NULL)''']
+
+# Job states.
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Attempts at a job by default.
+MAX_ATTEMPTS = 3
+
+# Seconds a lease lasts, renewed every third of that while grading.
+LEASE_SECONDS = 60.0
+
+# Seconds to wait before the next attempt, times the attempts so far.
+RETRY_DELAY = 5.0
+
+# Seconds between looks at an empty queue.
+POLL_INTERVAL = 0.5
+
+# Seconds to wait for a lock held by another worker.
+BUSY_TIMEOUT = 30.0
+
+
+class JobQueue(object):
+    """The job queue database. Each process, and each thread, opens its
+       own JobQueue.
+    """
+
+    def __str__(self):
+        return "JobQueue"
+
+    def __init__(self, path):
+        """Open the queue, creating it if needed.
+
+        Keyword arguments:
+        path -- SQLite database file.
+        """
+        self.path = path
+        # Transactions are explicit, see transaction().
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode a crash of the host may lose the last commits but
+        # never corrupts the queue, a lost result is graded again.
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            with self.transaction():
+                for statement in SCHEMA:
+                    self.db.execute(statement)
+                self.db.execute('PRAGMA user_version=%d' % SCHEMA_VERSION)
+
+    def close(self):
+        """Close the database."""
+        self.db.close()
+
+    def transaction(self):
+        """Context manager for a write transaction, taken up front so
+           two workers never lease the same job.
+        """
+        return _Transaction(self.db)
+
+    def add(self, config_spec, user_progs, overrides=None,
+            max_attempts=MAX_ATTEMPTS):
+        """Queue a job per user program, unless the program already has
+           a job queued or running for that spec.
+
+        Keyword arguments:
+        config_spec -- yaml spec.
+        user_progs -- user programs to grade.
+        overrides -- map of 'testcases' items to use instead of the spec's.
+        max_attempts -- attempts at each job.
+
+        Return values:
+        int -- number of jobs queued.
+        """
+        config_spec = os.path.abspath(config_spec)
+        overrides = json.dumps(overrides or {}, sort_keys=True)
+        now = time.time()
+        count = 0
+        with self.transaction():
+            for user_prog in user_progs:
+                user_prog = os.path.abspath(user_prog)
+                pending = self.db.execute(
+                    'SELECT 1 FROM jobs WHERE spec = ? AND user_prog = ? '
+                    'AND overrides = ? AND state IN (?, ?)',
+                    (config_spec, user_prog, overrides, QUEUED,
+                     RUNNING)).fetchone()
+                if pending is not None:
+                    continue
+                self.db.execute(
+                    'INSERT INTO jobs (spec, user_prog, overrides, state, '
+                    'max_attempts, created, updated) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (config_spec, user_prog, overrides, QUEUED,
+                     max_attempts, now, now))
+                count = count + 1
+        return count
+
+    def lease(self, worker, seconds=LEASE_SECONDS):
+        """Take the next job, a queued one or one whose lease ran out.
+
+        Keyword arguments:
+        worker -- name of the worker taking it.
+        seconds -- lease duration.
+
+        Return values:
+        map -- the job, see gradeserver.py, or None if there is none.
+        """
+        now = time.time()
+        with self.transaction():
+            while True:
+                row = self.db.execute(
+                    'SELECT id, spec, user_prog, overrides, state, '
+                    'attempts, max_attempts FROM jobs '
+                    'WHERE (state = ? AND not_before <= ?) '
+                    'OR (state = ? AND lease_until < ?) '
+                    'ORDER BY id LIMIT 1',
+                    (QUEUED, now, RUNNING, now)).fetchone()
+                if row is None:
+                    return None
+                job_id, config_spec, user_prog, overrides, state, \
+                    attempts, max_attempts = row
+                if state == RUNNING and attempts >= max_attempts:
+                    # Its workers died on every attempt, keep away.
+                    self.db.execute(
+                        'UPDATE jobs SET state = ?, worker = NULL, '
+                        'lease_until = NULL, error = ?, updated = ? '
+                        'WHERE id = ?',
+                        (FAILED, 'Lease expired %d times' % attempts, now,
+                         job_id))
+                    continue
+                self.db.execute(
+                    'UPDATE jobs SET state = ?, worker = ?, '
+                    'lease_until = ?, attempts = attempts + 1, '
+                    'updated = ? WHERE id = ?',
+                    (RUNNING, worker, now + seconds, now, job_id))
+                return {'id': job_id, 'spec': config_spec,
+                        'user_prog': user_prog,
+                        'overrides': json.loads(overrides),
+                        'attempt': attempts + 1, 'report': True}
+
+    def renew(self, job_id, worker, seconds=LEASE_SECONDS):
+        """Extend the lease of a job we are grading.
+
+        Return values:
+        bool -- False if the job is no longer ours.
+        """
+        now = time.time()
+        with self.transaction():
+            cursor = self.db.execute(
+                'UPDATE jobs SET lease_until = ?, updated = ? '
+                'WHERE id = ? AND worker = ? AND state = ?',
+                (now + seconds, now, job_id, worker, RUNNING))
+        return cursor.rowcount == 1
+
+    def release(self, job_id, worker):
+        """Put back a job we did not grade, e.g the worker is stopping,
+           without counting the attempt.
+        """
+        with self.transaction():
+            self.db.execute(
+                'UPDATE jobs SET state = ?, worker = NULL, '
+                'lease_until = NULL, attempts = attempts - 1, updated = ? '
+                'WHERE id = ? AND worker = ? AND state = ?',
+                (QUEUED, time.time(), job_id, worker, RUNNING))
+
+    def complete(self, job_id, worker, result, state=DONE):
+        """Record the result of a job, once. A worker that lost its
+           lease, the job was taken by another worker or queued again,
+           writes nothing.
+
+        Keyword arguments:
+        job_id -- job graded.
+        worker -- name of the worker that graded it.
+        result -- gradeserver.grade_job() record.
+        state -- DONE, or FAILED for a last attempt that had an
+                 operational error.
+
+        Return values:
+        bool -- False if the job is no longer ours.
+        """
+        now = time.time()
+        key = result.get('key') or 'job:%d' % job_id
+        with self.transaction():
+            cursor = self.db.execute(
+                'UPDATE jobs SET state = ?, worker = NULL, '
+                'lease_until = NULL, result_key = ?, error = ?, '
+                'updated = ? WHERE id = ? AND worker = ? AND state = ?',
+                (state, key, result.get('error'), now, job_id, worker,
+                 RUNNING))
+            if cursor.rowcount != 1:
+                return False
+            self.db.execute(
+                'INSERT OR IGNORE INTO results '
+                '(key, job_id, grade, result, report, created) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, job_id, result.get('grade'),
+                 json.dumps(result.get('result')),
+                 dump_result(result.get('report') or {}), now))
+        return True
+
+    def retry(self, job_id, worker, error, result=None):
+        """A job failed for an operational reason, queue it again unless
+           that was its last attempt.
+
+        Keyword arguments:
+        job_id -- job graded.
+        worker -- name of the worker that graded it.
+        error -- what went wrong.
+        result -- gradeserver.grade_job() record, if the job was graded,
+                  kept on the last attempt.
+
+        Return values:
+        bool -- True if the job was queued again.
+        """
+        now = time.time()
+        with self.transaction():
+            row = self.db.execute(
+                'SELECT attempts, max_attempts FROM jobs '
+                'WHERE id = ? AND worker = ? AND state = ?',
+                (job_id, worker, RUNNING)).fetchone()
+            if row is None:
+                return False
+            attempts, max_attempts = row
+            if attempts < max_attempts:
+                self.db.execute(
+                    'UPDATE jobs SET state = ?, worker = NULL, '
+                    'lease_until = NULL, not_before = ?, error = ?, '
+                    'updated = ? WHERE id = ?',
+                    (QUEUED, now + RETRY_DELAY * attempts, error, now,
+                     job_id))
+                return True
+            if result is None:
+                self.db.execute(
+                    'UPDATE jobs SET state = ?, worker = NULL, '
+                    'lease_until = NULL, error = ?, updated = ? '
+                    'WHERE id = ?', (FAILED, error, now, job_id))
+                return False
+
+        result = dict(result)
+        result['error'] = error
+        self.complete(job_id, worker, result, FAILED)
+        return False
+
+    def counts(self):
+        """Number of jobs in each state."""
+        counts = dict((state, 0) for state in (QUEUED, RUNNING, DONE,
+                                               FAILED))
+        for state, count in self.db.execute(
+                'SELECT state, COUNT(*) FROM jobs GROUP BY state'):
+            counts[state] = count
+        return counts
+
+    def results(self):
+        """Result record of every job, in the order they were queued.
+
+        Return values:
+        generator -- maps, the gradebatch.py record plus 'id', 'state',
+                     'attempts' and 'error'.
+        """
+        cursor = self.db.execute(
+            'SELECT jobs.id, jobs.user_prog, jobs.state, jobs.attempts, '
+            'jobs.error, results.grade, results.result, results.report '
+            'FROM jobs LEFT JOIN results ON jobs.result_key = results.key '
+            'ORDER BY jobs.id')
+        for job_id, user_prog, state, attempts, error, grade, result, \
+                report in cursor:
+            record = {'id': job_id, 'filename': user_prog, 'state': state,
+                      'attempts': attempts, 'error': error}
+            if report is not None:
+                record['status'] = 'done'
+                record['grade'] = grade
+                record['result'] = json.loads(result)
+                record['report'] = json.loads(report)
+            else:
+                record['status'] = 'error' if state == FAILED else state
+            yield record
+
+
+class _Transaction(object):
+    """BEGIN IMMEDIATE ... COMMIT, ROLLBACK on an exception."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.db.execute('COMMIT')
+        else:
+            self.db.execute('ROLLBACK')
+        return False
+
+
+class LeaseKeeper(threading.Thread):
+    """Renews the lease of the job being graded until stopped, with its
+       own connection since sqlite3 connections stay in their thread.
+    """
+
+    def __init__(self, path, job_id, worker, seconds):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.job_id = job_id
+        self.worker = worker
+        self.seconds = seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        queue = JobQueue(self.path)
+        try:
+            while not self.stopped.wait(self.seconds / 3.0):
+                try:
+                    if not queue.renew(self.job_id, self.worker,
+                                       self.seconds):
+                        break
+                except sqlite3.Error:
+                    pass    # try again, the lease outlasts a few misses.
+        finally:
+            queue.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def work(path, options, lease_seconds=LEASE_SECONDS, forever=False):
+    """Worker process, grades jobs until the queue has none left, or
+       until stopped if forever.
+
+    Keyword arguments:
+    path -- queue database.
+    options -- grader options, see gradeserver.main().
+    lease_seconds -- lease duration.
+    forever -- wait for more jobs once the queue is empty.
+
+    Return values:
+    int -- number of jobs graded.
+    """
+    gradeserver.init_worker(options)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    worker = '%s:%d' % (socket.gethostname(), os.getpid())
+    queue = JobQueue(path)
+    graded = 0
+    try:
+        while True:
+            job = queue.lease(worker, lease_seconds)
+            if job is None:
+                counts = queue.counts()
+                if not forever and counts[QUEUED] == 0 and \
+                   counts[RUNNING] == 0:
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            keeper = LeaseKeeper(path, job['id'], worker, lease_seconds)
+            keeper.start()
+            try:
+                result = gradeserver.grade_job(job)
+            except BaseException:
+                keeper.stop()
+                queue.release(job['id'], worker)
+                raise
+            keeper.stop()
+
+            if result['status'] != 'done':
+                queue.retry(job['id'], worker, result['error'])
+            elif result['operational_error']:
+                queue.retry(job['id'], worker,
+                            'Operational error, grade %s' % result['grade'],
+                            result)
+            else:
+                queue.complete(job['id'], worker, result)
+            graded = graded + 1
+    finally:
+        queue.close()
+        if gradeserver.WORKER.get('exec_pool') is not None:
+            gradeserver.WORKER['exec_pool'].close()
+    return graded
+
+
+def run_workers(path, options, workers, lease_seconds=LEASE_SECONDS,
+                forever=False):
+    """Run the worker processes until they are done, see work(). On
+       SIGTERM or SIGINT the workers put back the jobs they were grading.
+    """
+    processes = [multiprocessing.Process(target=work,
+                                         args=(path, options, lease_seconds,
+                                               forever))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in processes:
+        while process.is_alive():
+            process.join(POLL_INTERVAL)
+
+
+def main(argv):
+    """Parse the args and run the command.
+
+    Keyword arguments:
+    argv - user args.
+    """
+    description = 'Python function grader tool, job queue.'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-q', '--queue', dest='queue', default=QUEUE_PATH,
+                        help='Queue database, default %(default)s')
+    commands = parser.add_subparsers(dest='command')
+
+    add_parser = commands.add_parser('add', help='Queue user programs')
+    add_parser.add_argument('-s', '--spec', dest='configSpecFileName',
+                            required=True,
+                            help='Input spec for valuating user programs')
+    add_parser.add_argument('-d', '--dir', dest='directory',
+                            help='Queue every .py file in this directory')
+    add_parser.add_argument('-g', '--glob', dest='pattern',
+                            help='Queue every file matching this pattern')
+    add_parser.add_argument('-m', '--manifest', dest='manifest',
+                            help='File listing the user programs, one ' +
+                                 'per line')
+    add_parser.add_argument('--max-attempts', type=int, dest='maxAttempts',
+                            default=MAX_ATTEMPTS,
+                            help='Attempts at each job, default ' +
+                                 '%(default)s')
+    add_parser.add_argument('userProgs', nargs='*', metavar='user_prog',
+                            help='User programs to queue')
+
+    work_parser = commands.add_parser('work', help='Grade queued jobs')
+    work_parser.add_argument('-w', '--workers', type=int, dest='workers',
+                             default=multiprocessing.cpu_count(),
+                             help='User programs to grade at a time')
+    work_parser.add_argument('-j', '--jobs', type=int, dest='jobs',
+                             help='Test cases to run at a time')
+    work_parser.add_argument('--test-mode', dest='testMode',
+                             choices=['process', 'batched'],
+                             help='Run each test case in its own process ' +
+                                  'or all of them in one')
+    work_parser.add_argument('--lease', type=float, dest='lease',
+                             default=LEASE_SECONDS,
+                             help='Lease duration in seconds, default ' +
+                                  '%(default)s')
+    work_parser.add_argument('--forever', action='store_true',
+                             dest='forever', default=False,
+                             help='Wait for more jobs once the queue is ' +
+                                  'empty')
+    work_parser.add_argument('--no-forkserver', action='store_false',
+                             dest='useForkServer', default=True,
+                             help='Start a new interpreter for every ' +
+                                  'test case')
+    work_parser.add_argument('--no-cache', action='store_false',
+                             dest='useCache', default=True,
+                             help='Always grade, do not use the caches')
+    work_parser.add_argument('--cache-dir', dest='cacheDir',
+                             default=CACHE_DIR,
+                             help='Cache directory, default %(default)s')
+    work_parser.add_argument('--cache-size', type=int, dest='cacheSize',
+                             default=256,
+                             help='Result cache size limit in MB')
+    work_parser.add_argument('--lint-subprocess', action='store_false',
+                             dest='inprocessLint', default=True,
+                             help='Run pylint in a new process')
+    work_parser.add_argument('--no-overlap', action='store_false',
+                             dest='overlapStages', default=True,
+                             help='Run the wellness check and the test ' +
+                                  'cases one after the other')
+    work_parser.add_argument('--timings', action='store_true',
+                             dest='timings', default=False,
+                             help='Time each grading stage')
+
+    commands.add_parser('status', help='Number of jobs in each state')
+
+    results_parser = commands.add_parser('results',
+                                         help='Write the results, one ' +
+                                              'JSON line per job')
+    results_parser.add_argument('-o', '--output', dest='output',
+                                help='Results file, default stdout')
+
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit:
+        return -1
+
+    queue_dir = os.path.dirname(os.path.abspath(args.queue))
+    if not os.path.isdir(queue_dir):
+        os.makedirs(queue_dir)
+
+    if args.command == 'add':
+        submissions = find_submissions(args.directory, args.pattern,
+                                       args.manifest) + args.userProgs
+        if not submissions:
+            sys.stderr.write('No user programs to queue\n')
+            return -1
+        queue = JobQueue(args.queue)
+        count = queue.add(args.configSpecFileName, submissions,
+                          max_attempts=args.maxAttempts)
+        queue.close()
+        sys.stderr.write('Queued %d of %d user programs\n' %
+                         (count, len(submissions)))
+        return 0
+
+    if args.command == 'status':
+        queue = JobQueue(args.queue)
+        counts = queue.counts()
+        queue.close()
+        for state in (QUEUED, RUNNING, DONE, FAILED):
+            print ('%-8s : %d' % (state, counts[state]))
+        return 0
+
+    if args.command == 'results':
+        outfile = sys.stdout
+        if args.output is not None:
+            outfile = open(args.output, 'w')
+        queue = JobQueue(args.queue)
+        try:
+            for record in queue.results():
+                outfile.write(dump_result(record) + '\n')
+        finally:
+            queue.close()
+            if outfile is not sys.stdout:
+                outfile.close()
+        return 0
+
+    testcase_overrides = {}
+    if args.testMode is not None:
+        testcase_overrides['mode'] = args.testMode
+    if args.jobs is not None:
+        testcase_overrides['parallelism'] = args.jobs
+
+    options = {'log_level': logging.WARN,
+               'use_forkserver': args.useForkServer,
+               'jobs': args.jobs,
+               'testcase_overrides': testcase_overrides,
+               'cache_dir': args.cacheDir if args.useCache else None,
+               'cache_size': args.cacheSize * 1024 * 1024,
+               'inprocess_lint': args.inprocessLint,
+               'overlap_stages': args.overlapStages,
+               'timings': args.timings}
+
+    # Creates the queue before the workers race to.
+    JobQueue(args.queue).close()
+    start = time.time()
+    run_workers(args.queue, options, max(1, args.workers), args.lease,
+                args.forever)
+    sys.stderr.write('Done in %.2f seconds\n' % (time.time() - start))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
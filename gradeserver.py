@@ -0,0 +1,556 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Module for the grading daemon, a long running process that grades
+   user programs sent to it over a local Unix socket. The compiled
+   specs, the pylint linters and the fork server pools stay warm from
+   one job to the next, so a burst of submissions does not pay for a
+   cold start per program.
+
+   Protocol, one JSON object per line each way. A client sends jobs:
+     {"id": <any>, "spec": <yaml spec>, "user_prog": <program>,
+      "overrides": {<'testcases' items>}, "report": true}
+   paths are absolute, or relative to the directory of the daemon. Only
+   "spec" and "user_prog" are needed. Each job is answered, as soon as
+   it is graded so not in the order sent, with the result record of
+   gradebatch.py plus the "id":
+     {"id": ..., "filename": ..., "status": "done", "grade": ...,
+      "result": ..., "report": {...}, "key": ...,
+      "operational_error": false}
+   "key" is the result cache key of the program, spec and grader,
+   "operational_error" is true if the grade is worth another try, see
+   Grade.operational_error().
+   "status" is "error" (with "error") if the job could not be graded,
+   or was not answered within job_deadline seconds of being sent (its
+   worker died say), and "rejected" if the daemon already has
+   max_pending jobs.
+     {"op": "stats"} is answered with the daemon's counters.
+   The daemon closes the connection once the client has closed its end
+   and every job of the connection was answered.
+
+   Usage:
+     gradeserver.py serve [ -S <socket> -w <workers> -j <jobs> ]
+     gradeserver.py submit [ -S <socket> ] -s <yaml spec> <program> ...
+"""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import sys
+import os
+
+# helper imports
+import argparse
+import cPickle
+import functools
+import itertools
+import json
+import logging
+import multiprocessing
+import signal
+import socket
+import SocketServer
+import threading
+import time
+import Queue
+
+import gradelint
+import gradespec
+from gradebatch import dump_result
+from gradepython import PyGrade, PYTHON_EXEC
+from gradeworker import ForkServerPool
+from gradecache import ResultCache, CACHE_DIR, CACHE_MAX_BYTES, \
+    result_cache_dir, spec_cache_dir
+
+
+# Default socket path.
+SOCKET_PATH = os.path.join(CACHE_DIR, 'gradeserver.sock')
+
+# Jobs queued or being graded at most, more are rejected.
+MAX_PENDING = 4096
+
+# Seconds from when a job is sent until it is answered as lost, the pool
+# never answers a job whose worker died.
+JOB_DEADLINE = 3600
+
+# Seconds between checks for lost jobs.
+DEADLINE_CHECK = 1.0
+
+# Per worker process state, set up once by init_worker().
+WORKER = {}
+
+
+def init_worker(options):
+    """Worker process initializer, starts the fork servers and the
+       linter up front so the first job does not wait for them. Workers
+       leave the process group of the daemon, a signal to the group
+       must not kill a worker that holds the lock of the job queue.
+    """
+    os.setpgrp()
+    WORKER['options'] = options
+    WORKER['specs'] = {}
+    WORKER['exec_pool'] = None
+    WORKER['result_cache'] = None
+    WORKER['spec_cache'] = None
+    if options['cache_dir'] is not None:
+        WORKER['result_cache'] = ResultCache(
+            result_cache_dir(options['cache_dir']), options['cache_size'])
+        WORKER['spec_cache'] = ResultCache(
+            spec_cache_dir(options['cache_dir']), CACHE_MAX_BYTES)
+    if options['use_forkserver']:
+        try:
+            WORKER['exec_pool'] = ForkServerPool(PYTHON_EXEC,
+                                                 options['jobs'] or 1)
+        except Exception:
+            WORKER['exec_pool'] = None
+    if options['inprocess_lint']:
+        try:
+            gradelint.get_linter()
+        except Exception:
+            pass
+
+
+def compiled_spec(config_spec, overrides):
+    """The compiled spec, kept in this worker for as long as neither
+       the spec file nor its data file change.
+
+    Return values:
+    pair -- -1/0, error string/CompiledSpec
+    """
+    try:
+        stat = os.stat(config_spec)
+    except OSError as e:
+        return -1, str(e)
+    key = (config_spec, stat.st_mtime, stat.st_size,
+           json.dumps(overrides, sort_keys=True))
+    spec = WORKER['specs'].get(key)
+    if spec is not None and spec.test_source is not None and \
+       spec.test_source.changed():
+        spec = None     # its data file was edited.
+    if spec is None:
+        retval, spec = gradespec.load_spec(config_spec, overrides,
+                                           WORKER['spec_cache'])
+        if retval < 0:
+            return -1, spec
+        WORKER['specs'][key] = spec
+    return 0, spec
+
+
+def grade_job(job):
+    """Grade one job in this worker, never raises so every job gets its
+       answer.
+
+    Keyword arguments:
+    job -- map, see the module docstring.
+
+    Return values:
+    map -- result record, see gradebatch.grade_one().
+    """
+    result = {'id': job.get('id'), 'filename': job.get('user_prog')}
+    try:
+        options = WORKER['options']
+        overrides = dict(options['testcase_overrides'])
+        overrides.update(job.get('overrides') or {})
+        retval, spec = compiled_spec(job['spec'], overrides)
+        if retval < 0:
+            result['status'] = 'error'
+            result['error'] = spec
+            return result
+        if WORKER['exec_pool'] is not None:
+            WORKER['exec_pool'].grow(spec.test_jobs)
+
+        py_grade = PyGrade(job['spec'], job['user_prog'],
+                           options['log_level'],
+                           use_forkserver=options['use_forkserver'],
+                           exec_pool=WORKER['exec_pool'],
+                           testcase_overrides=overrides,
+                           compiled_spec=spec,
+                           result_cache=WORKER['result_cache'],
+                           use_inprocess_lint=options['inprocess_lint'])
+        py_grade.print_report = False
+        py_grade.overlap_stages = options['overlap_stages']
+        if options['timings']:
+            py_grade.enable_timings()
+        py_grade.run()
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+        return result
+
+    result['status'] = 'done'
+    result['grade'] = py_grade.grade_report.get('grade')
+    result['result'] = py_grade.eval_result
+    result['operational_error'] = py_grade.operational_error()
+    result['key'] = None
+    if py_grade.compiled_spec is not None:
+        result['key'] = py_grade.result_cache_key()
+    if job.get('report', True):
+        result['report'] = py_grade.grade_report
+    return result
+
+
+def run_job(job):
+    """grade_job() for the pool, whose callback only gets the results
+       that make it back. Anything grade_job() lets through, or a result
+       that cannot be pickled, is answered with an error record instead
+       so the client is never left waiting.
+    """
+    try:
+        result = grade_job(job)
+        cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+        return result
+    except BaseException as e:
+        return {'id': job.get('id'), 'filename': job.get('user_prog'),
+                'status': 'error', 'error': 'Grading failed : %r' % e}
+
+
+class GradeHandler(SocketServer.StreamRequestHandler):
+    """One client connection, jobs are read as they come and handed to
+       the worker pool. The results are queued as they complete and a
+       writer thread of the connection sends them, so a client slow to
+       read holds up no one else.
+    """
+
+    def handle(self):
+        self.lock = threading.Lock()
+        self.answered = threading.Condition(self.lock)
+        self.jobs = {}          # job number -> (job, deadline)
+        self.results = Queue.Queue()
+        writer = threading.Thread(target=self.write_results)
+        writer.daemon = True
+        writer.start()
+
+        numbers = itertools.count()
+        for line in iter(self.rfile.readline, ''):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict):
+                    raise ValueError('not an object')
+            except ValueError as e:
+                self.reply({'status': 'error', 'error': 'bad request : %s' %
+                            str(e)})
+                continue
+
+            if job.get('op') == 'stats':
+                self.reply(self.server.stats())
+                continue
+            if not isinstance(job.get('spec'), basestring) or \
+               not isinstance(job.get('user_prog'), basestring):
+                self.reply({'id': job.get('id'), 'status': 'error',
+                            'error': "job needs 'spec' and 'user_prog'"})
+                continue
+            if not self.server.job_start():
+                self.reply({'id': job.get('id'),
+                            'filename': job['user_prog'],
+                            'status': 'rejected'})
+                continue
+
+            number = next(numbers)
+            with self.lock:
+                self.jobs[number] = (job,
+                                     time.time() + self.server.job_deadline)
+            self.server.pool.apply_async(run_job, (job,),
+                                         callback=functools.partial(
+                                             self.job_done, number))
+
+        # The client is done sending, wait for the rest of its results,
+        # the writer answers the lost ones.
+        with self.answered:
+            while self.jobs:
+                self.answered.wait(DEADLINE_CHECK)
+        self.results.put(None)
+        writer.join()
+
+    def reply(self, record):
+        """Queue a record for the client, see write_results()."""
+        self.results.put(record)
+
+    def job_done(self, number, result, lost=False):
+        """Answer a job, from the result handler of the pool or as lost.
+           Only the first answer counts, the result of a job answered as
+           lost is dropped.
+        """
+        with self.answered:
+            if self.jobs.pop(number, None) is None:
+                return
+            self.reply(result)
+            self.answered.notify()
+        self.server.job_done(lost)
+
+    def expire_jobs(self):
+        """Answer the jobs past their deadline with an error."""
+        now = time.time()
+        with self.lock:
+            lost = [(number, job) for number, (job, deadline)
+                    in self.jobs.iteritems() if deadline <= now]
+        for number, job in lost:
+            self.job_done(number,
+                          {'id': job.get('id'),
+                           'filename': job.get('user_prog'),
+                           'status': 'error',
+                           'error': 'Not graded within %s seconds, the '
+                                    'job was lost' % self.server.job_deadline},
+                          lost=True)
+
+    def write_results(self):
+        """Writer thread, sends the queued records to the client until
+           handle() queues None. Once the client is gone the records are
+           dropped, the grades are still cached.
+        """
+        gone = False
+        check = time.time() + DEADLINE_CHECK
+        while True:
+            if time.time() >= check:
+                self.expire_jobs()
+                check = time.time() + DEADLINE_CHECK
+            try:
+                record = self.results.get(timeout=DEADLINE_CHECK)
+            except Queue.Empty:
+                continue
+            if record is None:
+                break
+            if gone:
+                continue
+            try:
+                self.wfile.write(dump_result(record) + '\n')
+                self.wfile.flush()
+            except (socket.error, IOError):
+                gone = True
+
+    def finish(self):
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except (socket.error, IOError):
+            pass    # client is gone, what it did not read is dropped.
+
+
+class GradeServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Unix socket server, a thread per connection, handing the jobs to a
+       pool of grading processes. The pool size is the global limit of
+       programs graded at a time, 'jobs' that of test cases per program.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, options, workers, max_pending=MAX_PENDING,
+                 job_deadline=JOB_DEADLINE):
+        """Start the workers and listen on path.
+
+        Keyword arguments:
+        path -- Unix socket path, a stale socket there is replaced.
+        options -- grader options, see main().
+        workers -- user programs to grade at a time.
+        max_pending -- jobs queued or being graded at most.
+        job_deadline -- seconds from when a job is sent until it is
+                        answered as lost.
+        """
+        self.pool = multiprocessing.Pool(workers, init_worker, (options,))
+        self.workers = workers
+        self.max_pending = max_pending
+        self.job_deadline = job_deadline
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.graded = 0
+        self.rejected = 0
+        self.lost = 0
+        self.started = time.time()
+        if os.path.exists(path):
+            os.unlink(path)
+        SocketServer.UnixStreamServer.__init__(self, path, GradeHandler)
+
+    def job_start(self):
+        """Count a new job, False if we are full."""
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected = self.rejected + 1
+                return False
+            self.pending = self.pending + 1
+            return True
+
+    def job_done(self, lost=False):
+        """Count a job answered, graded or lost."""
+        with self.lock:
+            self.pending = self.pending - 1
+            if lost:
+                self.lost = self.lost + 1
+            else:
+                self.graded = self.graded + 1
+
+    def stats(self):
+        """The daemon's counters, for the 'stats' request."""
+        with self.lock:
+            return {'op': 'stats',
+                    'workers': self.workers,
+                    'pending': self.pending,
+                    'graded': self.graded,
+                    'rejected': self.rejected,
+                    'lost': self.lost,
+                    'uptime': time.time() - self.started}
+
+    def close(self):
+        """Stop listening and stop the workers."""
+        self.server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+        self.pool.terminate()
+        self.pool.join()
+
+
+def submit(path, config_spec, user_progs, outfile, overrides=None):
+    """Send the user programs to the daemon and write the results to
+       outfile as they come, one JSON line each.
+
+    Return values:
+    int -- number of results received.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    wfile = client.makefile('wb')
+    for index, user_prog in enumerate(user_progs):
+        job = {'id': index, 'spec': os.path.abspath(config_spec),
+               'user_prog': os.path.abspath(user_prog)}
+        if overrides:
+            job['overrides'] = overrides
+        wfile.write(json.dumps(job) + '\n')
+    wfile.close()
+    client.shutdown(socket.SHUT_WR)
+
+    count = 0
+    rfile = client.makefile('rb')
+    for line in iter(rfile.readline, ''):
+        outfile.write(line)
+        outfile.flush()
+        count = count + 1
+    rfile.close()
+    client.close()
+    return count
+
+
+def main(argv):
+    """Parse the args, then serve or submit.
+
+    Keyword arguments:
+    argv - user args.
+    """
+    description = 'Python function grader daemon.'
+    parser = argparse.ArgumentParser(description=description)
+    commands = parser.add_subparsers(dest='command')
+
+    serve_parser = commands.add_parser('serve', help='Run the daemon')
+    serve_parser.add_argument('-S', '--socket', dest='socket',
+                              default=SOCKET_PATH,
+                              help='Unix socket, default %(default)s')
+    serve_parser.add_argument('-w', '--workers', action='store', type=int,
+                              dest='workers',
+                              default=multiprocessing.cpu_count(),
+                              help='User programs to grade at a time')
+    serve_parser.add_argument('-j', '--jobs', action='store', type=int,
+                              dest='jobs',
+                              help='Test cases to run at a time')
+    serve_parser.add_argument('--max-pending', action='store', type=int,
+                              dest='maxPending', default=MAX_PENDING,
+                              help='Jobs to queue at most, default ' +
+                                   '%(default)s')
+    serve_parser.add_argument('--job-deadline', action='store', type=float,
+                              dest='jobDeadline', default=JOB_DEADLINE,
+                              help='Seconds from when a job is sent until ' +
+                                   'it is answered as lost, default ' +
+                                   '%(default)s')
+    serve_parser.add_argument('--test-mode', action='store',
+                              dest='testMode',
+                              choices=['process', 'batched'],
+                              help='Run each test case in its own ' +
+                                   'process or all of them in one')
+    serve_parser.add_argument('--no-forkserver', action='store_false',
+                              dest='useForkServer', default=True,
+                              help='Start a new interpreter for every ' +
+                                   'test case')
+    serve_parser.add_argument('--no-cache', action='store_false',
+                              dest='useCache', default=True,
+                              help='Always grade, do not use the caches')
+    serve_parser.add_argument('--cache-dir', action='store',
+                              dest='cacheDir', default=CACHE_DIR,
+                              help='Cache directory, default %(default)s')
+    serve_parser.add_argument('--cache-size', action='store', type=int,
+                              dest='cacheSize', default=256,
+                              help='Result cache size limit in MB')
+    serve_parser.add_argument('--lint-subprocess', action='store_false',
+                              dest='inprocessLint', default=True,
+                              help='Run pylint in a new process')
+    serve_parser.add_argument('--no-overlap', action='store_false',
+                              dest='overlapStages', default=True,
+                              help='Run the wellness check and the test ' +
+                                   'cases one after the other')
+    serve_parser.add_argument('--timings', action='store_true',
+                              dest='timings', default=False,
+                              help='Time each grading stage')
+
+    submit_parser = commands.add_parser('submit',
+                                        help='Grade programs with the ' +
+                                             'daemon')
+    submit_parser.add_argument('-S', '--socket', dest='socket',
+                               default=SOCKET_PATH,
+                               help='Unix socket, default %(default)s')
+    submit_parser.add_argument('-s', '--spec', dest='configSpecFileName',
+                               required=True,
+                               help='Input spec for valuating user programs')
+    submit_parser.add_argument('userProgs', nargs='+', metavar='user_prog',
+                               help='User programs to grade')
+
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit:
+        return -1
+
+    if args.command == 'submit':
+        try:
+            submit(args.socket, args.configSpecFileName, args.userProgs,
+                   sys.stdout)
+        except socket.error as e:
+            sys.stderr.write('Cannot reach the daemon at %s : %s\n' %
+                             (args.socket, str(e)))
+            return -1
+        return 0
+
+    testcase_overrides = {}
+    if args.testMode is not None:
+        testcase_overrides['mode'] = args.testMode
+    if args.jobs is not None:
+        testcase_overrides['parallelism'] = args.jobs
+
+    options = {'log_level': logging.WARN,
+               'use_forkserver': args.useForkServer,
+               'jobs': args.jobs,
+               'testcase_overrides': testcase_overrides,
+               'cache_dir': args.cacheDir if args.useCache else None,
+               'cache_size': args.cacheSize * 1024 * 1024,
+               'inprocess_lint': args.inprocessLint,
+               'overlap_stages': args.overlapStages,
+               'timings': args.timings}
+
+    socket_dir = os.path.dirname(args.socket)
+    if socket_dir and not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir)
+
+    server = GradeServer(args.socket, options, max(1, args.workers),
+                         args.maxPending, args.jobDeadline)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    sys.stderr.write('Grading on %s with %d workers\n' %
+                     (args.socket, server.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,742 @@
+# -*- coding: utf-8 -*-
+
+"""Module for the compiled form of the yaml config spec."""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import os
+
+# helper library imports
+import collections
+import csv
+import hashlib
+import itertools
+import json
+import math
+import re
+import yaml
+import zipfile
+
+from gradecache import ResultCache
+from gradecompare import COMPARE_DEFAULTS
+from gradeperf import PERFORMANCE_DEFAULTS, GROWTH, growth_curve, \
+    fit_exponent
+
+
+# Bump when CompiledSpec changes, old cache entries are then ignored.
+SPEC_FORMAT = '8'
+
+# Python value for each spec type.
+ARG_CAST = {'string': str,
+            'integer': int,
+            'float': float,
+            'bool': bool,
+            'double': float,
+            'complex': complex,
+            'none': None}
+
+# Container types, with how many type parameters they take, None for
+# any number: 'list[integer]', 'tuple[string, float]', 'dict[string,
+# list[integer]]', 'ndarray[float]'. Without parameters the values are
+# taken as they are.
+CONTAINER_TYPES = {'list': (0, 1),
+                   'tuple': None,
+                   'dict': (0, 2),
+                   'ndarray': (0, 1)}
+
+# numpy dtype for each 'ndarray' element type.
+NDARRAY_DTYPES = {'integer': 'int64',
+                  'float': 'float64',
+                  'double': 'float64',
+                  'bool': 'bool',
+                  'complex': 'complex128'}
+
+TYPE_TOKEN = re.compile(r'\s*([A-Za-z_]+|\[|\]|,)\s*')
+
+# parse_type() results, by type name.
+PARSED_TYPES = {}
+
+# Bytes of user output we keep per test case by default.
+OUTPUT_LIMIT = 65536
+
+# Test data file formats, by file extension.
+DATA_FORMATS = ('.jsonl', '.csv', '.npy', '.npz')
+
+# Test case options that only decide how fast we grade.
+SCHEDULING_OPTIONS = ('parallelism',)
+
+
+# Everything Grade needs from the spec, validated and with the test
+# vectors already converted to their types. Treat the maps as read-only,
+# a compiled spec is shared by every grader of the same spec.
+CompiledSpec = collections.namedtuple('CompiledSpec', [
+    'digest',               # hash of the normalized spec and options
+    'code_spec',
+    'language',
+    'function_name',
+    'arg_count',
+    'arg_list',
+    'arg_type_list',
+    'return_type',
+    'max_file_size',
+    'max_grade',
+    'wellness_map',
+    'wellness_check_list',
+    'testcase_map',         # 'testcases' without input/output
+    'test_count',
+    'timeout_interval',
+    'test_mode',
+    'test_jobs',
+    'output_limit',         # bytes of user output kept, None for all
+    'compare_options',      # 'compare' map, see gradecompare, or None
+    'fail_fast',            # stop the tests once the grade is decided
+    'max_failures',         # failed tests that decide the grade, 0 none
+    'mem_limit',            # bytes of address space per test, or None
+    'cpu_limit',            # cpu seconds per test, or None
+    'performance',          # 'performance' map, see gradeperf, or None
+    'testcase_input',
+    'testcase_output',
+    'test_source',          # TestVectors of 'datafile' or None
+])
+
+
+def parse_type(type_name):
+    """Parse a spec type such as 'integer' or 'dict[string,
+       list[float]]'.
+
+    Return values:
+    pair -- type name, tuple of parsed type parameters
+
+    Raises ValueError if it is not a type we know.
+    """
+    parsed = PARSED_TYPES.get(type_name)
+    if parsed is not None:
+        return parsed
+
+    tokens = []
+    pos = 0
+    while pos < len(type_name):
+        match = TYPE_TOKEN.match(type_name, pos)
+        if match is None:
+            raise ValueError("unknown type '%s'" % type_name)
+        tokens.append(match.group(1))
+        pos = match.end()
+
+    def parse(pos):
+        if pos >= len(tokens):
+            raise ValueError("unknown type '%s'" % type_name)
+        name = tokens[pos]
+        params = []
+        pos = pos + 1
+        if pos < len(tokens) and tokens[pos] == '[':
+            while True:
+                param, pos = parse(pos + 1)
+                params.append(param)
+                if pos < len(tokens) and tokens[pos] == ']':
+                    pos = pos + 1
+                    break
+                if pos >= len(tokens) or tokens[pos] != ',':
+                    raise ValueError("unknown type '%s'" % type_name)
+        if name in ARG_CAST:
+            counts = (0,)
+        elif name in CONTAINER_TYPES:
+            counts = CONTAINER_TYPES[name]
+        else:
+            raise ValueError("unknown type '%s'" % type_name)
+        if counts is not None and len(params) not in counts:
+            raise ValueError("unknown type '%s'" % type_name)
+        if name == 'ndarray' and params and \
+           (params[0][1] or params[0][0] not in NDARRAY_DTYPES):
+            raise ValueError("unknown type '%s'" % type_name)
+        return (name, tuple(params)), pos
+
+    parsed, pos = parse(0)
+    if pos != len(tokens):
+        raise ValueError("unknown type '%s'" % type_name)
+    PARSED_TYPES[type_name] = parsed
+    return parsed
+
+
+def plain_value(value):
+    """A value as it is, with lists of lists and text as str."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [plain_value(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple([plain_value(v) for v in value])
+    if isinstance(value, dict):
+        return dict((plain_value(k), plain_value(v))
+                    for k, v in value.iteritems())
+    return value
+
+
+def convert_value(parsed, value):
+    """Convert a spec value to the parse_type() type, see cast_value()."""
+    name, params = parsed
+    if name in ARG_CAST:
+        cast = ARG_CAST[name]
+        if cast is None:
+            return None
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        else:
+            value = str(value)
+        return cast(value)
+
+    # A container given as text, i.e a csv field, is JSON.
+    if isinstance(value, basestring):
+        value = json.loads(value)
+
+    if name == 'ndarray':
+        import numpy
+        dtype = None
+        if params:
+            dtype = NDARRAY_DTYPES[params[0][0]]
+        if isinstance(value, numpy.ndarray):
+            # From a data file, no copy unless the dtype differs.
+            return numpy.asarray(value, dtype=dtype)
+        return numpy.array(plain_value(value), dtype=dtype)
+
+    if name == 'dict':
+        if not isinstance(value, dict):
+            raise TypeError('%s is not a dict' % (value,))
+        if not params:
+            return plain_value(value)
+        return dict((convert_value(params[0], k), convert_value(params[1], v))
+                    for k, v in value.iteritems())
+
+    if not isinstance(value, (list, tuple)):
+        raise TypeError('%s is not a %s' % (value, name))
+    if not params:
+        values = plain_value(list(value))
+    elif name == 'tuple' and len(params) > 1:
+        if len(value) != len(params):
+            raise ValueError('%s does not have %d items' %
+                             (value, len(params)))
+        values = [convert_value(param, v) for param, v in zip(params, value)]
+    else:
+        values = [convert_value(params[0], v) for v in value]
+    if name == 'tuple':
+        return tuple(values)
+    return values
+
+
+def cast_value(type_name, value):
+    """Convert a spec value to the python type of type_name, the same
+       way our test programs always did for the plain types, i.e
+       cast(str(value)). Containers are converted item by item.
+    """
+    return convert_value(parse_type(type_name), value)
+
+
+def npy_rows(fd):
+    """Shape of the .npy array in file fd and an iterator over its rows,
+       read from fd one at a time. The members of an .npz can not be
+       memory mapped, this way they are not read as a whole either.
+    """
+    import numpy
+    from numpy.lib import format as npy_format
+
+    version = npy_format.read_magic(fd)
+    if version == (1, 0):
+        header = npy_format.read_array_header_1_0(fd)
+    elif version == (2, 0):
+        header = npy_format.read_array_header_2_0(fd)
+    else:
+        raise ValueError('unsupported .npy version %d.%d' % version)
+    shape, fortran_order, dtype = header
+    if not shape:
+        raise ValueError('array has no rows')
+    if dtype.hasobject:
+        raise ValueError('object arrays are not supported')
+    if fortran_order:
+        # Its rows are not contiguous, read it as a whole.
+        array = numpy.frombuffer(bytearray(fd.read()), dtype)
+        return shape, iter(array.reshape(shape, order='F'))
+
+    row_shape = shape[1:]
+    row_bytes = dtype.itemsize * int(numpy.prod(row_shape))
+
+    def rows():
+        for _ in xrange(shape[0]):
+            row = bytearray(row_bytes)
+            if fd.readinto(row) != row_bytes:
+                raise ValueError('array data is truncated')
+            yield numpy.frombuffer(row, dtype).reshape(row_shape)
+    return shape, rows()
+
+
+class TestVectors(object):
+    """Test vectors kept in a data file, the 'datafile' of 'testcases',
+       read one test case at a time as the tests run so a spec with a
+       great many test cases is never in memory as a whole.
+
+       Formats, by file extension:
+         .jsonl -- a JSON line per test case, {"input": [...],
+                   "output": ...} or [ [...], ... ].
+         .csv   -- a row per test case, the arguments then the output.
+                   A first row with the argument names is skipped.
+         .npy   -- 2-D array, a row per test case, the arguments then
+                   the output. Memory mapped.
+         .npz   -- arrays 'input' and 'output', a row per test case.
+                   With one argument the row of 'input' is the
+                   argument, else it has one item per argument. Read
+                   a row at a time, ndarray values are kept as such.
+       The values are converted to the spec types as inline test
+       vectors are. Kept in the compiled spec, so only the path and what
+       we learned from scan() is kept here.
+    """
+
+    def __str__(self):
+        return "TestVectors"
+
+    def __init__(self, path, arg_list, arg_type_list, return_type):
+        """Init method.
+
+        Keyword arguments:
+        path -- test data file.
+        arg_list -- spec argument names.
+        arg_type_list -- spec argument types.
+        return_type -- spec return type.
+        """
+        self.path = path
+        self.fmt = os.path.splitext(path)[1].lower()
+        self.arg_list = tuple(arg_list)
+        self.arg_type_list = tuple(arg_type_list)
+        self.return_type = return_type
+        self.count = 0
+        self.digest = None
+        self.stamp = None
+
+    def stat(self):
+        """Size and mtime of the data file."""
+        st = os.stat(self.path)
+        return st.st_size, st.st_mtime
+
+    def changed(self):
+        """True if the data file changed since scan()."""
+        try:
+            return self.stat() != self.stamp
+        except OSError:
+            return True
+
+    def rows(self):
+        """Iterate over the raw (input, output) of each test case."""
+        arg_count = len(self.arg_type_list)
+        if self.fmt == '.jsonl':
+            with open(self.path, 'rb') as fd:
+                for line in fd:
+                    if not line.strip():
+                        continue
+                    row = json.loads(line)
+                    if isinstance(row, dict):
+                        yield row.get('input'), row.get('output')
+                    elif isinstance(row, list) and len(row) == 2:
+                        yield row[0], row[1]
+                    else:
+                        raise ValueError('bad test case %s' % line.strip())
+        elif self.fmt == '.csv':
+            with open(self.path, 'rb') as fd:
+                for index, row in enumerate(csv.reader(fd)):
+                    if index == 0 and arg_count > 0 and \
+                       tuple(row[:arg_count]) == self.arg_list:
+                        continue
+                    if len(row) != arg_count + 1:
+                        raise ValueError('bad test case %s' % row)
+                    yield row[:arg_count], row[arg_count]
+        elif self.fmt == '.npy':
+            import numpy
+            data = numpy.load(self.path, mmap_mode='r')
+            if data.ndim != 2 or data.shape[1] != arg_count + 1:
+                raise ValueError('array shape %s does not match argcount' %
+                                 (data.shape,))
+            for index in xrange(data.shape[0]):
+                row = data[index].tolist()
+                yield row[:arg_count], row[arg_count]
+        elif self.fmt == '.npz':
+            for row in self.npz_rows():
+                yield row
+        else:
+            raise ValueError('unknown test data format %s' % self.fmt)
+
+    def npz_rows(self):
+        """Iterate over the (input, output) of the test cases of an .npz,
+           see rows().
+        """
+        arg_count = len(self.arg_type_list)
+        arg_ndarray = [parse_type(type_name)[0] == 'ndarray'
+                       for type_name in self.arg_type_list]
+        return_ndarray = parse_type(self.return_type)[0] == 'ndarray'
+
+        def value(row, ndarray):
+            return row if ndarray else row.tolist()
+
+        with zipfile.ZipFile(self.path) as archive:
+            members = []
+            try:
+                for name in ('input', 'output'):
+                    try:
+                        members.append(archive.open(name + '.npy'))
+                    except KeyError:
+                        raise ValueError("no '%s' array" % name)
+                input_shape, inputs = npy_rows(members[0])
+                output_shape, outputs = npy_rows(members[1])
+                if input_shape[0] != output_shape[0]:
+                    raise ValueError('input and output arrays differ in '
+                                     'length')
+                for row, toutput in itertools.izip(inputs, outputs):
+                    if arg_count == 1 or row.ndim == 0:
+                        tinput = [row]
+                    else:
+                        tinput = list(row)
+                    if len(tinput) == arg_count:
+                        tinput = [value(t, ndarray) for t, ndarray
+                                  in zip(tinput, arg_ndarray)]
+                    yield tinput, value(toutput, return_ndarray)
+            finally:
+                for member in members:
+                    member.close()
+
+    def cast(self, tinput, toutput):
+        """Convert a test case to the spec types, see cast_value()."""
+        if tinput is not None:
+            if len(tinput) != len(self.arg_type_list):
+                raise ValueError('test input %s does not match argcount' %
+                                 (tinput,))
+            tinput = tuple([cast_value(type_name, t) for type_name, t
+                            in zip(self.arg_type_list, tinput)])
+        return tinput, cast_value(self.return_type, toutput)
+
+    def __iter__(self):
+        for tinput, toutput in self.rows():
+            yield self.cast(tinput, toutput)
+
+    def scan(self):
+        """Check every test case of the data file, one at a time, and
+           remember how many there are and the hash of the file.
+
+        Return values:
+        int -- number of test cases.
+        """
+        stamp = self.stat()
+        count = 0
+        for count, _ in enumerate(self, 1):
+            pass
+
+        digest = hashlib.sha256()
+        with open(self.path, 'rb') as fd:
+            for data in iter(lambda: fd.read(65536), ''):
+                digest.update(data)
+
+        self.count = count
+        self.digest = digest.hexdigest()
+        self.stamp = stamp
+        return count
+
+
+def spec_digest(code_spec, eval_spec, overrides, data_digest=None):
+    """Hash of the normalized spec, the scheduling options are left out
+       since they do not change a grade. data_digest is the hash of the
+       test data file, if the spec has one.
+    """
+    options = dict((k, v) for k, v in overrides.iteritems()
+                   if k not in SCHEDULING_OPTIONS)
+    spec = {'codespec': code_spec,
+            'evalspec': eval_spec,
+            'overrides': options}
+    if data_digest is not None:
+        spec['datafile'] = data_digest
+    data = yaml.safe_dump(spec)
+    return hashlib.sha256(data).hexdigest()
+
+
+def compile_performance(perf_map, name):
+    """Check the 'performance' map of 'evalspec' and fill in the
+       defaults, see gradeperf.
+
+    Return values:
+    pair -- -1/0, error string/map, with 'exponent' the growth exponent
+            of the reference over the sizes.
+    """
+    if not isinstance(perf_map, dict):
+        return -1, "conf_spec[%s] 'performance' is not a map" % name
+    for option in perf_map:
+        if option not in PERFORMANCE_DEFAULTS:
+            return -1, "conf_spec[%s] unknown performance option '%s'" % \
+                (name, option)
+    performance = dict(PERFORMANCE_DEFAULTS)
+    performance.update(perf_map)
+    try:
+        reference = performance['reference']
+        if reference not in GROWTH:
+            reference = float(reference)
+        performance['maxhit'] = int(performance['maxhit'])
+        if performance['error'] is None:
+            performance['error'] = performance['maxhit']
+        performance['error'] = int(performance['error'])
+        performance['threshold'] = float(performance['threshold'])
+        if performance['threshold'] <= 0:
+            raise ValueError('threshold should be > 0')
+        performance['sizes'] = sorted(set(int(n) for n in
+                                          performance['sizes']))
+        if len(performance['sizes']) < 2 or performance['sizes'][0] < 1:
+            raise ValueError('sizes should be two or more sizes >= 1')
+        performance['repeat'] = max(1, int(performance['repeat']))
+        performance['timeout'] = float(performance['timeout'])
+        performance['seed'] = int(performance['seed'])
+    except (ValueError, TypeError) as e:
+        return -1, "conf_spec[%s] bad performance option : %s" % \
+            (name, str(e))
+    curve = growth_curve(reference)
+    performance['exponent'] = fit_exponent(
+        performance['sizes'], [curve(n) for n in performance['sizes']])
+    return 0, performance
+
+
+def compile_spec(data_map, name, overrides=None, base_dir=None):
+    """Validate the parsed yaml spec and compile it.
+
+       TODO: This needs more spec checks? i.e reject a spec
+       if something is missing.
+
+       We do assume defaults for some items when not given.
+
+    Keyword arguments:
+    data_map -- parsed yaml spec.
+    name -- spec name for error messages.
+    overrides -- map of 'testcases' items to use instead of the spec's.
+    base_dir -- directory a 'datafile' is relative to, default that of
+                name.
+
+    Return values:
+    pair -- -1/0, error string/CompiledSpec
+    """
+    overrides = overrides or {}
+    if base_dir is None:
+        base_dir = os.path.dirname(name)
+    if not isinstance(data_map, dict):
+        return -1, "conf_spec[%s] is not a map" % name
+
+    code_spec = data_map.get('codespec')
+    eval_spec = data_map.get('evalspec')
+    if code_spec is None:
+        return -1, "conf_spec[%s] does not contain 'codespec'" % name
+
+    if eval_spec is None:
+        return -1, "conf_spec[%s] does not contain 'evalspec'" % name
+
+    if 'language' not in code_spec.keys():
+        return -1, "conf_spec[%s] does not contain 'language'" % name
+
+    if 'function' not in code_spec.keys():
+        return -1, "conf_spec[%s] does not contain 'function'" % name
+
+    arg_count = int(code_spec.get('argcount', 0))
+    arg_list = []
+    arg_type_list = []
+    if arg_count > 0:
+        # Parse only when arg_count > 0
+        if 'argnames' in code_spec.keys():
+            arg_list = code_spec['argnames'] or []
+
+            if 'argtypes' in code_spec.keys():
+                arg_type_list = code_spec['argtypes'] or []
+
+    if len(arg_list) != arg_count or \
+       len(arg_list) != len(arg_type_list):
+        return -1, 'conf_spec[%s] parse error, arg count mismatch' % name
+
+    return_type = code_spec.get('returntype') or ['bool']
+    for type_name in arg_type_list + [return_type[0]]:
+        try:
+            parse_type(type_name)
+        except (ValueError, TypeError):
+            return -1, "conf_spec[%s] unknown type '%s'" % (name, type_name)
+
+    wellness_map = eval_spec.get('wellness', {})
+    testcase_map = dict(eval_spec.get('testcases', {}))
+    testcase_map.update(overrides)
+
+    test_count = int(testcase_map.get('count', 0))
+    testcase_input = testcase_map.pop('input', [])
+    testcase_output = testcase_map.pop('output', [])
+    datafile = testcase_map.pop('datafile', None)
+
+    # Test vectors in a data file are checked here, one at a time, and
+    # read again as the tests run.
+    test_source = None
+    if datafile is not None:
+        if testcase_input or testcase_output:
+            return -1, "conf_spec [%s] has both 'datafile' and " \
+                "'input'/'output'" % name
+        if os.path.splitext(datafile)[1].lower() not in DATA_FORMATS:
+            return -1, "conf_spec[%s] unknown test data format '%s'" % \
+                (name, datafile)
+        test_source = TestVectors(os.path.join(base_dir, datafile),
+                                  arg_list, arg_type_list, return_type[0])
+        try:
+            rows = test_source.scan()
+        except ImportError as e:
+            return -1, 'conf_spec [%s] %s needs numpy : %s' % \
+                (name, datafile, str(e))
+        except (EnvironmentError, ValueError, TypeError, UnicodeError,
+                csv.Error) as e:
+            return -1, 'conf_spec [%s] parse error, bad test data in ' \
+                '%s : %s' % (name, datafile, str(e))
+        if 'count' not in testcase_map:
+            test_count = rows
+        elif rows != test_count:
+            return -1, 'conf_spec [%s] parse error, i/o mismatch' % name
+    elif 'testcases' in eval_spec.keys() and \
+        (len(testcase_input) != test_count or
+         len(testcase_input) != len(testcase_output)):
+        return -1, 'conf_spec [%s] parse error, i/o mismatch' % name
+
+    # Convert the test vectors once, here.
+    try:
+        inputs = []
+        for tinput in testcase_input:
+            if tinput is None:
+                inputs.append(None)
+                continue
+            if len(tinput) != arg_count:
+                return -1, 'conf_spec [%s] parse error, test input %s ' \
+                    'does not match argcount' % (name, tinput)
+            inputs.append(tuple([cast_value(type_name, t) for type_name, t
+                                 in zip(arg_type_list, tinput)]))
+        outputs = tuple([cast_value(return_type[0], toutput)
+                         for toutput in testcase_output])
+    except ImportError as e:
+        return -1, 'conf_spec [%s] ndarray needs numpy : %s' % \
+            (name, str(e))
+    except (ValueError, TypeError, UnicodeError) as e:
+        return -1, 'conf_spec [%s] parse error, bad test data : %s' % \
+            (name, str(e))
+
+    test_mode = testcase_map.get('mode', 'process')
+    if test_mode not in ('process', 'batched'):
+        return -1, "conf_spec[%s] unknown test mode '%s'" % (name, test_mode)
+
+    test_jobs = int(testcase_map.get('parallelism', 1))
+    if test_jobs < 1:
+        return -1, "conf_spec[%s] parallelism should be >= 1" % name
+
+    output_limit = int(testcase_map.get('outputlimit', OUTPUT_LIMIT))
+    if output_limit < 0:
+        return -1, "conf_spec[%s] outputlimit should be >= 0" % name
+
+    max_failures = int(testcase_map.get('maxfailures', 0))
+    if max_failures < 0:
+        return -1, "conf_spec[%s] maxfailures should be >= 0" % name
+    fail_fast = bool(testcase_map.get('failfast', False) or max_failures)
+
+    mem_limit = float(testcase_map.get('memlimit', 0))
+    if mem_limit < 0:
+        return -1, "conf_spec[%s] memlimit should be >= 0" % name
+    cpu_limit = float(testcase_map.get('cpulimit', 0))
+    if cpu_limit < 0:
+        return -1, "conf_spec[%s] cpulimit should be >= 0" % name
+
+    compare_options = None
+    compare = testcase_map.get('compare')
+    if compare is not None:
+        if not isinstance(compare, dict):
+            return -1, "conf_spec[%s] 'compare' is not a map" % name
+        for option in compare:
+            if option not in COMPARE_DEFAULTS:
+                return -1, "conf_spec[%s] unknown compare option '%s'" % \
+                    (name, option)
+        compare_options = dict(COMPARE_DEFAULTS)
+        compare_options.update(compare)
+        try:
+            for option in ('abstol', 'reltol'):
+                compare_options[option] = float(compare_options[option])
+                if compare_options[option] < 0:
+                    raise ValueError('%s should be >= 0' % option)
+        except (ValueError, TypeError) as e:
+            return -1, "conf_spec[%s] bad compare option : %s" % \
+                (name, str(e))
+        for option in ('unordered', 'strict'):
+            compare_options[option] = bool(compare_options[option])
+
+    performance = None
+    if eval_spec.get('performance') is not None:
+        retval, performance = compile_performance(eval_spec['performance'],
+                                                  name)
+        if retval < 0:
+            return -1, performance
+
+    return 0, CompiledSpec(
+        digest=spec_digest(code_spec, eval_spec, overrides,
+                           test_source and test_source.digest),
+        code_spec=code_spec,
+        language=code_spec['language'],
+        function_name=code_spec['function'],
+        arg_count=arg_count,
+        arg_list=tuple(arg_list),
+        arg_type_list=tuple(arg_type_list),
+        return_type=return_type,
+        max_file_size=int(code_spec.get('filesizelimit', 10)),
+        max_grade=int(eval_spec.get('grademax', 100)),
+        wellness_map=wellness_map,
+        wellness_check_list=tuple(wellness_map.keys()),
+        testcase_map=testcase_map,
+        test_count=test_count,
+        timeout_interval=float(testcase_map.get('timeout', 1)),
+        test_mode=test_mode,
+        test_jobs=test_jobs,
+        output_limit=output_limit or None,
+        compare_options=compare_options,
+        fail_fast=fail_fast,
+        max_failures=max_failures,
+        mem_limit=int(mem_limit * 1024 * 1024) or None,
+        cpu_limit=int(math.ceil(cpu_limit)) or None,
+        performance=performance,
+        testcase_input=tuple(inputs),
+        testcase_output=outputs,
+        test_source=test_source)
+
+
+def load_spec(config_spec, overrides=None, spec_cache=None):
+    """Read and compile the yaml spec file. The compiled spec is kept in
+       spec_cache keyed by the hash and the path of the spec file (a
+       relative datafile is relative to the spec), so the next load of
+       the same spec skips the yaml parsing and checks.
+
+    Keyword arguments:
+    config_spec -- yaml spec file.
+    overrides -- map of 'testcases' items to use instead of the spec's.
+    spec_cache -- ResultCache to keep compiled specs in, optional.
+
+    Return values:
+    pair -- -1/0, error string/CompiledSpec
+    """
+    overrides = overrides or {}
+    try:
+        with open(config_spec, 'rb') as fd:
+            spec_bytes = fd.read()
+    except Exception, e:
+        return -1, "Reading config_spec[%s]: %s" % (config_spec, str(e))
+
+    key = None
+    if spec_cache is not None:
+        key = ResultCache.make_key(['spec', SPEC_FORMAT, spec_bytes,
+                                    os.path.abspath(config_spec),
+                                    repr(sorted(overrides.items()))])
+        spec = spec_cache.get(key)
+        if spec is not None and (spec.test_source is None or
+                                 not spec.test_source.changed()):
+            return 0, spec
+
+    try:
+        data_map = yaml.safe_load(spec_bytes)
+    except Exception, e:
+        return -1, "Loading yaml config_spec [%s]: %s" % (config_spec, str(e))
+
+    retval, spec = compile_spec(data_map, config_spec, overrides)
+    if retval == 0 and key is not None:
+        spec_cache.put(key, spec)
+    return retval, spec
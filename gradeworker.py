@@ -0,0 +1,973 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Module for the pre-warmed python worker pool used to run test cases,
+   and the runner for batched test execution.
+"""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import sys
+import os
+
+# helper imports
+import collections
+import cPickle
+import cStringIO
+import errno
+import imp
+import itertools
+import marshal
+import mmap
+import resource
+import select
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import traceback
+import Queue
+
+import gradeharness
+
+
+# Size of each read from the child output pipe.
+READ_CHUNK = 65536
+
+# Most we take of a test result record, a record is a few KB at most.
+RESULT_LIMIT = 65536
+
+# Put where the middle of an output that went past its limit was.
+TRUNCATED_MARKER = '\n...[%d bytes truncated]...\n'
+
+# numpy arrays of at least this many bytes are handed to the test process
+# in shared memory, see SharedArrays.
+SHARED_MIN_BYTES = 1 << 20
+
+# Where SharedArrays keeps its files, in memory when we can.
+SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# What we measure of each test process, see usage_record().
+USAGE_FIELDS = ('wall', 'utime', 'stime', 'maxrss')
+
+
+class BoundedBuffer(object):
+    """File like buffer that keeps at most 'limit' bytes of what is
+       written to it, the first and the last limit/2 bytes. What was
+       dropped from the middle is replaced with TRUNCATED_MARKER.
+    """
+
+    def __init__(self, limit=None):
+        """Init method.
+
+        Keyword arguments:
+        limit -- bytes to keep, None to keep everything.
+        """
+        self.limit = limit
+        self.head = []
+        self.head_size = 0
+        self.tail = collections.deque()
+        self.tail_size = 0
+        self.dropped = 0
+        self.softspace = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8', 'replace')
+        if self.limit is None:
+            self.head.append(data)
+            return
+
+        room = self.limit // 2 - self.head_size
+        if room > 0:
+            self.head.append(data[:room])
+            self.head_size = self.head_size + len(data[:room])
+            data = data[room:]
+        if not data:
+            return
+
+        self.tail.append(data)
+        self.tail_size = self.tail_size + len(data)
+        tail_limit = self.limit - self.limit // 2
+        while self.tail_size - len(self.tail[0]) >= tail_limit:
+            dropped = len(self.tail.popleft())
+            self.tail_size = self.tail_size - dropped
+            self.dropped = self.dropped + dropped
+        cut = self.tail_size - tail_limit
+        if cut > 0:
+            self.tail[0] = self.tail[0][cut:]
+            self.tail_size = self.tail_size - cut
+            self.dropped = self.dropped + cut
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        """What we kept, with the marker if we had to drop some."""
+        value = ''.join(self.head)
+        if self.dropped:
+            value = value + TRUNCATED_MARKER % self.dropped
+        return value + ''.join(self.tail)
+
+
+def is_ndarray(obj):
+    """True for a numpy array, without importing numpy."""
+    return type(obj).__name__ == 'ndarray' and \
+        type(obj).__module__ == 'numpy'
+
+
+def arrays_in(obj):
+    """The numpy arrays in obj, at any depth of its lists, tuples and
+       dicts, each array once.
+    """
+    seen = {}
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if is_ndarray(obj):
+            seen.setdefault(id(obj), obj)
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.itervalues())
+    return seen.values()
+
+
+class SharedArrays(object):
+    """Hands the big numpy arrays of the tests to the test processes in
+       shared memory. Each array is written once to a file under
+       SHARED_DIR and the tests only refer to it, a test process maps the
+       file copy-on-write instead of getting a copy through its pipe.
+
+       share() and release() bracket the life of a test, once no test
+       that was shared holds an array its file is removed. A suite
+       streamed from a data file so never has more in SHARED_DIR than
+       the tests in flight.
+    """
+
+    def __init__(self, min_bytes=SHARED_MIN_BYTES, directory=None):
+        """Init method.
+
+        Keyword arguments:
+        min_bytes -- smallest array to share, smaller ones are copied.
+        directory -- where the files go, default SHARED_DIR.
+        """
+        self.min_bytes = min_bytes
+        self.directory = directory or SHARED_DIR
+        self.arrays = {}        # array_key() -> [array, reference, uses]
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def array_key(obj):
+        """Key of an array, its id alone may be that of an array gone, so
+           the address, type and shape of its data are part of it.
+        """
+        return (id(obj), obj.__array_interface__['data'][0],
+                obj.dtype.str, obj.shape)
+
+    def lookup(self, obj):
+        """Entry of a shared array, None if it is not shared."""
+        entry = self.arrays.get(self.array_key(obj))
+        if entry is None or entry[0] is not obj:
+            return None
+        return entry
+
+    def share(self, tests):
+        """Write the big arrays of the tests to SHARED_DIR, unless they
+           are there already, and count a use of each.
+        """
+        with self.lock:
+            for obj in arrays_in(tests):
+                if obj.nbytes < self.min_bytes or obj.dtype.hasobject:
+                    continue
+                entry = self.lookup(obj)
+                if entry is None:
+                    fd, path = tempfile.mkstemp(prefix='pygrade-',
+                                                suffix='.array',
+                                                dir=self.directory)
+                    with os.fdopen(fd, 'wb') as wfile:
+                        obj.tofile(wfile)
+                    # The entry keeps the array so its key stays its own.
+                    entry = [obj, ('ndarray', path, obj.dtype.str,
+                                   obj.shape), 0]
+                    self.arrays[self.array_key(obj)] = entry
+                entry[2] = entry[2] + 1
+
+    def release(self, tests):
+        """The test processes are done with these tests, remove the files
+           of their arrays no other test uses.
+        """
+        with self.lock:
+            for obj in arrays_in(tests):
+                entry = self.lookup(obj)
+                if entry is None:
+                    continue
+                entry[2] = entry[2] - 1
+                if entry[2] <= 0:
+                    del self.arrays[self.array_key(obj)]
+                    self.unlink(entry[1])
+
+    def persistent_id(self, obj):
+        """Pickler hook, the reference of a shared array, see
+           load_shared(). None for anything else, it is pickled as usual.
+        """
+        if not is_ndarray(obj):
+            return None
+        with self.lock:
+            entry = self.lookup(obj)
+        return entry[1] if entry is not None else None
+
+    @staticmethod
+    def unlink(reference):
+        """Remove the file of a shared array, a test process that mapped
+           it keeps its copy.
+        """
+        try:
+            os.unlink(reference[1])
+        except OSError:
+            pass
+
+    def close(self):
+        """Remove the files of the shared arrays."""
+        with self.lock:
+            for obj, reference, uses in self.arrays.itervalues():
+                self.unlink(reference)
+            self.arrays = {}
+
+
+def load_shared(reference):
+    """Unpickler hook, maps an array SharedArrays wrote. It is private to
+       this process, the user code may change it.
+    """
+    import numpy
+
+    kind, path, dtype, shape = reference
+    with open(path, 'rb') as rfile:
+        data = mmap.mmap(rfile.fileno(), 0, access=mmap.ACCESS_COPY)
+    return numpy.frombuffer(data, dtype).reshape(shape)
+
+
+def dump_tests(tests, shared=None):
+    """Serialize tests for a child, binary pickle so any test data goes
+       (lists, dicts, numpy arrays ...). The big arrays go by reference
+       when shared, a SharedArrays, is given.
+    """
+    out = cStringIO.StringIO()
+    pickler = cPickle.Pickler(out, cPickle.HIGHEST_PROTOCOL)
+    if shared is None:
+        pickler.dump(tests)
+        return out.getvalue()
+
+    # Shared for as long as the caller holds the tests, it gives them
+    # back with shared.release().
+    shared.share(tests)
+    pickler.persistent_id = shared.persistent_id
+    try:
+        pickler.dump(tests)
+    except BaseException:
+        shared.release(tests)
+        raise
+    return out.getvalue()
+
+
+def load_tests(data):
+    """Load dump_tests() tests."""
+    unpickler = cPickle.Unpickler(cStringIO.StringIO(data))
+    unpickler.persistent_load = load_shared
+    return unpickler.load()
+
+
+def worker_script():
+    """Path of this module as a script, used to start the workers."""
+    script = os.path.abspath(__file__)
+    if script.endswith(('.pyc', '.pyo')):
+        script = script[:-1]
+    return script
+
+
+def child_exit_code(code):
+    """Map a SystemExit code to a process exit status the same way the
+       interpreter does it when a script calls sys.exit().
+
+    Keyword arguments:
+    code -- SystemExit.code value.
+    """
+    if code is None:
+        return 0
+    if isinstance(code, (int, long)):
+        return int(code) & 0xff
+    try:
+        sys.stderr.write(str(code) + '\n')
+    except Exception:
+        pass
+    return 1
+
+
+class CodeImporter(object):
+    """Import hook serving modules from code objects we were handed, so
+       the child imports the user code without reading or compiling it
+       again and without writing bytecode next to it.
+    """
+
+    def __init__(self, modules):
+        """Init method.
+
+        Keyword arguments:
+        modules -- list of (module name, file name, code object).
+        """
+        self.modules = dict((name, (fname, code))
+                            for name, fname, code in modules)
+
+    def find_module(self, fullname, path=None):
+        if fullname in self.modules:
+            return self
+        return None
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+        fname, code = self.modules[fullname]
+        module = imp.new_module(fullname)
+        module.__file__ = fname
+        module.__loader__ = self
+        sys.modules[fullname] = module
+        try:
+            exec code in module.__dict__
+        except BaseException:
+            del sys.modules[fullname]
+            raise
+        return module
+
+
+def make_program(exec_fname, tests, modules=(), shared=None):
+    """Build a program to hand to a child, the tests to run are plain
+       data for gradeharness.run_test(), nothing is generated or
+       compiled per test.
+
+    Keyword arguments:
+    exec_fname -- name the program runs as, it is never written. Its
+                  directory is the child's sys.path[0].
+    tests -- list of gradeharness.run_test() argument tuples.
+    modules -- list of (module name, file name, code object) the tests
+               can import.
+    shared -- SharedArrays for the big arrays of the tests, optional.
+
+    Return values:
+    str -- the program, marshalled.
+    """
+    return marshal.dumps((exec_fname, dump_tests(tuple(tests), shared),
+                          tuple(modules)))
+
+
+def read_program(rfile):
+    """Read a '<length>\\n<program>' record, see make_program()."""
+    size = int(rfile.readline())
+    return rfile.read(size)
+
+
+def write_test(wfile, test, shared=None):
+    """Write one more test for a batch child, '<length>\\n<test>', see
+       run_batch().
+    """
+    data = dump_tests(test, shared)
+    wfile.write('%d\n' % len(data))
+    wfile.write(data)
+    wfile.flush()
+
+
+def read_test(rfile):
+    """Read a write_test() test, None once there are no more."""
+    header = rfile.readline()
+    if not header:
+        return None
+    return load_tests(rfile.read(int(header)))
+
+
+def setup_program(program):
+    """Prepare this process to run the given marshalled program, we
+       mimic 'python <exec_fname>' as close as we can.
+
+    Return values:
+    list -- the tests of the program
+    """
+    exec_fname, tests, modules = marshal.loads(program)
+    sys.dont_write_bytecode = True
+    sys.argv = [exec_fname]
+    sys.path[0] = os.path.dirname(exec_fname)
+    sys.meta_path.insert(0, CodeImporter(modules))
+    return load_tests(tests)
+
+
+def write_result(wfile, record):
+    """Write one test result record, '<length>\\n<marshalled record>'."""
+    data = marshal.dumps(record)
+    wfile.write('%d\n' % len(data))
+    wfile.write(data)
+    wfile.flush()
+
+
+def read_result(data):
+    """Parse a write_result() record.
+
+    Return values:
+    map -- the record, None if there is none or it is cut short.
+    """
+    header, sep, data = data.partition('\n')
+    try:
+        if not sep or len(data) != int(header):
+            return None
+        record = marshal.loads(data)
+    except (ValueError, EOFError, TypeError):
+        return None
+    if not isinstance(record, dict):
+        return None
+    return record
+
+
+def open_result_channel():
+    """Our stdout becomes the result channel, only the harness writes
+       to it. Whatever the user code prints goes to stderr, the output
+       channel.
+
+    Return values:
+    file -- the result channel.
+    """
+    result = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    return result
+
+
+def exec_main(program):
+    """Runs the first test of the given program inside a freshly forked
+       child. The test result is written to stdout, see
+       open_result_channel().
+
+    Keyword arguments:
+    program -- marshalled program, see make_program().
+
+    Return values:
+    int -- exit status of the test.
+    """
+    try:
+        result = open_result_channel()
+        tests = setup_program(program)
+        gradeharness.run_test(*tests[0],
+                              report=lambda r: write_result(result, r))
+        code = 0
+    except SystemExit as e:
+        code = child_exit_code(e.code)
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    except Exception:
+        pass
+    return code
+
+
+def set_limits(mem_limit=None, cpu_limit=None):
+    """Cap the resources of this process, called in the test process
+       before the user code runs. Going over the cpu limit gets us
+       SIGXCPU, and SIGKILL a second later if that is caught. Going over
+       the memory limit makes allocations fail, i.e MemoryError.
+
+    Keyword arguments:
+    mem_limit -- bytes of address space (RLIMIT_AS), None for no limit.
+    cpu_limit -- cpu seconds (RLIMIT_CPU), None for no limit.
+    """
+    if mem_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (mem_limit, mem_limit))
+    if cpu_limit:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
+
+
+def usage_record(wall, rusage):
+    """What a test process used, from its resource.struct_rusage.
+
+    Return values:
+    map -- wall   -- wall clock seconds.
+           utime  -- user cpu seconds.
+           stime  -- system cpu seconds.
+           maxrss -- peak resident set size in KB.
+    """
+    return {'wall': wall,
+            'utime': rusage.ru_utime,
+            'stime': rusage.ru_stime,
+            'maxrss': rusage.ru_maxrss}
+
+
+def reap_child(pid, block=False):
+    """Reap a child of ours with its resource usage.
+
+    Keyword arguments:
+    pid -- the child.
+    block -- wait for it to exit.
+
+    Return values:
+    pair -- os.waitpid() style status, resource.struct_rusage, or None
+            if the child is still running.
+    """
+    wpid, status, rusage = os.wait4(pid, 0 if block else os.WNOHANG)
+    if wpid == 0:
+        return None
+    return status, rusage
+
+
+def wait_status_code(status):
+    """Convert os.waitpid() status to Popen style returncode, i.e
+       negative signal number if the child was killed.
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def kill_child(pid):
+    """Kill the child and everything it spawned, child runs in its own
+       process group.
+    """
+    for kill in (lambda: os.killpg(pid, signal.SIGKILL),
+                 lambda: os.kill(pid, signal.SIGKILL)):
+        try:
+            kill()
+            return
+        except OSError:
+            continue
+
+
+def drain_until_exit(rfds, poll, deadline, limits=None):
+    """Wait for a child without any fixed sleep interval, we block in
+       select() on the child's output pipes so the child's output (and
+       EOF when it exits) wakes us up right away. The pipes are drained
+       while the child runs so a chatty child never blocks on a full
+       pipe, and we keep no more than the limit of each pipe (head and
+       tail) so it cannot run us out of memory either.
+
+       After EOF the child is reaped, that is almost always immediate so
+       we back off from a few microseconds only if it is not.
+
+    Keyword arguments:
+    rfds -- read ends of the child's pipes.
+    poll -- callable, returns the child exit status or None if running.
+    deadline -- time.time() by which the child has to be done.
+    limits -- bytes to keep of each pipe, None for no limit.
+
+    Return values:
+    tuple -- list of output per pipe, exit status from poll() or None,
+             timedout
+    """
+    limits = limits or [None] * len(rfds)
+    chunks = dict((rfd, BoundedBuffer(limit))
+                  for rfd, limit in zip(rfds, limits))
+    outputs = lambda: [chunks[rfd].getvalue() for rfd in rfds]
+    pending = list(rfds)
+    while pending:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return outputs(), None, True
+        try:
+            ready, _, _ = select.select(pending, [], [], remaining)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for rfd in ready:
+            data = os.read(rfd, READ_CHUNK)
+            if not data:
+                pending.remove(rfd)
+                continue
+            chunks[rfd].write(data)
+
+    delay = 0.00005
+    while True:
+        status = poll()
+        if status is not None:
+            return outputs(), status, False
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return outputs(), None, True
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.005)
+
+
+def run_child(program, timeout, limit=None, mem_limit=None,
+              cpu_limit=None):
+    """Fork a child from this warm template and run the given program in
+       it. The test result and the child's output are collected via a
+       pipe each, the child is killed once it runs past 'timeout'
+       seconds.
+
+    Keyword arguments:
+    program -- marshalled program to run in the child.
+    timeout -- max allowed run time in seconds.
+    limit -- bytes to keep of the child's output, None for all.
+    mem_limit, cpu_limit -- caps for the child, see set_limits().
+
+    Return values:
+    tuple -- returncode, result record data, output, timedout, usage
+             (see usage_record())
+    """
+    rfd, wfd = os.pipe()
+    out_rfd, out_wfd = os.pipe()
+    start = time.time()
+    pid = os.fork()
+    if pid == 0:
+        # Child, never return from here.
+        code = 1
+        try:
+            os.setpgid(0, 0)
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.dup2(wfd, 1)
+            os.dup2(out_wfd, 2)
+            for fd in (devnull, rfd, wfd, out_rfd, out_wfd):
+                os.close(fd)
+            set_limits(mem_limit, cpu_limit)
+            code = exec_main(program)
+        finally:
+            os._exit(code)
+
+    os.close(wfd)
+    os.close(out_wfd)
+
+    (result, output), reaped, timedout = \
+        drain_until_exit([rfd, out_rfd], lambda: reap_child(pid),
+                         start + timeout, [RESULT_LIMIT, limit])
+    if timedout:
+        kill_child(pid)
+        reaped = reap_child(pid, True)
+    status, rusage = reaped
+
+    os.close(rfd)
+    os.close(out_rfd)
+    return (wait_status_code(status), result, output, timedout,
+            usage_record(time.time() - start, rusage))
+
+
+def serve(rfile, wfile):
+    """Fork server loop, reads one request per line and replies with the
+       result of running it.
+
+    Request  : '<timeout> <output limit> <memory limit> <cpu limit>'
+               '\\n<program length>\\n<program>'
+               output limit is -1 for no limit, the others 0.
+    Response : '<returncode> <timedout> <result length> <output length>'
+               ' <wall> <utime> <stime> <maxrss>\\n<result><output>'
+    """
+    while True:
+        line = rfile.readline()
+        if not line:
+            break
+        timeout, limit, mem_limit, cpu_limit = line.split()
+        limit = int(limit)
+        program = read_program(rfile)
+        returncode, result, output, timedout, usage = \
+            run_child(program, float(timeout), limit if limit >= 0 else None,
+                      int(mem_limit) or None, int(cpu_limit) or None)
+        wfile.write('%d %d %d %d %r %r %r %d\n' %
+                    ((returncode, int(timedout), len(result), len(output)) +
+                     tuple(usage[k] for k in USAGE_FIELDS)))
+        wfile.write(result)
+        wfile.write(output)
+        wfile.flush()
+
+
+class ForkServer(object):
+    """Client side of a single fork server process.
+
+       The server is a python process that has already paid the interpreter
+       startup and imports, for every test it forks a fresh child from this
+       warm template. So each test still runs in its own process.
+    """
+
+    def __str__(self):
+        return "ForkServer"
+
+    def __init__(self, python_exec):
+        """Start the server process.
+
+        Keyword arguments:
+        python_exec -- python interpreter to use.
+        """
+        self.proc = subprocess.Popen([python_exec, worker_script()],
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     close_fds=True)
+
+    def alive(self):
+        """True if the server process is still running."""
+        return self.proc.poll() is None
+
+    def run(self, program, timeout, limit=None, mem_limit=None,
+            cpu_limit=None):
+        """Run the given program in a child forked by the server.
+
+        Keyword arguments:
+        program -- marshalled program, see make_program().
+        timeout -- max allowed run time in seconds.
+        limit -- bytes to keep of the child's output, None for all.
+        mem_limit, cpu_limit -- caps for the child, see set_limits().
+
+        Return values:
+        tuple -- returncode, result record data, output, timedout, usage
+                 (see usage_record())
+
+        Raises IOError when the server is gone.
+        """
+        if limit is None:
+            limit = -1
+        self.proc.stdin.write('%r %d %d %d\n%d\n' %
+                              (float(timeout), limit, mem_limit or 0,
+                               cpu_limit or 0, len(program)))
+        self.proc.stdin.write(program)
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline()
+        if not header:
+            raise IOError('fork server exited')
+        header = header.split()
+        returncode, timedout, rsize, size = [int(x) for x in header[:4]]
+        usage = dict(zip(USAGE_FIELDS, [float(x) for x in header[4:7]] +
+                         [int(header[7])]))
+        result = self.proc.stdout.read(rsize)
+        output = self.proc.stdout.read(size)
+        if len(result) != rsize or len(output) != size:
+            raise IOError('fork server short read')
+        return returncode, result, output, bool(timedout), usage
+
+    def close(self):
+        """Stop the server process."""
+        try:
+            self.proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            self.proc.wait()
+        except Exception:
+            pass
+
+
+class ForkServerPool(object):
+    """Bounded pool of fork servers, safe to be used from multiple
+       threads. A server that died is replaced on the next use.
+    """
+
+    def __str__(self):
+        return "ForkServerPool"
+
+    def __init__(self, python_exec, size=1):
+        """Start 'size' fork servers.
+
+        Keyword arguments:
+        python_exec -- python interpreter to use.
+        size -- number of servers, i.e how many tests can run at once.
+        """
+        self.python_exec = python_exec
+        self.size = size
+        self.idle = Queue.Queue()
+        self.lock = threading.Lock()
+        self.servers = []
+        for _ in range(size):
+            server = ForkServer(python_exec)
+            self.servers.append(server)
+            self.idle.put(server)
+
+    def run(self, program, timeout, limit=None, mem_limit=None,
+            cpu_limit=None):
+        """Hand the test to an idle server, blocks until one is available.
+
+        Return values:
+        tuple -- returncode, result record data, output, timedout, usage
+
+        Raises IOError/OSError if the server died while running the test.
+        """
+        server = self.idle.get()
+        try:
+            if not server.alive():
+                server = self.__replace(server)
+            return server.run(program, timeout, limit, mem_limit, cpu_limit)
+        finally:
+            self.idle.put(server)
+
+    def grow(self, size):
+        """Start more servers, up to 'size' in all, for a spec that runs
+           more tests at once than the pool was started for.
+        """
+        with self.lock:
+            while self.size < size:
+                server = ForkServer(self.python_exec)
+                self.servers.append(server)
+                self.idle.put(server)
+                self.size = self.size + 1
+
+    def __replace(self, server):
+        """Swap a dead server with a new one."""
+        server.close()
+        new_server = ForkServer(self.python_exec)
+        with self.lock:
+            self.servers[self.servers.index(server)] = new_server
+        return new_server
+
+    def close(self):
+        """Stop all the servers."""
+        with self.lock:
+            for server in self.servers:
+                server.close()
+            self.servers = []
+
+
+class TestTimeout(BaseException):
+    """Raised in the batch runner when a test runs past its timeout, a
+       BaseException so a plain 'except Exception' in user code does not
+       swallow it.
+    """
+    pass
+
+
+class TestCpuLimit(BaseException):
+    """Raised in the batch runner when a test runs past its cpu limit."""
+    pass
+
+
+def on_test_timeout(signum, frame):
+    """SIGALRM handler for the batch runner."""
+    raise TestTimeout()
+
+
+def on_test_cpu_limit(signum, frame):
+    """SIGPROF handler for the batch runner."""
+    raise TestCpuLimit()
+
+
+def run_batch(rfile, timeout, start=0, limit=None, mem_limit=None,
+              cpu_limit=None):
+    """Batch runner, runs every test of the program from 'start' onwards
+       in this process, the user module is imported once by the first
+       test. Each test gets 'timeout' seconds enforced with an interval
+       timer.
+
+       The program is read from rfile, followed by more tests one at a
+       time (see write_test()) until EOF, so the parent can stream a
+       great many tests through without either side holding them all.
+
+       One record is streamed on the original stdout per test, with the
+       test result record (see write_result()) and the user prints,
+       captured per test:
+         '<index> <done|timeout|cpulimit> <exit code> <result length>'
+         ' <output length> <wall> <utime> <stime> <maxrss>'
+         '\\n<result><output>'
+       The usage is that of the test (see usage_record()), but for
+       maxrss, the peak of the batch process so far.
+
+    Keyword arguments:
+    rfile -- file to read the program and the tests from.
+    timeout -- max allowed run time per test in seconds.
+    start -- index of the first test to run.
+    limit -- bytes to keep of the user prints per test, None for all.
+    mem_limit -- bytes of address space for the whole batch process.
+    cpu_limit -- cpu seconds per test.
+    """
+    # Keep the record channel private, anything the user writes to the
+    # real stdout/stderr goes nowhere.
+    out = os.fdopen(os.dup(1), 'wb')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    os.close(devnull)
+
+    tests = itertools.chain(setup_program(read_program(rfile)),
+                            iter(lambda: read_test(rfile), None))
+
+    set_limits(mem_limit)
+    signal.signal(signal.SIGALRM, on_test_timeout)
+    # RLIMIT_CPU would count the whole batch, a profiling timer counts
+    # the cpu time of each test.
+    signal.signal(signal.SIGPROF, on_test_cpu_limit)
+    for index, test in enumerate(tests):
+        if index < start:
+            continue
+        buf = BoundedBuffer(limit)
+        result = BoundedBuffer(RESULT_LIMIT)
+        sys.stdout = sys.stderr = buf
+        status = 'done'
+        code = 0
+        begin = time.time()
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            try:
+                if cpu_limit:
+                    signal.setitimer(signal.ITIMER_PROF, cpu_limit)
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+                gradeharness.run_test(
+                    *test, report=lambda r: write_result(result, r))
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.setitimer(signal.ITIMER_PROF, 0)
+        except TestTimeout:
+            status = 'timeout'
+        except TestCpuLimit:
+            status = 'cpulimit'
+        except SystemExit as e:
+            code = child_exit_code(e.code)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        sys.stdout = sys.__stdout__
+        sys.stderr = sys.__stderr__
+
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        usage = {'wall': time.time() - begin,
+                 'utime': after.ru_utime - before.ru_utime,
+                 'stime': after.ru_stime - before.ru_stime,
+                 'maxrss': after.ru_maxrss}
+
+        output = buf.getvalue()
+        result = result.getvalue()
+        out.write('%d %s %d %d %d %r %r %r %d\n' %
+                  ((index, status, code, len(result), len(output)) +
+                   tuple(usage[k] for k in USAGE_FIELDS)))
+        out.write(result)
+        out.write(output)
+        out.flush()
+
+    out.close()
+    return 0
+
+
+def run_exec(program, mem_limit=None, cpu_limit=None):
+    """Run the program in this process, for when there is no fork
+       server. The test result goes to our stdout and the user output to
+       our stderr.
+    """
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    set_limits(mem_limit, cpu_limit)
+    return exec_main(program)
+
+
+if __name__ == '__main__':
+    # The program to run comes in on stdin, see make_program().
+    sys.dont_write_bytecode = True
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        # Our own file on stdin, sys.stdin is pointed at devnull.
+        # batch <timeout> <start> <output limit> <memory> <cpu limit>
+        limit = int(sys.argv[4])
+        sys.exit(run_batch(os.fdopen(os.dup(0), 'rb'), float(sys.argv[2]),
+                           int(sys.argv[3]), limit if limit >= 0 else None,
+                           int(sys.argv[5]) or None, int(sys.argv[6]) or None))
+    if len(sys.argv) > 1 and sys.argv[1] == 'exec':
+        # exec [ <memory limit> <cpu limit> ], 0 for no limit.
+        limits = [int(x) or None for x in sys.argv[2:4]]
+        sys.exit(run_exec(read_program(sys.stdin), *limits))
+    serve(sys.stdin, sys.stdout)
@@ -7,6 +7,7 @@
 ./gradepython.py -s test4/code_spec.yaml -u test4/test.py > test4.report
 ./gradepython.py -s test5/code_spec.yaml -u test5/test.py > test5.report
 ./gradepython.py -s test6/code_spec.yaml -u test6/test.py > test6.report
+./gradepython.py -s test8/code_spec.yaml -u test8/test.py > test8.report
 
 cat test.report >> all.report
 cat test1.report >> all.report
@@ -15,5 +16,6 @@ cat test3.report >> all.report
 cat test4.report >> all.report
 cat test5.report >> all.report
 cat test6.report >> all.report
+cat test8.report >> all.report
 
 
@@ -0,0 +1,10 @@
+"""
+Keep pylint happy!
+"""
+
+def pairs(count):
+    """
+    Tuples, the spec expects lists.
+    """
+
+    return tuple((index, index) for index in range(count))
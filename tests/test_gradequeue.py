@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the leases of the grading job queue.
+
+   Usage: python -m unittest discover tests
+"""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import sys
+import os
+
+# helper imports
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import gradequeue
+
+
+def graded(grade):
+    """A gradeserver.grade_job() record."""
+    return {'status': 'done', 'grade': grade, 'result': 1.0,
+            'key': 'key', 'report': {'grade': grade}}
+
+
+class LeaseTest(unittest.TestCase):
+    """Results of workers that lost their lease are dropped."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='pygrade_queue_')
+        self.queue = gradequeue.JobQueue(os.path.join(self.workdir,
+                                                      'jobs.db'))
+        self.queue.add('spec.yaml', ['user_prog.py'])
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.workdir)
+
+    def test_expired_lease_reclaimed(self):
+        first = self.queue.lease('first', -1.0)    # expired right away
+        second = self.queue.lease('second')
+        self.assertEqual(first['id'], second['id'])
+        self.assertEqual(second['attempt'], 2)
+
+        self.assertFalse(self.queue.complete(first['id'], 'first',
+                                             graded('1.0/100.0')))
+        self.assertEqual(self.queue.counts()[gradequeue.RUNNING], 1)
+        self.assertTrue(self.queue.complete(second['id'], 'second',
+                                            graded('2.0/100.0')))
+        self.assertFalse(self.queue.complete(first['id'], 'first',
+                                             graded('1.0/100.0')))
+
+        results = list(self.queue.results())
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['grade'], '2.0/100.0')
+        self.assertEqual(results[0]['state'], gradequeue.DONE)
+
+    def test_requeued_job(self):
+        job = self.queue.lease('first')
+        self.assertTrue(self.queue.retry(job['id'], 'first', 'Popen'))
+        self.assertFalse(self.queue.complete(job['id'], 'first',
+                                             graded('1.0/100.0')))
+        self.assertEqual(self.queue.counts()[gradequeue.QUEUED], 1)
+        self.assertEqual(list(self.queue.results())[0]['status'],
+                         gradequeue.QUEUED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the test vectors of .npz data files, see
+   gradespec.TestVectors.
+
+   Usage: python -m unittest discover tests
+"""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import sys
+import os
+
+# helper imports
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import numpy
+
+import gradespec
+
+
+class NpzTest(unittest.TestCase):
+    """The rows of 'input' and 'output' as test cases."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='pygrade_spec_')
+        self.path = os.path.join(self.workdir, 'tests.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def vectors(self, arg_types, return_type, save=numpy.savez, **arrays):
+        save(self.path, **arrays)
+        return list(gradespec.TestVectors(self.path,
+                                          ['arg%d' % index for index
+                                           in range(len(arg_types))],
+                                          arg_types, return_type))
+
+    def test_ndarray_argument(self):
+        inputs = numpy.arange(12.0).reshape(3, 4)
+        for save in (numpy.savez, numpy.savez_compressed):
+            vectors = self.vectors(['ndarray[float]'], 'float', save,
+                                   input=inputs, output=inputs.sum(axis=1))
+            self.assertEqual(len(vectors), 3)
+            for index, (tinput, toutput) in enumerate(vectors):
+                self.assertEqual(len(tinput), 1)
+                self.assertTrue(isinstance(tinput[0], numpy.ndarray))
+                self.assertEqual(tinput[0].tolist(), inputs[index].tolist())
+                self.assertEqual(toutput, inputs[index].sum())
+
+    def test_ndarray_output(self):
+        inputs = numpy.arange(6).reshape(3, 2, 1)
+        vectors = self.vectors(['ndarray[integer]'], 'ndarray[integer]',
+                               input=inputs, output=inputs * 2)
+        self.assertEqual([toutput.tolist() for _, toutput in vectors],
+                         (inputs * 2).tolist())
+
+    def test_arguments(self):
+        inputs = numpy.array([[1, 2], [3, 4]])
+        vectors = self.vectors(['integer', 'integer'], 'integer',
+                               input=inputs, output=inputs.sum(axis=1))
+        self.assertEqual(vectors, [((1, 2), 3), ((3, 4), 7)])
+        self.assertTrue(isinstance(vectors[0][0][0], int))
+
+    def test_one_value_argument(self):
+        vectors = self.vectors(['integer'], 'integer',
+                               input=numpy.array([5, 6]),
+                               output=numpy.array([25, 36]))
+        self.assertEqual(vectors, [((5,), 25), ((6,), 36)])
+
+    def test_length_mismatch(self):
+        self.assertRaises(ValueError, self.vectors, ['integer'], 'integer',
+                          input=numpy.array([5, 6]),
+                          output=numpy.array([25]))
+
+    def test_missing_array(self):
+        self.assertRaises(ValueError, self.vectors, ['integer'], 'integer',
+                          input=numpy.array([5, 6]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for the shared memory the big numpy test arrays are handed to
+   the test processes in, see gradeworker.SharedArrays.
+
+   Usage: python -m unittest discover tests
+"""
+
+__author__ = 'Powell Molleti'
+__version__ = '0.1.1'
+
+# system imports
+import sys
+import os
+
+# helper imports
+import logging
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import numpy
+
+import gradepython
+import gradeworker
+
+
+# Test cases, each with an argument twice SHARED_MIN_BYTES.
+TESTS = 8
+ITEMS = gradeworker.SHARED_MIN_BYTES // 4
+
+SPEC = '''
+codespec:
+  filesizelimit: 1
+  language: 'python'
+  function: 'total'
+  argcount: 1
+  argnames:
+    - values
+  argtypes:
+    - ndarray[integer]
+  returntype:
+    - integer
+
+evalspec:
+  grademax: 100
+  testcases:
+    maxhit: 100
+    timeout: 5
+    datafile: 'tests.npz'
+'''
+
+USER_PROG = '''"""
+Keep pylint happy!
+"""
+
+
+def total(values):
+    """
+    Sum of the values.
+    """
+    return int(values.sum())
+'''
+
+
+class StreamedArraysTest(unittest.TestCase):
+    """The arrays of a suite streamed from a data file are let go as the
+       tests run, the shared files do not pile up.
+    """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='pygrade_shared_')
+        self.shared_dir = os.path.join(self.workdir, 'shm')
+        os.mkdir(self.shared_dir)
+        inputs = numpy.array([numpy.arange(ITEMS) + index
+                              for index in range(TESTS)])
+        outputs = numpy.array([int(row.sum()) for row in inputs])
+        numpy.savez(os.path.join(self.workdir, 'tests.npz'),
+                    input=inputs, output=outputs)
+        self.config_spec = os.path.join(self.workdir, 'code_spec.yaml')
+        with open(self.config_spec, 'w') as wfile:
+            wfile.write(SPEC)
+        self.user_prog = os.path.join(self.workdir, 'total.py')
+        with open(self.user_prog, 'w') as wfile:
+            wfile.write(USER_PROG)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def grade(self, overrides):
+        """Grade the submission, the number of shared files each time an
+           array was shared and the grade report.
+        """
+        pygrade = gradepython.PyGrade(self.config_spec, self.user_prog,
+                                      log_level=logging.ERROR,
+                                      testcase_overrides=overrides)
+        shared = gradeworker.SharedArrays(directory=self.shared_dir)
+        pygrade.shared_arrays = shared
+        pygrade.print_report = False
+        counts = []
+        share = shared.share
+
+        def counting_share(tests):
+            share(tests)
+            if tests:       # not the batch program, its tests follow
+                counts.append(len(os.listdir(self.shared_dir)))
+        shared.share = counting_share
+
+        pygrade.run()
+        return counts, pygrade
+
+    def check(self, overrides, in_flight):
+        counts, pygrade = self.grade(overrides)
+        self.assertEqual(len(counts), TESTS)
+        self.assertTrue(max(counts) <= in_flight, counts)
+        self.assertEqual(os.listdir(self.shared_dir), [])
+        self.assertEqual(pygrade.grade_report['grade'], '100.0/100.0')
+
+    def test_process(self):
+        self.check({'mode': 'process'}, 1)
+
+    def test_parallel(self):
+        self.check({'mode': 'process', 'parallelism': 2}, 2)
+
+    def test_batched(self):
+        ahead = gradepython.BATCH_AHEAD
+        gradepython.BATCH_AHEAD = 2
+        try:
+            self.check({'mode': 'batched'}, 3)
+        finally:
+            gradepython.BATCH_AHEAD = ahead
+
+
+if __name__ == '__main__':
+    unittest.main()